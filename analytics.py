@@ -0,0 +1,220 @@
+"""Training load analytics for one user.
+
+The daily load is the number of minutes trained that day. From the
+daily series we compute:
+
+- weekly (ISO week) and monthly volume
+- acute load, the mean daily load over the last 7 days, chronic load
+  over the last 28 days, and their ratio
+- monotony, the mean daily load of the last 7 days divided by its
+  standard deviation, and strain, the 7 day load times monotony
+- minutes per workout type over the last 28 days
+
+The user's workouts are read in one query. With NumPy installed the
+numbers come from a dense daily array, otherwise from plain Python with
+the same results.
+"""
+from __future__ import annotations
+
+from collections import defaultdict
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from db.cache import cached
+from db.workouts import get_user_workout_version, get_workout_series
+
+# NumPy costs a good part of the startup time, it is imported on the
+# first computation instead
+np = None
+_numpy_loaded = False
+
+ACUTE_DAYS = 7
+CHRONIC_DAYS = 28
+SERIES_DAYS = 56
+
+
+def _week_label(monday: date) -> str:
+    year, week, _ = monday.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _load_summary(last_week: Sequence[float], chronic: float) -> Dict:
+    week_total = float(sum(last_week))
+    acute = week_total / ACUTE_DAYS
+    std = (sum((x - acute) ** 2 for x in last_week) / ACUTE_DAYS) ** 0.5
+    monotony = acute / std if std > 0 else None
+    return {
+        "acute": round(acute, 1),
+        "chronic": round(chronic, 1),
+        "ratio": round(acute / chronic, 2) if chronic else None,
+        "monotony": round(monotony, 2) if monotony is not None else None,
+        "strain": round(week_total * monotony, 1) if monotony is not None else None,
+    }
+
+
+def _by_type(totals: Dict[str, int]) -> List[Dict]:
+    return [
+        {"type": t, "minutes": int(m)}
+        for t, m in sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+    ]
+
+
+def _compute_python(rows: Sequence, as_of: date) -> Dict:
+    daily = defaultdict(int)
+    weekly = defaultdict(lambda: [0, 0])
+    monthly = defaultdict(lambda: [0, 0])
+    recent = defaultdict(int)
+    recent_start = as_of - timedelta(days=CHRONIC_DAYS - 1)
+
+    for raw_day, minutes, wtype in rows:
+        try:
+            day = date.fromisoformat(raw_day)
+        except (TypeError, ValueError):
+            continue
+        daily[day] += minutes
+        week = weekly[day - timedelta(days=day.weekday())]
+        week[0] += 1
+        week[1] += minutes
+        month = monthly[day.strftime("%Y-%m")]
+        month[0] += 1
+        month[1] += minutes
+        if recent_start <= day <= as_of:
+            recent[wtype] += minutes
+
+    span = CHRONIC_DAYS + SERIES_DAYS
+    loads = [daily.get(as_of - timedelta(days=i), 0) for i in range(span - 1, -1, -1)]
+
+    series = []
+    for i in range(span - SERIES_DAYS, span):
+        series.append({
+            "date": (as_of - timedelta(days=span - 1 - i)).isoformat(),
+            "load": loads[i],
+            "acute": round(sum(loads[i - ACUTE_DAYS + 1:i + 1]) / ACUTE_DAYS, 1),
+            "chronic": round(sum(loads[i - CHRONIC_DAYS + 1:i + 1]) / CHRONIC_DAYS, 1),
+        })
+
+    return {
+        **_load_summary(loads[-ACUTE_DAYS:], sum(loads[-CHRONIC_DAYS:]) / CHRONIC_DAYS),
+        "series": series,
+        "weekly": [
+            {"week": _week_label(m), "start": m.isoformat(), "count": c, "minutes": t}
+            for m, (c, t) in sorted(weekly.items(), reverse=True)
+        ],
+        "monthly": [
+            {"month": m, "count": c, "minutes": t}
+            for m, (c, t) in sorted(monthly.items(), reverse=True)
+        ],
+        "by_type": _by_type(recent),
+    }
+
+
+def _compute_numpy(rows: Sequence, as_of: date) -> Dict:
+    raw_days, minutes, types = zip(*rows)
+    try:
+        days = np.array(raw_days, dtype="datetime64[D]")
+    except ValueError:
+        # Some dates do not parse, let the slow path skip them
+        return _compute_python(rows, as_of)
+    minutes = np.array(minutes, dtype=np.float64)
+    types = np.array(types, dtype=object)
+    today = np.datetime64(as_of, "D")
+
+    # Dense daily loads for the days the load series needs, zero on rest days
+    span = CHRONIC_DAYS + SERIES_DAYS
+    offsets = (days - (today - (span - 1))).astype(np.int64)
+    inside = (offsets >= 0) & (offsets < span)
+    daily = np.bincount(offsets[inside], weights=minutes[inside], minlength=span)
+
+    # Rolling means from one cumulative sum
+    total = np.concatenate(([0.0], np.cumsum(daily)))
+    acute = (total[ACUTE_DAYS:] - total[:-ACUTE_DAYS]) / ACUTE_DAYS
+    chronic = (total[CHRONIC_DAYS:] - total[:-CHRONIC_DAYS]) / CHRONIC_DAYS
+
+    first = span - SERIES_DAYS
+    series = [
+        {"date": d.isoformat(), "load": int(load), "acute": round(a, 1), "chronic": round(c, 1)}
+        for d, load, a, c in zip(
+            np.arange(today - (SERIES_DAYS - 1), today + 1).tolist(),
+            daily[first:].tolist(),
+            acute[first - ACUTE_DAYS + 1:].tolist(),
+            chronic[first - CHRONIC_DAYS + 1:].tolist(),
+        )
+    ]
+
+    # 1970-01-01 was a Thursday, shift so that Monday is 0
+    weekday = (days.astype(np.int64) + 3) % 7
+    week_starts, week_idx = np.unique(days - weekday, return_inverse=True)
+    week_counts = np.bincount(week_idx)
+    week_minutes = np.bincount(week_idx, weights=minutes)
+
+    month_starts, month_idx = np.unique(days.astype("datetime64[M]"), return_inverse=True)
+    month_counts = np.bincount(month_idx)
+    month_minutes = np.bincount(month_idx, weights=minutes)
+
+    recent = offsets >= span - CHRONIC_DAYS
+    recent &= offsets < span
+    type_names, type_idx = np.unique(types[recent], return_inverse=True)
+    type_minutes = np.bincount(type_idx, weights=minutes[recent], minlength=len(type_names))
+
+    return {
+        **_load_summary(daily[-ACUTE_DAYS:].tolist(), float(chronic[-1])),
+        "series": series,
+        "weekly": [
+            {"week": _week_label(m), "start": m.isoformat(), "count": c, "minutes": int(t)}
+            for m, c, t in zip(
+                week_starts[::-1].tolist(),
+                week_counts[::-1].tolist(),
+                week_minutes[::-1].tolist(),
+            )
+        ],
+        "monthly": [
+            {"month": str(m)[:7], "count": c, "minutes": int(t)}
+            for m, c, t in zip(
+                month_starts[::-1].tolist(),
+                month_counts[::-1].tolist(),
+                month_minutes[::-1].tolist(),
+            )
+        ],
+        "by_type": _by_type(dict(zip(type_names.tolist(), type_minutes.tolist()))),
+    }
+
+
+def load_numpy():
+    """The numpy module, or None when it is not installed"""
+    global np, _numpy_loaded
+    if not _numpy_loaded:
+        try:
+            import numpy
+        except ImportError:  # pragma: no cover - optional speedup
+            numpy = None
+        np = numpy
+        _numpy_loaded = True
+    return np
+
+
+def compute(rows: Sequence, as_of: date, use_numpy: Optional[bool] = None) -> Dict:
+    """Analytics from (date, duration, type) rows, loads are as of as_of"""
+    if use_numpy is None:
+        use_numpy = load_numpy() is not None
+    elif use_numpy:
+        load_numpy()
+
+    if use_numpy and rows:
+        result = _compute_numpy(rows, as_of)
+    else:
+        result = _compute_python(rows, as_of)
+    return {"as_of": as_of.isoformat(), **result}
+
+
+@cached()
+def _cached_training_load(user_id: int, version: int, as_of: str) -> Dict:
+    return compute(get_workout_series(user_id), date.fromisoformat(as_of))
+
+
+def training_load(user_id: int, as_of: Optional[date] = None) -> Dict:
+    """Analytics for one user, cached until one of their workouts changes"""
+    as_of = as_of or date.today()
+    version = get_user_workout_version(user_id)
+    if version is None:
+        return compute(get_workout_series(user_id), as_of)
+    return _cached_training_load(user_id, version, as_of.isoformat())
@@ -0,0 +1,198 @@
+"""JSON API for the mobile client, mounted at /api/v1.
+
+Read-only endpoints on top of the same db functions the HTML pages
+use. Listings take the same cursor and limit parameters as the pages,
+and fields=a,b,c to return only some of the columns. Workout listings
+and stats take from=YYYY-MM-DD and to=YYYY-MM-DD.
+"""
+import json
+from functools import wraps
+
+from flask import Blueprint, abort, current_app, request, session
+
+from analytics import training_load
+from db.categories import list_categories
+from db.messages import list_messages, list_sent_messages
+from db.pagination import page_size
+from db.users import get_user_by_id
+from db.workouts import (
+    WORKOUT_FIELDS,
+    get_user_stats,
+    get_user_stats_by_type,
+    get_workout,
+    list_all_workouts,
+    list_workouts_by_user,
+)
+from forms import parse_date_range
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+MESSAGE_FIELDS = (
+    "id",
+    "content",
+    "unread",
+    "created_at",
+    "sender",
+    "receiver",
+    "workout_id",
+    "workout_type",
+    "workout_date",
+)
+
+# Sort keys the listings select for their cursors, returned only when
+# asked for with fields=
+INTERNAL_FIELDS = ("day",)
+
+
+def dumps(data) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def json_response(data, status=200):
+    return current_app.response_class(dumps(data), status=status, mimetype="application/json")
+
+
+def api_error(e):
+    return json_response({"error": e.name}, e.code)
+
+
+# Registered per code so they win over the app's HTML error pages
+for _code in (400, 401, 403, 404):
+    bp.register_error_handler(_code, api_error)
+
+
+def api_login_required(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if "user_id" not in session:
+            abort(401)
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def requested_fields(allowed):
+    """Parse fields=a,b into a tuple of known names, None means all"""
+    raw = request.args.get("fields")
+    if not raw:
+        return None
+    fields = tuple(f for f in (x.strip() for x in raw.split(",")) if f in allowed)
+    if not fields:
+        abort(400)
+    return fields
+
+
+def page_response(page, fields):
+    items = [dict(row) for row in page["items"]]
+    if fields is not None:
+        items = [{k: item[k] for k in fields if k in item} for item in items]
+    else:
+        items = [
+            {k: v for k, v in item.items() if k not in INTERNAL_FIELDS} for item in items
+        ]
+    return json_response({
+        "items": items,
+        "next_cursor": page["next_cursor"],
+        "prev_cursor": page["prev_cursor"],
+    })
+
+
+@bp.route("/workouts")
+@api_login_required
+def workouts():
+    fields = requested_fields(WORKOUT_FIELDS)
+    date_from, date_to = parse_date_range(request.args)
+    page = list_all_workouts(
+        request.args.get("cursor"),
+        page_size(request.args.get("limit")),
+        fields=fields,
+        date_from=date_from,
+        date_to=date_to,
+    )
+    return page_response(page, fields)
+
+
+@bp.route("/workouts/<int:workout_id>")
+@api_login_required
+def workout(workout_id):
+    row = get_workout(workout_id)
+    if not row:
+        abort(404)
+    return json_response(row)
+
+
+@bp.route("/users/<int:user_id>/workouts")
+@api_login_required
+def user_workouts(user_id):
+    if not get_user_by_id(user_id):
+        abort(404)
+
+    fields = requested_fields(WORKOUT_FIELDS)
+    date_from, date_to = parse_date_range(request.args)
+    page = list_workouts_by_user(
+        user_id,
+        request.args.get("cursor"),
+        page_size(request.args.get("limit")),
+        fields=fields,
+        date_from=date_from,
+        date_to=date_to,
+    )
+    return page_response(page, fields)
+
+
+@bp.route("/users/<int:user_id>/stats")
+@api_login_required
+def user_stats(user_id):
+    if not get_user_by_id(user_id):
+        abort(404)
+
+    date_from, date_to = parse_date_range(request.args)
+    return json_response({
+        **get_user_stats(user_id, date_from, date_to),
+        "by_type": get_user_stats_by_type(user_id, date_from, date_to),
+    })
+
+
+@bp.route("/users/<int:user_id>/analytics")
+@api_login_required
+def user_analytics(user_id):
+    if not get_user_by_id(user_id):
+        abort(404)
+
+    return json_response(training_load(user_id))
+
+
+@bp.route("/categories")
+@api_login_required
+def categories():
+    return json_response({"items": list_categories()})
+
+
+@bp.route("/messages")
+@api_login_required
+def messages():
+    fields = requested_fields(MESSAGE_FIELDS)
+    page = list_messages(
+        session["user_id"],
+        request.args.get("cursor"),
+        page_size(request.args.get("limit")),
+    )
+    return page_response(page, fields)
+
+
+@bp.route("/messages/sent")
+@api_login_required
+def sent_messages():
+    fields = requested_fields(MESSAGE_FIELDS)
+    page = list_sent_messages(
+        session["user_id"],
+        request.args.get("cursor"),
+        page_size(request.args.get("limit")),
+    )
+    return page_response(page, fields)
@@ -1,469 +1,116 @@
+"""Application factory.
+
+Configuration is read in this order, later values winning: the
+defaults below, instance/config.py, FLASK_* environment variables
+(FLASK_SECRET_KEY, FLASK_DATABASE, ...) and the mapping given to
+create_app(). Building the app opens no database connections and
+creates no files, so a server can build it once and fork workers from
+it (gunicorn --preload wsgi:app).
+"""
 import secrets
-import sqlite3
-from functools import wraps
+import time
 from pathlib import Path
 
-from flask import (
-    Flask, abort, flash, g,
-    redirect, render_template,
-    request, session, url_for
-)
+from flask import Flask, g, render_template, session
+from jinja2 import FileSystemBytecodeCache
+
+from api import bp as api_bp
+from commands import register_commands
+from db.connection import close_db
+from db.messages import get_unread_count
+from db.passwords import HashingBusy
+from metrics import bp as metrics_bp
+from profiling import bp as profiling_bp
+from views import auth, messages, search, workouts
+
+DEFAULTS = {
+    "SECRET_KEY": "dev-secret",
+    # None keeps the compiled templates in Jinja's per-user temp
+    # directory, a path uses that directory and False turns it off
+    "JINJA_CACHE_DIR": None,
+}
+
+
+def create_app(config=None):
+    app = Flask(__name__, instance_relative_config=True)
+    app.config.from_mapping(DEFAULTS)
+    app.config.from_pyfile("config.py", silent=True)
+    app.config.from_prefixed_env()
+    if config:
+        app.config.from_mapping(config)
+
+    cache_dir = app.config["JINJA_CACHE_DIR"]
+    if cache_dir is not False:
+        if cache_dir:
+            Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        app.jinja_options = {
+            **app.jinja_options,
+            "bytecode_cache": FileSystemBytecodeCache(cache_dir),
+        }
+
+    app.register_blueprint(auth.bp)
+    app.register_blueprint(workouts.bp)
+    app.register_blueprint(messages.bp)
+    app.register_blueprint(search.bp)
+    app.register_blueprint(api_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(profiling_bp)
+
+    app.before_request(ensure_csrf)
+    app.context_processor(inject_csrf)
+    app.context_processor(inject_unread_count)
+    app.teardown_appcontext(_close_db)
+
+    app.register_error_handler(HashingBusy, handle_hashing_busy)
+    for code in (400, 403, 404):
+        app.register_error_handler(code, handle_error)
+
+    register_commands(app)
+    return app
+
+
+def warm_up(app):
+    """Do the first-request work up front, before the workers are forked.
+
+    Compiles every template and imports the optional modules that are
+    otherwise loaded on first use. Does not touch the database.
+    """
+    from analytics import load_numpy
+
+    for name in app.jinja_env.list_templates():
+        if name.endswith(".html"):
+            app.jinja_env.get_template(name)
+    load_numpy()
 
-from db.categories import (
-    assign_categories_to_workout,
-    list_categories,
-    list_workout_categories,
-)
 
-from db.connection import close_db, init_db
-
-from db.messages import (
-    add_message,
-    get_message,
-    update_message,
-    delete_message_by_id,
-    list_workouts_for_messages,
-    list_messages_full,
-    get_workout_owner,
-)
-
-from db.users import add_user, get_user, verify_password, get_user_by_id
-
-from db.workouts import (
-    add_workout,
-    get_workout,
-    list_workouts,
-    list_all_workouts,
-    list_workouts_by_user,
-    search_workouts,
-    update_workout,
-    delete_workout_by_id,
-    get_user_stats,
-    get_user_stats_by_type,
-)
-
-app = Flask(__name__)
-app.config["SECRET_KEY"] = "dev-secret"
-app.config["DATABASE"] = "instance/app.sqlite3"
-
-
-Path("instance").mkdir(exist_ok=True)
-
-
-@app.before_request
 def ensure_csrf():
     if "csrf_token" not in session:
         session["csrf_token"] = secrets.token_hex(16)
+        session["since"] = int(time.time())
     g.csrf_token = session["csrf_token"]
 
 
-@app.context_processor
 def inject_csrf():
     return {"csrf_token": g.get("csrf_token")}
 
 
-@app.teardown_appcontext
-def _close_db(exc):
-    close_db()
-
-
-@app.cli.command("init-db")
-def init_db_command():
-    init_db("schema.sql")
-    print("Initialized the database.")
-
-
-def validate_csrf():
-    if request.form.get("csrf_token") != session.get("csrf_token"):
-        abort(400)
-
-
-def login_required(fn):
-    @wraps(fn)
-    def wrapper(*args, **kwargs):
-        if "user_id" not in session:
-            flash("Kirjaudu sisään ensin.", "error")
-            return redirect(url_for("login"))
-        return fn(*args, **kwargs)
-    return wrapper
-
-
-def validate_workout_form(form):
-    date = (form.get("date") or "").strip()
-    wtype = (form.get("type") or "").strip()
-    duration_raw = (form.get("duration") or "").strip()
-    description = (form.get("description") or "").strip()
-
-    errors = []
-
-    if not date:
-        errors.append("Päivämäärä vaaditaan.")
-    if not wtype:
-        errors.append("Tyyppi vaaditaan.")
-    if len(wtype) > 50:
-        errors.append("Tyyppi on liian pitkä (max 50).")
-    if len(description) > 1000:
-        errors.append("Kuvaus on liian pitkä (max 1000).")
-
-    try:
-        duration_val = int(duration_raw)
-        if duration_val < 0 or duration_val > 100000:
-            errors.append("Kesto ei kelpaa.")
-    except ValueError:
-        errors.append("Keston tulee olla kokonaisluku.")
-        duration_val = None
-
-    return {
-        "date": date,
-        "type": wtype,
-        "duration": duration_raw,
-        "description": description,
-        "duration_val": duration_val,
-    }, errors
-
-
-@app.route("/")
-@login_required
-def index():
-    workouts = list_workouts(session["user_id"])
-    workouts = [
-        dict(w) | {"categories": list_workout_categories(w["id"])}
-        for w in workouts
-    ]
-    return render_template("index.html", workouts=workouts)
-
-
-@app.route("/register", methods=["GET", "POST"])
-def register():
-    if request.method == "POST":
-        validate_csrf()
-
-        username = (request.form.get("username") or "").strip()
-        password = (request.form.get("password") or "").strip()
-        password2 = (request.form.get("password2") or "").strip()
-
-        if not (3 <= len(username) <= 30):
-            flash("Käyttäjätunnuksen pituus 3–30 merkkiä.", "error")
-            return render_template("register.html")
-
-        if not (8 <= len(password) <= 128):
-            flash("Salasanan pituus 8–128 merkkiä.", "error")
-            return render_template("register.html")
-
-        if password != password2:
-            flash("Salasanat eivät täsmää.", "error")
-            return render_template("register.html")
-
-        if get_user(username):
-            flash("Käyttäjätunnus on jo käytössä.", "error")
-            return render_template("register.html")
-
-        add_user(username, password)
-        flash("Tunnus luotu. Voit nyt kirjautua sisään.", "success")
-        return redirect(url_for("login"))
-
-    return render_template("register.html")
-
-
-@app.route("/login", methods=["GET", "POST"])
-def login():
-    if request.method == "POST":
-        validate_csrf()
-
-        username = (request.form.get("username") or "").strip()
-        password = (request.form.get("password") or "").strip()
-        user = get_user(username)
-
-        if user and verify_password(user, password):
-            session["user_id"] = user["id"]
-            session["username"] = user["username"]
-            flash(f"Tervetuloa, {user['username']}!", "success")
-            return redirect(url_for("index"))
-
-        flash("Virheellinen käyttäjätunnus tai salasana.", "error")
-
-    return render_template("login.html")
-
-
-@app.route("/logout")
-def logout():
-    session.clear()
-    flash("Uloskirjautuminen onnistui.", "success")
-    return redirect(url_for("login"))
-
-
-@app.route("/profile")
-@login_required
-def profile():
-    user = get_user_by_id(session["user_id"])
-    stats = get_user_stats(session["user_id"])
-    stats_by_type = get_user_stats_by_type(session["user_id"])
-    workouts = list_workouts(session["user_id"])
-
-    return render_template(
-        "user.html",
-        user=user,
-        stats=stats,
-        stats_by_type=stats_by_type,
-        workouts=workouts,
-    )
-
-
-@app.route("/messages")
-@login_required
-def messages_route():
-    workouts = list_workouts_for_messages()
-    messages = list_messages_full()
-
-    return render_template(
-        "messages.html",
-        workouts=workouts,
-        messages=messages,
-    )
-
-
-@app.route("/workout/add", methods=["GET", "POST"], endpoint="add_workout")
-@login_required
-def add_workout_route():
-    if request.method == "POST":
-        validate_csrf()
-
-        selected_ids = [
-            int(x) for x in request.form.getlist("categories")
-            if x.isdigit()
-        ]
+def inject_unread_count():
+    if "user_id" not in session:
+        return {}
+    return {"unread_count": get_unread_count(session["user_id"])}
 
-        data, errors = validate_workout_form(request.form)
 
-        if errors:
-            for e in errors:
-                flash(e, "error")
-            return render_template(
-                "workout_form.html",
-                form=data,
-                categories=list_categories(),
-                selected=set(selected_ids),
-            )
-
-        try:
-            wid = add_workout(
-                session["user_id"],
-                data["date"],
-                data["type"],
-                data["duration_val"],
-                data["description"] or None,
-            )
-            assign_categories_to_workout(wid, selected_ids)
-        except sqlite3.IntegrityError:
-            abort(403)
-
-        flash("Treeni lisätty.", "success")
-        return redirect(url_for("index"))
-
-    return render_template(
-        "workout_form.html",
-        form={"date": "", "type": "", "duration": "", "description": ""},
-        categories=list_categories(),
-        selected=set(),
-    )
-
-
-@app.route("/workout/<int:workout_id>/edit", methods=["GET", "POST"])
-@login_required
-def edit_workout(workout_id):
-    workout = get_workout(workout_id)
-
-    if not workout or workout["user_id"] != session["user_id"]:
-        abort(403)
-
-    if request.method == "POST":
-        validate_csrf()
-
-        selected_ids = [
-            int(x) for x in request.form.getlist("categories")
-            if x.isdigit()
-        ]
-
-        data, errors = validate_workout_form(request.form)
-
-        if errors:
-            for e in errors:
-                flash(e, "error")
-            return render_template(
-                "workout_form.html",
-                form=data,
-                categories=list_categories(),
-                selected=set(selected_ids),
-            )
-
-        update_workout(
-            workout_id,
-            session["user_id"],
-            data["date"],
-            data["type"],
-            data["duration_val"],
-            data["description"] or None,
-        )
-
-        assign_categories_to_workout(workout_id, selected_ids)
-
-        flash("Treeni päivitetty.", "success")
-        return redirect(url_for("profile"))
-
-    return render_template(
-        "workout_form.html",
-        form={
-            "date": workout["date"],
-            "type": workout["type"],
-            "duration": workout["duration"],
-            "description": workout["description"] or "",
-        },
-        categories=list_categories(),
-        selected={
-            c["id"] for c in list_workout_categories(workout_id)
-        },
-    )
-
-
-@app.route("/users/<int:user_id>")
-def user_profile(user_id):
-    user = get_user_by_id(user_id)
-
-    if not user:
-        abort(404)
-
-    workouts = list_workouts_by_user(user_id)
-
-    return render_template(
-        "user_profile.html",
-        user=user,
-        workouts=workouts
-    )
-
-
-@app.route("/message/add", methods=["POST"])
-@login_required
-def add_message_route():
-    validate_csrf()
-
-    workout_id = request.form.get("workout_id")
-    content = (request.form.get("content") or "").strip()
-
-    if not workout_id or not workout_id.isdigit() or not content:
-        abort(400)
-
-    owner_row = get_workout_owner(int(workout_id))
-    if not owner_row:
-        abort(400)
-
-    receiver_id = owner_row["user_id"]
-
-    add_message(
-        session["user_id"],
-        receiver_id,
-        int(workout_id),
-        content
-    )
-
-    flash("Viesti lisätty.", "success")
-    return redirect(url_for("messages_route"))
-
-
-@app.route("/message/<int:message_id>/edit", methods=["GET", "POST"])
-@login_required
-def edit_message_route(message_id):
-    message = get_message(message_id)
-
-    if not message or message["sender_id"] != session["user_id"]:
-        abort(403)
-
-    if request.method == "POST":
-        validate_csrf()
-        content = (request.form.get("content") or "").strip()
-
-        if not content:
-            abort(400)
-
-        update_message(message_id, content)
-        flash("Viesti päivitetty.", "success")
-        return redirect(url_for("messages_route"))
-
-    return render_template("edit_message.html", message=message)
-
-
-@app.route("/message/<int:message_id>/delete", methods=["POST"])
-@login_required
-def delete_message_route(message_id):
-    validate_csrf()
-
-    delete_message_by_id(message_id)
-    flash("Viesti poistettu.", "success")
-    return redirect(url_for("messages_route"))
-
-
-@app.route("/workout/<int:workout_id>/delete", methods=["POST"])
-@login_required
-def delete_workout(workout_id):
-    validate_csrf()
-
-    success = delete_workout_by_id(workout_id, session["user_id"])
-
-    if not success:
-        abort(403)
-
-    flash("Treeni poistettu.", "success")
-    return redirect(url_for("profile"))
-
-
-@app.route("/workouts")
-@login_required
-def workouts_all():
-    rows = list_all_workouts()
-
-    items = [
-    {
-        "id": r["id"],
-        "date": r["date"],
-        "type": r["type"],
-        "duration": r["duration"],
-        "description": r["description"],
-        "username": r["username"],
-        "user_id": r["user_id"],
-    }
-    for r in rows
-]
-    return render_template("workouts_all.html", workouts=items)
-
-
-@app.route("/search")
-@login_required
-def search():
-    query = (request.args.get("query") or "").strip()
-    results = []
+def _close_db(exc):
+    close_db()
 
-    if query:
-        rows = search_workouts(query)
-        results = [
-            {
-                "id": r["id"],
-                "date": r["date"],
-                "type": r["type"],
-                "duration": r["duration"],
-                "description": r["description"],
-                "username": r["username"],
-            }
-            for r in rows
-        ]
 
-    return render_template("search.html", results=results, query=query)
+def handle_hashing_busy(e):
+    return render_template("503.html"), 503, {"Retry-After": "1"}
 
 
-@app.errorhandler(400)
-@app.errorhandler(403)
-@app.errorhandler(404)
 def handle_error(e):
     return render_template(f"{e.code}.html"), e.code
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,91 @@
+"""Training load analytics on a long synthetic history, NumPy against plain Python.
+
+Usage: python -m bench.analytics [--years 10] [--per-day 3] [--rounds 20]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+import analytics
+from app import create_app
+from db.connection import close_pools, get_db, init_db
+from db.migrations import migrate
+from db.users import add_user
+from db.workouts import get_workout_series
+from db.writer import close_writers
+
+app = create_app()
+
+TYPES = ("cardio", "voima", "liikkuvuus", "muu")
+
+
+def seed(user_id, years, per_day):
+    rng = random.Random(1)
+    end = date.today()
+    day = end - timedelta(days=365 * years)
+    rows = []
+    while day <= end:
+        for _ in range(rng.randint(0, per_day)):
+            rows.append((user_id, day.isoformat(), rng.choice(TYPES), rng.randint(10, 120)))
+        day += timedelta(days=1)
+
+    db = get_db()
+    db.executemany(
+        "INSERT INTO workouts (user_id, date, type, duration) VALUES (?, ?, ?, ?)",
+        rows,
+    )
+    db.commit()
+    return len(rows)
+
+
+def timed(fn, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--per-day", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config["DATABASE"] = os.path.join(tmp, "bench.sqlite3")
+        with app.app_context():
+            init_db("schema.sql")
+            migrate()
+            user_id = add_user("bench", "bench-password")
+            count = seed(user_id, args.years, args.per_day)
+
+        with app.test_request_context():
+            today = date.today()
+            rows = get_workout_series(user_id)
+
+            print(f"{count} workouts over {args.years} years")
+            query = timed(lambda: get_workout_series(user_id), args.rounds)
+            print(f"series query: {query * 1000:.1f} ms")
+
+            python = timed(lambda: analytics.compute(rows, today, use_numpy=False), args.rounds)
+            print(f"python: {python * 1000:.1f} ms")
+            if analytics.load_numpy() is not None:
+                numpy = timed(lambda: analytics.compute(rows, today, use_numpy=True), args.rounds)
+                print(f"numpy: {numpy * 1000:.1f} ms")
+            else:
+                print("numpy: not installed")
+
+            analytics.training_load(user_id)
+            cached = timed(lambda: analytics.training_load(user_id), args.rounds)
+            print(f"cached training_load: {cached * 1000:.3f} ms")
+
+        close_writers()
+        close_pools()
+
+
+if __name__ == "__main__":
+    main()
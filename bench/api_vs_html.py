@@ -0,0 +1,104 @@
+"""Response size and time of the JSON API against the HTML listings.
+
+Usage: python -m bench.api_vs_html [--workouts 2000] [--limit 50] [--rounds 50]
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+import api
+from app import create_app
+from db.connection import close_pools, init_db
+from db.migrations import migrate
+from db.users import add_user
+from db.workouts import list_all_workouts
+from db.writer import close_writers
+from importer import import_workouts
+
+app = create_app()
+
+TYPES = ("cardio", "voima", "liikkuvuus", "muu")
+
+
+def seed(user_id, count):
+    rng = random.Random(1)
+    records = (
+        (i, {
+            "date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "type": rng.choice(TYPES),
+            "duration": rng.randint(10, 120),
+            "description": "Peruskestävyyslenkki ja venyttelyt " * rng.randint(0, 3),
+        })
+        for i in range(count)
+    )
+    import_workouts(user_id, records)
+
+
+def measure(client, path, rounds):
+    size = 0
+    start = time.perf_counter()
+    for _ in range(rounds):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+        size = len(response.data)
+    return size, (time.perf_counter() - start) / rounds
+
+
+def measure_dumps(fn, items, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(items)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workouts", type=int, default=2000)
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=50)
+    args = parser.parse_args()
+
+    paths = [
+        ("html", f"/workouts?limit={args.limit}"),
+        ("api", f"/api/v1/workouts?limit={args.limit}"),
+        ("api fields", f"/api/v1/workouts?limit={args.limit}&fields=date,type,duration"),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config["DATABASE"] = os.path.join(tmp, "bench.sqlite3")
+        with app.app_context():
+            init_db("schema.sql")
+            migrate()
+            user_id = add_user("bench", "bench-password")
+            seed(user_id, args.workouts)
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+            sess["username"] = "bench"
+
+        print(f"{args.workouts} workouts, page of {args.limit}, {args.rounds} rounds")
+        for name, path in paths:
+            measure(client, path, 1)
+            size, elapsed = measure(client, path, args.rounds)
+            print(f"{name:>10}: {size:>7} bytes, {elapsed * 1000:.2f} ms/request")
+
+        with app.test_request_context():
+            page = list_all_workouts(None, args.limit)
+            items = [dict(row) for row in page["items"]]
+
+        stdlib = lambda data: json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+        rounds = args.rounds * 20
+        print(f"json.dumps: {measure_dumps(stdlib, items, rounds) * 1e6:.0f} us/page")
+        if api.orjson is not None:
+            print(f"orjson.dumps: {measure_dumps(api.orjson.dumps, items, rounds) * 1e6:.0f} us/page")
+
+        close_writers()
+        close_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""Deterministic synthetic database with a given number of workouts.
+
+Usage: python -m bench.datagen OUTPUT [--workouts 100k] [--seed 1]
+
+The same size and seed give the same rows, apart from the password
+salt and the change times in table_versions. Users get workouts with a
+Zipf-like skew, user 1 being the most active, about one user per
+hundred workouts. Dates run over three years up to END_DATE in id
+order, roughly one workout in ten gets comments from other users and
+most of those have been read.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import date, timedelta
+from itertools import accumulate
+
+from app import create_app
+from db.connection import close_pools, init_db
+from db.migrations import migrate
+from db.passwords import hash_password
+from db.search import rebuild_search_index
+from db.writer import close_writers
+
+GENERATOR_VERSION = 1
+END_DATE = date(2025, 12, 31)
+YEARS = 3
+WORKOUTS_PER_USER = 100
+BATCH = 20000
+PASSWORD = "bench-password"
+
+TYPES = (
+    ("juoksu", 30), ("voima", 25), ("cardio", 12), ("pyöräily", 10),
+    ("kävely", 8), ("uinti", 6), ("jooga", 5), ("venyttely", 4),
+)
+# The schema's categories in id order: Juoksu, Pyöräily, Uinti,
+# Kuntosali, Jooga, Kävely, Muu
+TYPE_CATEGORY = {
+    "juoksu": 1, "pyöräily": 2, "uinti": 3, "voima": 4,
+    "jooga": 5, "kävely": 6, "cardio": 7, "venyttely": 7,
+}
+CATEGORY_IDS = range(1, 8)
+WORDS = (
+    "lenkki", "rauhallinen", "kova", "intervalli", "mäki", "polku", "sali",
+    "jalat", "ylävartalo", "selkä", "kevyt", "palauttava", "pitkä", "vauhti",
+    "syke", "matala", "aamu", "ilta", "sade", "aurinko", "metsä", "ranta",
+    "kaveri", "ryhmä", "tekniikka", "kuntopiiri", "venyttely", "liikkuvuus",
+    "maastopyörä", "uimahalli", "allas", "hiihto", "latu", "porrastreeni",
+)
+COMMENTS = (
+    "Hyvä treeni!", "Kova vauhti, hienoa.", "Mikä reitti tämä oli?",
+    "Lähden mukaan ensi kerralla.", "Muista palautua kunnolla.",
+    "Tosi tasainen suoritus.", "Paljonko sykkeet olivat?", "Huikeaa!",
+)
+SIZE_SUFFIXES = {"k": 1000, "m": 1000 ** 2}
+
+
+def parse_size(text: str) -> int:
+    """Read 1000, 100k or 10M"""
+    text = text.strip().lower()
+    factor = SIZE_SUFFIXES.get(text[-1:], 1)
+    digits = text[:-1] if factor > 1 else text
+    return int(float(digits) * factor)
+
+
+def user_count(workouts: int) -> int:
+    return max(3, workouts // WORKOUTS_PER_USER)
+
+
+def _workout_rows(rng, first_id, count, total, users, cum_weights, types, type_weights):
+    first_day = (END_DATE - timedelta(days=365 * YEARS)).toordinal()
+    span = 365 * YEARS
+    owners = rng.choices(users, cum_weights=cum_weights, k=count)
+    kinds = rng.choices(types, weights=type_weights, k=count)
+
+    workouts, categories, messages = [], [], []
+    for n in range(count):
+        workout_id = first_id + n
+        offset = int(span * workout_id / total + rng.uniform(-3, 3))
+        day = date.fromordinal(first_day + min(span, max(0, offset)))
+        kind = kinds[n]
+        description = None
+        if rng.random() < 0.6:
+            description = " ".join(rng.choices(WORDS, k=rng.randint(2, 7))).capitalize()
+        duration = min(300, max(5, int(rng.lognormvariate(3.8, 0.4))))
+        workouts.append((workout_id, owners[n], day.isoformat(), kind, duration, description))
+
+        picked = rng.choices((0, 1, 2), weights=(25, 60, 15))[0]
+        if picked:
+            ids = {TYPE_CATEGORY[kind]}
+            if picked == 2:
+                ids.add(rng.choice(CATEGORY_IDS))
+            categories.extend((workout_id, c) for c in sorted(ids))
+
+        if rng.random() < 0.1:
+            for _ in range(rng.choice((1, 1, 1, 2, 3))):
+                sender = rng.choices(users, cum_weights=cum_weights)[0]
+                if sender == owners[n]:
+                    sender = sender % len(users) + 1
+                sent = f"{day + timedelta(days=rng.randint(0, 2))} {rng.randint(6, 22):02d}:{rng.randint(0, 59):02d}:00"
+                read_at = sent if rng.random() < 0.85 else None
+                messages.append((workout_id, sender, owners[n], rng.choice(COMMENTS), sent, read_at))
+    return workouts, categories, messages
+
+
+def generate(path: str, workouts: int, seed: int = 1, progress=None) -> dict:
+    """Create the database at path, which must not exist yet"""
+    if os.path.exists(path):
+        raise FileExistsError(path)
+
+    with create_app({"DATABASE": path}).app_context():
+        init_db("schema.sql")
+        migrate()
+        rebuild_search_index()
+        password_hash = hash_password(PASSWORD)
+    close_writers()
+    close_pools()
+
+    rng = random.Random(seed)
+    users = list(range(1, user_count(workouts) + 1))
+    cum_weights = list(accumulate(1 / n ** 1.1 for n in users))
+    types = [t for t, _ in TYPES]
+    type_weights = [w for _, w in TYPES]
+
+    conn = sqlite3.connect(path, isolation_level=None)
+    counts = {"users": len(users), "workouts": 0, "workout_categories": 0, "messages": 0}
+    try:
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA cache_size = -200000")
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO users (id, username, password_hash) VALUES (?, ?, ?)",
+            ((u, f"user{u:06d}", password_hash) for u in users),
+        )
+        conn.execute("COMMIT")
+
+        for first in range(1, workouts + 1, BATCH):
+            count = min(BATCH, workouts - first + 1)
+            rows, categories, messages = _workout_rows(
+                rng, first, count, workouts, users, cum_weights, types, type_weights
+            )
+            conn.execute("BEGIN")
+            conn.executemany(
+                """INSERT INTO workouts (id, user_id, date, type, duration, description)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
+            conn.executemany(
+                "INSERT INTO workout_categories (workout_id, category_id) VALUES (?, ?)",
+                categories,
+            )
+            conn.executemany(
+                """INSERT INTO messages (workout_id, sender_id, receiver_id, content, created_at, read_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                messages,
+            )
+            conn.execute("COMMIT")
+            counts["workouts"] += len(rows)
+            counts["workout_categories"] += len(categories)
+            counts["messages"] += len(messages)
+            if progress:
+                progress(counts["workouts"], workouts)
+    finally:
+        conn.close()
+    return counts
+
+
+def cached_database(workouts: int, data_dir: str, seed: int = 1) -> str:
+    """Path of a generated database in data_dir, made on first use"""
+    path = os.path.join(data_dir, f"bench-v{GENERATOR_VERSION}-{workouts}-s{seed}.sqlite3")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        print(f"generating {workouts} workouts into {path}")
+        start = time.perf_counter()
+        tmp = path + ".tmp"
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(tmp + suffix):
+                os.remove(tmp + suffix)
+        generate(tmp, workouts, seed)
+        os.replace(tmp, path)
+        print(f"generated in {time.perf_counter() - start:.1f} s")
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output")
+    parser.add_argument("--workouts", type=parse_size, default="100k")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = generate(
+        args.output,
+        args.workouts,
+        args.seed,
+        progress=lambda done, total: print(f"\r{done}/{total} workouts", end="", flush=True),
+    )
+    print()
+    print(", ".join(f"{n} {table}" for table, n in counts.items()))
+    print(f"{time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
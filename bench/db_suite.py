@@ -0,0 +1,375 @@
+"""Time the public functions of db/ on generated databases of several sizes.
+
+Usage: python -m bench.db_suite [--sizes 1k,100k] [--rounds 20]
+           [--data-dir instance/bench] [--output FILE] [--compare OLD.json]
+
+The databases come from bench.datagen and are kept in --data-dir for the
+next run. Every case reports p50 and p95 over --rounds calls after one
+warm-up call, and the peak Python memory of one more call under
+tracemalloc (SQLite's own page cache is not counted). The query cache is
+off so the queries themselves are measured. Writes are undone after each
+call through the app's own functions, so the databases can be reused.
+
+The results are saved as JSON together with the commit. --compare prints
+the change in p50 against an earlier result file.
+"""
+import argparse
+import inspect
+import json
+import os
+import pkgutil
+import platform
+import sqlite3
+import statistics
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from importlib import import_module
+from typing import Callable, NamedTuple, Optional
+
+import db
+from app import create_app
+from bench.datagen import END_DATE, GENERATOR_VERSION, PASSWORD, cached_database, parse_size
+from db import categories, leaderboard, messages, search, users, workouts
+from db.connection import close_pools, get_db
+from db.writer import close_writers
+
+app = create_app()
+
+HEAVY_ROUNDS = 3
+DEFAULT_THRESHOLD = 1.25
+
+# Public functions that are not timed on their own
+EXCLUDED = {
+    "cache": "query cache plumbing",
+    "connection": "connection plumbing",
+    "instrument": "SQL timing plumbing",
+    "migrations": "schema maintenance",
+    "pagination": "no database access",
+    "passwords": "CPU bound hashing, see bench.login_throughput",
+    "shards": "resharding, needs DB_SHARDS",
+    "writer": "measured through the writes",
+    "categories.sync_workout_categories": "measured through save_workout",
+    "leaderboard.bucket_label": "no database access",
+    "leaderboard.current_bucket": "no database access",
+    "leaderboard.shift_bucket": "no database access",
+    "search.fts5_available": "no database access",
+    "search.to_match_query": "no database access",
+    "users.add_user": "users cannot be deleted, hashing dominates",
+    "workouts.day_number": "no database access",
+}
+
+
+class Case(NamedTuple):
+    name: str
+    call: Callable
+    setup: Optional[Callable] = None
+    undo: Optional[Callable] = None
+    heavy: bool = False
+
+
+class Context:
+    """Ids and values the cases run with, picked from the database"""
+
+    def __init__(self):
+        conn = get_db()
+        self.user = 1
+        self.username = conn.execute("SELECT username FROM users WHERE id = 1").fetchone()[0]
+        self.password_hash = conn.execute(
+            "SELECT password_hash FROM users WHERE id = 1"
+        ).fetchone()[0]
+        self.workout = conn.execute(
+            "SELECT MAX(id) FROM workouts WHERE user_id = ?", (self.user,)
+        ).fetchone()[0]
+        self.thread = conn.execute(
+            """SELECT workout_id FROM messages WHERE receiver_id = ?
+               ORDER BY id DESC LIMIT 1""",
+            (self.user,),
+        ).fetchone()[0]
+        self.message, self.sender, self.content = conn.execute(
+            """SELECT id, sender_id, content FROM messages WHERE receiver_id = ?
+               ORDER BY id DESC LIMIT 1""",
+            (self.user,),
+        ).fetchone()
+        self.workout_ids = [
+            r[0] for r in conn.execute(
+                "SELECT id FROM workouts WHERE user_id = ? ORDER BY id DESC LIMIT 50",
+                (self.user,),
+            )
+        ]
+        self.date_to = END_DATE
+        self.date_from = END_DATE - timedelta(days=30)
+        self.week = leaderboard.current_bucket("week", END_DATE)
+
+
+def _add_workout(ctx):
+    return workouts.add_workout(ctx.user, END_DATE.isoformat(), "juoksu", 45, "Bench lenkki")
+
+
+def _add_message(ctx):
+    return messages.add_message(ctx.sender, ctx.user, ctx.workout, "Bench")
+
+
+def _add_unread(ctx):
+    return [_add_message(ctx) for _ in range(20)]
+
+
+def _delete_messages(ctx, inbox):
+    for message_id in inbox:
+        messages.delete_message_by_id(message_id, ctx.user)
+
+
+CASES = [
+    Case("workouts.list_all_workouts", lambda c: workouts.list_all_workouts()),
+    Case(
+        "workouts.list_all_workouts[range]",
+        lambda c: workouts.list_all_workouts(date_from=c.date_from, date_to=c.date_to),
+    ),
+    Case("workouts.list_workouts", lambda c: workouts.list_workouts(c.user)),
+    Case(
+        "workouts.list_workouts[range]",
+        lambda c: workouts.list_workouts(c.user, c.date_from, c.date_to),
+    ),
+    Case("workouts.list_workouts_by_user", lambda c: workouts.list_workouts_by_user(c.user)),
+    Case("workouts.get_workout", lambda c: workouts.get_workout(c.workout)),
+    Case("workouts.search_workouts", lambda c: workouts.search_workouts("lenkki")),
+    Case("workouts.suggest_workouts", lambda c: workouts.suggest_workouts("juo")),
+    Case("workouts.get_user_stats", lambda c: workouts.get_user_stats(c.user)),
+    Case(
+        "workouts.get_user_stats[range]",
+        lambda c: workouts.get_user_stats(c.user, c.date_from, c.date_to),
+    ),
+    Case("workouts.get_user_stats_by_type", lambda c: workouts.get_user_stats_by_type(c.user)),
+    Case(
+        "workouts.get_user_stats_by_type[range]",
+        lambda c: workouts.get_user_stats_by_type(c.user, c.date_from, c.date_to),
+    ),
+    Case("workouts.get_user_workout_version", lambda c: workouts.get_user_workout_version(c.user)),
+    Case("workouts.get_workout_series", lambda c: workouts.get_workout_series(c.user)),
+    Case(
+        "workouts.add_workout",
+        lambda c: _add_workout(c),
+        undo=lambda c, wid: workouts.delete_workout_by_id(wid, c.user),
+    ),
+    Case(
+        "workouts.save_workout",
+        lambda c: workouts.save_workout(
+            c.user, END_DATE.isoformat(), "juoksu", 45, "Bench lenkki", [1, 6]
+        ),
+        undo=lambda c, wid: workouts.delete_workout_by_id(wid, c.user),
+    ),
+    Case(
+        "workouts.delete_workout_by_id",
+        lambda c, wid: workouts.delete_workout_by_id(wid, c.user),
+        setup=_add_workout,
+    ),
+    Case("workouts.find_user_stats_mismatches", lambda c: workouts.find_user_stats_mismatches(), heavy=True),
+    Case("workouts.rebuild_user_stats", lambda c: workouts.rebuild_user_stats(), heavy=True),
+    Case("messages.list_messages", lambda c: messages.list_messages(c.user)),
+    Case("messages.list_sent_messages", lambda c: messages.list_sent_messages(c.sender)),
+    Case("messages.list_thread", lambda c: messages.list_thread(c.thread, c.user, c.user)),
+    Case("messages.get_message", lambda c: messages.get_message(c.message)),
+    Case("messages.get_unread_count", lambda c: messages.get_unread_count(c.user)),
+    Case("messages.get_workout_owner", lambda c: messages.get_workout_owner(c.workout)),
+    Case(
+        "messages.add_message",
+        lambda c: _add_message(c),
+        undo=lambda c, mid: messages.delete_message_by_id(mid, c.user),
+    ),
+    Case(
+        "messages.delete_message_by_id",
+        lambda c, mid: messages.delete_message_by_id(mid, c.user),
+        setup=_add_message,
+    ),
+    Case(
+        "messages.update_message",
+        lambda c: messages.update_message(c.message, c.content, c.user),
+    ),
+    Case(
+        "messages.mark_read",
+        lambda c, inbox: messages.mark_read(c.user, inbox),
+        setup=_add_unread,
+        undo=lambda c, _, inbox: _delete_messages(c, inbox),
+    ),
+    Case(
+        "messages.mark_thread_read",
+        lambda c, inbox: messages.mark_thread_read(c.user, c.workout, c.user),
+        setup=_add_unread,
+        undo=lambda c, _, inbox: _delete_messages(c, inbox),
+    ),
+    Case("categories.list_categories", lambda c: categories.list_categories()),
+    Case(
+        "categories.list_workout_categories",
+        lambda c: categories.list_workout_categories(c.workout, c.user),
+    ),
+    Case(
+        "categories.list_categories_for_workouts",
+        lambda c: categories.list_categories_for_workouts(c.workout_ids),
+    ),
+    Case("leaderboard.get_leaderboard", lambda c: leaderboard.get_leaderboard("week", c.week)),
+    Case(
+        "leaderboard.get_leaderboard[all,count,category]",
+        lambda c: leaderboard.get_leaderboard("all", "", "count", category_id=1),
+    ),
+    Case("leaderboard.find_leaderboard_mismatches", lambda c: leaderboard.find_leaderboard_mismatches(), heavy=True),
+    Case("leaderboard.rebuild_leaderboards", lambda c: leaderboard.rebuild_leaderboards(), heavy=True),
+    Case("search.search_workouts_fts", lambda c: search.search_workouts_fts("lenkki")),
+    Case("search.rebuild_search_index", lambda c: search.rebuild_search_index(), heavy=True),
+    Case("users.get_user", lambda c: users.get_user(c.username)),
+    Case("users.get_user_by_id", lambda c: users.get_user_by_id(c.user)),
+    Case("users.get_user_with_workouts", lambda c: users.get_user_with_workouts(c.user)),
+    Case("users.list_workouts_by_user", lambda c: users.list_workouts_by_user(c.user)),
+    Case(
+        "users.verify_password",
+        lambda c: users.verify_password(users.get_user(c.username), PASSWORD),
+        heavy=True,
+    ),
+    Case(
+        "users.update_password_hash",
+        lambda c: users.update_password_hash(c.user, c.password_hash),
+    ),
+]
+
+
+def uncovered():
+    """Public functions of db/ that neither have a case nor are excluded"""
+    covered = {case.name.split("[")[0] for case in CASES}
+    missing = []
+    for module_info in pkgutil.iter_modules(db.__path__):
+        module = import_module(f"db.{module_info.name}")
+        if module_info.name in EXCLUDED:
+            continue
+        for name, fn in inspect.getmembers(module, inspect.isfunction):
+            qualified = f"{module_info.name}.{name}"
+            if (
+                not name.startswith("_")
+                and fn.__module__ == module.__name__
+                and qualified not in covered
+                and qualified not in EXCLUDED
+            ):
+                missing.append(qualified)
+    return missing
+
+
+def run_case(case, ctx, rounds):
+    def once(measure):
+        args = (case.setup(ctx),) if case.setup else ()
+        start = time.perf_counter()
+        result = measure(lambda: case.call(ctx, *args))
+        elapsed = time.perf_counter() - start
+        if case.undo:
+            case.undo(ctx, result, *args)
+        return elapsed
+
+    once(lambda fn: fn())
+    times = [once(lambda fn: fn()) for _ in range(min(rounds, HEAVY_ROUNDS) if case.heavy else rounds)]
+
+    peak = []
+
+    def traced(fn):
+        tracemalloc.start()
+        try:
+            return fn()
+        finally:
+            peak.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+
+    once(traced)
+
+    times.sort()
+    return {
+        "rounds": len(times),
+        "p50_ms": statistics.median(times) * 1000,
+        "p95_ms": times[min(len(times) - 1, round(0.95 * (len(times) - 1)))] * 1000,
+        "mean_ms": statistics.fmean(times) * 1000,
+        "peak_kib": peak[0] / 1024,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, threshold):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nagainst {baseline_path} ({baseline.get('commit')}):")
+    slower = 0
+    for size, cases in results["sizes"].items():
+        old_cases = baseline["sizes"].get(size, {})
+        for name, result in cases.items():
+            old = old_cases.get(name)
+            if not old:
+                continue
+            ratio = result["p50_ms"] / old["p50_ms"] if old["p50_ms"] else 1.0
+            mark = "  SLOWER" if ratio > threshold else ""
+            slower += bool(mark)
+            print(f"{size:>9} {name:<48} {old['p50_ms']:9.3f} -> {result['p50_ms']:9.3f} ms  x{ratio:.2f}{mark}")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1k,100k")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--only", help="Run the cases whose name contains this.")
+    parser.add_argument("--data-dir", default="instance/bench")
+    parser.add_argument("--output", help="Default: DATA_DIR/db-<commit>.json")
+    parser.add_argument("--compare", metavar="OLD_JSON")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+
+    missing = uncovered()
+    if missing:
+        print("no case for: " + ", ".join(missing))
+
+    commit = git_commit()
+    results = {
+        "commit": commit,
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "generator": GENERATOR_VERSION,
+        "seed": args.seed,
+        "rounds": args.rounds,
+        "sizes": {},
+    }
+    cases = [c for c in CASES if not args.only or args.only in c.name]
+
+    app.config["QUERY_CACHE"] = False
+    for size in (parse_size(s) for s in args.sizes.split(",")):
+        app.config["DATABASE"] = cached_database(size, args.data_dir, args.seed)
+        print(f"\n{size} workouts")
+        print(f"{'':48} {'p50 ms':>9} {'p95 ms':>9} {'peak KiB':>9}")
+        sized = results["sizes"][str(size)] = {}
+        with app.app_context():
+            ctx = Context()
+            for case in cases:
+                result = sized[case.name] = run_case(case, ctx, args.rounds)
+                print(
+                    f"{case.name:<48} {result['p50_ms']:9.3f} {result['p95_ms']:9.3f} "
+                    f"{result['peak_kib']:9.1f}"
+                )
+        close_writers()
+        close_pools()
+
+    output = args.output or os.path.join(args.data_dir, f"db-{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nsaved {output}")
+
+    if args.compare:
+        compare(results, args.compare, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+"""Concurrent end-to-end load test of the HTML routes on a generated database.
+
+Usage: python -m bench.load_test [--workouts 100k] [--concurrency 1,4,16,64]
+           [--duration 10] [--server threads|processes] [--mix index=15,...]
+           [--set DB_WRITE_QUEUE=false] [--output FILE]
+
+The app is served from a child process by Werkzeug, with a thread per
+connection or a forked process per connection (at most --processes at
+a time), on a copy of a bench.datagen database. Every virtual user logs
+in as a generated user, its own while there are enough of them, over a
+keep-alive connection. It keeps its session cookie and CSRF token and
+replays the mix of requests without think time. For each concurrency
+level the throughput, latency percentiles and errors are reported,
+"database is locked" separately. The level after which throughput
+stops growing by --saturation is reported as the saturation point.
+
+The virtual users are threads of this process. Keep an eye on its CPU
+use at high concurrency, past that point the client is what saturates.
+"""
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import re
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import quote, urlencode
+
+from bench.datagen import (
+    COMMENTS,
+    END_DATE,
+    PASSWORD,
+    TYPES,
+    WORDS,
+    cached_database,
+    parse_size,
+)
+
+DEFAULT_MIX = "index=15,workouts=25,search=15,profile=15,add_workout=15,add_message=15"
+DEFAULT_SATURATION = 1.1
+LOCKED = "database is locked"
+LOGIN_ATTEMPTS = 5
+
+_CSRF = re.compile(r'name="csrf_token" value="([^"]+)"')
+
+
+class ErrorTagger:
+    """Report the exception behind a 500 in a response header.
+
+    The app runs with PROPAGATE_EXCEPTIONS so errors reach this wrapper
+    instead of Flask's error page.
+    """
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        try:
+            return self.wsgi_app(environ, start_response)
+        except Exception as e:
+            kind = LOCKED if LOCKED in str(e) else type(e).__name__
+            start_response(
+                "500 INTERNAL SERVER ERROR",
+                [("Content-Type", "text/plain"), ("X-Load-Error", kind)],
+            )
+            return [kind.encode()]
+
+
+def serve(database, config, mode, processes, ready):
+    from werkzeug.serving import make_server
+
+    from app import create_app
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    app = create_app(dict(config, DATABASE=database, PROPAGATE_EXCEPTIONS=True))
+    server = make_server(
+        "127.0.0.1",
+        0,
+        ErrorTagger(app),
+        threaded=mode == "threads",
+        processes=processes if mode == "processes" else 1,
+    )
+    ready.send(server.server_port)
+    server.serve_forever()
+
+
+class Session:
+    """A logged-in browser: one keep-alive connection and its cookies"""
+
+    def __init__(self, port):
+        self.port = port
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        self.cookies = {}
+        self.csrf_token = None
+
+    def request(self, method, path, form=None):
+        headers = {}
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+        body = None
+        if form is not None:
+            body = urlencode(form, doseq=True)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, body, headers)
+            response = self.conn.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            self.conn.close()
+            return None, b"", time.perf_counter() - start, type(e).__name__
+        elapsed = time.perf_counter() - start
+
+        for header in response.headers.get_all("Set-Cookie") or []:
+            name, _, value = header.split(";", 1)[0].partition("=")
+            if value and "Max-Age=0" not in header:
+                self.cookies[name.strip()] = value
+            else:
+                self.cookies.pop(name.strip(), None)
+        return response.status, data, elapsed, response.getheader("X-Load-Error")
+
+    def login(self, username):
+        for _ in range(LOGIN_ATTEMPTS):
+            status, data, _, _ = self.request("GET", "/login")
+            match = _CSRF.search(data.decode("utf-8", "replace"))
+            if status != 200 or not match:
+                continue
+            self.csrf_token = match.group(1)
+            status, _, _, _ = self.request(
+                "POST",
+                "/login",
+                {"csrf_token": self.csrf_token, "username": username, "password": PASSWORD},
+            )
+            if status == 302:
+                return
+            # 503 while the password hashing pool is full
+            time.sleep(1)
+        raise RuntimeError(f"could not log in as {username}")
+
+    def close(self):
+        self.conn.close()
+
+
+def _get(path):
+    return lambda session, rng, db_info: session.request("GET", path(rng) if callable(path) else path)
+
+
+def _add_workout(session, rng, db_info):
+    kind = rng.choice(TYPES)[0]
+    return session.request("POST", "/workout/add", {
+        "csrf_token": session.csrf_token,
+        "date": (END_DATE - timedelta(days=rng.randint(0, 60))).isoformat(),
+        "type": kind,
+        "duration": str(rng.randint(15, 120)),
+        "description": " ".join(rng.choices(WORDS, k=4)).capitalize(),
+        "categories": [str(rng.randint(1, 7))],
+    })
+
+
+def _add_message(session, rng, db_info):
+    return session.request("POST", "/message/add", {
+        "csrf_token": session.csrf_token,
+        "workout_id": str(rng.randint(1, db_info["max_workout_id"])),
+        "content": rng.choice(COMMENTS),
+    })
+
+
+# action: (method, call), GETs must answer 200 and form posts redirect
+ACTIONS = {
+    "index": ("GET", _get("/")),
+    "workouts": ("GET", _get("/workouts")),
+    "search": ("GET", _get(lambda rng: "/search?query=" + quote(rng.choice(WORDS)))),
+    "profile": ("GET", _get("/profile")),
+    "add_workout": ("POST", _add_workout),
+    "add_message": ("POST", _add_message),
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise argparse.ArgumentTypeError(f"unknown action {name}, choose from {', '.join(ACTIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_setting(text):
+    key, sep, value = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError("use KEY=VALUE")
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+
+def classify(method, status, error):
+    if error:
+        return error
+    if status is None:
+        return "connection"
+    if method == "GET" and status in (200, 304):
+        return None
+    if method == "POST" and status == 302:
+        return None
+    if method == "POST" and status == 200:
+        return "form rejected"
+    return str(status)
+
+
+def run_stage(sessions, mix, duration, db_info, seed):
+    names = list(mix)
+    weights = [mix[n] for n in names]
+    records = [[] for _ in sessions]
+    start_barrier = threading.Barrier(len(sessions) + 1)
+    deadline = [0.0]
+
+    def user(index):
+        rng = random.Random(seed * 1000003 + index)
+        out = records[index]
+        start_barrier.wait()
+        while time.perf_counter() < deadline[0]:
+            name = rng.choices(names, weights)[0]
+            method, call = ACTIONS[name]
+            status, _, elapsed, error = call(sessions[index], rng, db_info)
+            out.append((name, elapsed, classify(method, status, error)))
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(len(sessions))]
+    for t in threads:
+        t.start()
+    deadline[0] = time.perf_counter() + duration
+    start_barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    return [r for rs in records for r in rs], elapsed
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))]
+
+
+def summarize(records, elapsed):
+    latencies = sorted(r[1] for r in records)
+    errors = Counter(r[2] for r in records if r[2])
+    return {
+        "requests": len(records),
+        "throughput": len(records) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "error_rate": sum(errors.values()) / len(records) if records else 0.0,
+        "locked": errors.get(LOCKED, 0),
+        "errors": dict(errors),
+    }
+
+
+def database_info(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        max_workout_id = conn.execute("SELECT MAX(id) FROM workouts").fetchone()[0]
+        usernames = [r[0] for r in conn.execute("SELECT username FROM users ORDER BY id")]
+    finally:
+        conn.close()
+    return {"max_workout_id": max_workout_id, "usernames": usernames}
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError("the server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workouts", type=parse_size, default="100k")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--data-dir", default="instance/bench")
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32,64")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per level.")
+    parser.add_argument("--server", choices=("threads", "processes"), default="threads")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 4,
+                        help="Most forked connection handlers at a time with --server processes.")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--set", dest="config", type=parse_setting, action="append", default=[],
+                        metavar="KEY=VALUE", help="App config for the server, value as JSON.")
+    parser.add_argument("--saturation", type=float, default=DEFAULT_SATURATION,
+                        help="Growth in throughput a level must reach, e.g. 1.1 for 10%%.")
+    parser.add_argument("--by-action", action="store_true")
+    parser.add_argument("--output", help="Save the results as JSON.")
+    args = parser.parse_args()
+
+    levels = [int(n) for n in args.concurrency.split(",")]
+    source = cached_database(args.workouts, args.data_dir, args.seed)
+    db_info = database_info(source)
+    rng = random.Random(args.seed)
+    usernames = rng.sample(db_info["usernames"], min(max(levels), len(db_info["usernames"])))
+
+    results = {
+        "workouts": args.workouts,
+        "server": args.server,
+        "processes": args.processes if args.server == "processes" else 1,
+        "mix": args.mix,
+        "config": dict(args.config),
+        "duration": args.duration,
+        "levels": [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "load.sqlite3")
+        shutil.copyfile(source, database)
+
+        receive, send = multiprocessing.Pipe(duplex=False)
+        server = multiprocessing.Process(
+            target=serve,
+            args=(database, dict(args.config), args.server, args.processes, send),
+            daemon=True,
+        )
+        server.start()
+        port = receive.recv()
+        wait_for_port(port)
+
+        sessions = []
+        try:
+            print(f"{args.workouts} workouts, {args.server} server, {args.duration:.0f} s per level")
+            print(f"{'users':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>8} {'locked':>7}")
+            for level in levels:
+                while len(sessions) < level:
+                    session = Session(port)
+                    session.login(usernames[len(sessions) % len(usernames)])
+                    sessions.append(session)
+
+                records, elapsed = run_stage(sessions[:level], args.mix, args.duration, db_info, args.seed)
+                summary = summarize(records, elapsed)
+                summary["concurrency"] = level
+                summary["actions"] = {
+                    name: summarize([r for r in records if r[0] == name], elapsed)
+                    for name in args.mix
+                }
+                results["levels"].append(summary)
+                print(
+                    f"{level:>6} {summary['throughput']:>9.1f} {summary['p50_ms']:>9.1f} "
+                    f"{summary['p95_ms']:>9.1f} {summary['p99_ms']:>9.1f} "
+                    f"{summary['error_rate']:>7.1%} {summary['locked']:>7}"
+                )
+                if summary["errors"]:
+                    print("       " + ", ".join(f"{k}: {v}" for k, v in summary["errors"].items()))
+                if args.by_action:
+                    for name, action in summary["actions"].items():
+                        print(
+                            f"       {name:<12} {action['throughput']:>8.1f}/s "
+                            f"p50 {action['p50_ms']:.1f} ms p95 {action['p95_ms']:.1f} ms "
+                            f"errors {action['error_rate']:.1%}"
+                        )
+        finally:
+            for session in sessions:
+                session.close()
+            server.terminate()
+            server.join()
+
+    best = None
+    for level in results["levels"]:
+        if best is not None and level["throughput"] < best["throughput"] * args.saturation:
+            results["saturation"] = best["concurrency"]
+            print(
+                f"\nsaturated at {best['concurrency']} users, {best['throughput']:.1f} req/s: "
+                f"{level['concurrency']} users gave {level['throughput']:.1f} req/s"
+            )
+            break
+        best = level
+    else:
+        results["saturation"] = None
+        print("\nthroughput still grew at the highest level")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Login throughput and latency at the configured password hashing cost.
+
+Usage: python -m bench.login_throughput [--clients 8] [--logins 20]
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from app import create_app
+from db.connection import close_pools, init_db
+from db.migrations import migrate
+from db.passwords import DEFAULT_COST
+from db.users import add_user
+from db.writer import close_writers
+
+app = create_app()
+
+
+def login(client):
+    client.get("/login")
+    with client.session_transaction() as sess:
+        token = sess["csrf_token"]
+    return client.post(
+        "/login",
+        data={"csrf_token": token, "username": "bench", "password": "bench-password"},
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--logins", type=int, default=20)
+    args = parser.parse_args()
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        for _ in range(args.logins):
+            start = time.perf_counter()
+            response = login(client)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config["DATABASE"] = os.path.join(tmp, "bench.sqlite3")
+        with app.app_context():
+            init_db("schema.sql")
+            migrate()
+            add_user("bench", "bench-password")
+
+        threads = [threading.Thread(target=worker) for _ in range(args.clients)]
+        start = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        total = time.perf_counter() - start
+
+        close_writers()
+        close_pools()
+
+    cost = dict(DEFAULT_COST, **app.config.get("PASSWORD_SCRYPT_COST", {}))
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"scrypt n={cost['n']} r={cost['r']} p={cost['p']}, {args.clients} clients")
+    print(f"logins/s: {len(latencies) / total:.1f}")
+    print(f"p50: {statistics.median(latencies) * 1000:.0f} ms, p99: {p99 * 1000:.0f} ms")
+    print(f"status codes: {statuses}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Cost of the request and SQL metrics: the same pages with METRICS off and on.
+
+Usage: python -m bench.metrics_overhead [--workouts 2000] [--rounds 200]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from app import create_app
+from db.connection import close_pools, init_db
+from db.migrations import migrate
+from db.users import add_user
+from db.writer import close_writers
+from importer import import_workouts
+from metrics import registry
+
+app = create_app()
+
+TYPES = ("cardio", "voima", "liikkuvuus", "muu")
+PATHS = ("/", "/workouts", "/profile", "/api/v1/workouts")
+
+
+def seed(user_id, count):
+    rng = random.Random(1)
+    records = (
+        (i, {
+            "date": f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "type": rng.choice(TYPES),
+            "duration": rng.randint(10, 120),
+        })
+        for i in range(count)
+    )
+    import_workouts(user_id, records)
+
+
+def measure(client, path, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        response = client.get(path)
+        assert response.status_code == 200, (path, response.status_code)
+    return (time.perf_counter() - start) / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workouts", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config["DATABASE"] = os.path.join(tmp, "bench.sqlite3")
+        # Every request runs its queries instead of hitting the cache
+        app.config["QUERY_CACHE"] = False
+        with app.app_context():
+            init_db("schema.sql")
+            migrate()
+            user_id = add_user("bench", "bench-password")
+            seed(user_id, args.workouts)
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["user_id"] = user_id
+            sess["username"] = "bench"
+
+        for path in PATHS:
+            timings = {}
+            for enabled in (False, True, False, True):
+                app.config["METRICS"] = enabled
+                measure(client, path, 5)
+                timings.setdefault(enabled, []).append(measure(client, path, args.rounds))
+            off, on = min(timings[False]), min(timings[True])
+            print(
+                f"{path:20} off {off * 1000:.3f} ms  on {on * 1000:.3f} ms  "
+                f"({(on - off) / off * 100:+.1f}%)"
+            )
+
+        registry.clear()
+        close_writers()
+        close_pools()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Cold start: time from a fresh interpreter to the first responses.
+
+Usage: python -m bench.startup [--runs 15] [--no-bytecode-cache]
+
+Every run is a new process. "factory" imports the app and calls
+create_app(), "preload" imports wsgi, which also compiles the templates
+and imports numpy the way a gunicorn --preload master does before
+forking. The times are cumulative from the start of the process: app
+built, first /login answered, then /workouts and /profile as a logged
+in user. The Jinja bytecode cache lives in a temporary directory that
+the first run fills.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from app import create_app
+from db.connection import close_pools, get_db, init_db
+from db.migrations import migrate
+from db.writer import close_writers
+
+STEPS = ("app built", "first /login", "then /workouts", "then /profile")
+
+CHILD = r"""
+import json, sys, time
+start = time.perf_counter()
+if sys.argv[1] == "preload":
+    from wsgi import app
+else:
+    from app import create_app
+    app = create_app()
+times = [time.perf_counter() - start]
+
+client = app.test_client()
+for path in ("/login", "/workouts", "/profile"):
+    response = client.get(path)
+    assert response.status_code == 200, (path, response.status_code)
+    times.append(time.perf_counter() - start)
+    if path == "/login":
+        with client.session_transaction() as sess:
+            sess["user_id"] = 1
+print(json.dumps(times))
+"""
+
+
+def prepare(path):
+    with create_app({"DATABASE": path}).app_context():
+        init_db("schema.sql")
+        migrate()
+        with open("seed.sql", encoding="utf-8") as f:
+            get_db().executescript(f.read())
+        get_db().commit()
+    close_writers()
+    close_pools()
+
+
+def measure(mode, runs, env):
+    results = []
+    for _ in range(runs):
+        done = subprocess.run(
+            [sys.executable, "-c", CHILD, mode],
+            env=env, capture_output=True, text=True, check=True,
+        )
+        results.append(json.loads(done.stdout))
+    return [statistics.median(r[i] for r in results) * 1000 for i in range(len(STEPS))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=15)
+    parser.add_argument("--no-bytecode-cache", action="store_true")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, "bench.sqlite3")
+        prepare(database)
+        env = dict(
+            os.environ,
+            FLASK_DATABASE=database,
+            FLASK_JINJA_CACHE_DIR="false" if args.no_bytecode_cache else os.path.join(tmp, "jinja"),
+        )
+
+        print(f"{'mode':<9}" + "".join(f"{step:>16}" for step in STEPS))
+        for mode in ("factory", "preload"):
+            times = measure(mode, args.runs, env)
+            print(f"{mode:<9}" + "".join(f"{t:13.1f} ms" for t in times))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Write throughput with N concurrent writers, with and without the writer queue.
+
+Usage: python -m bench.write_throughput [--writers 1,4,16] [--rows 200]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from app import create_app
+from db.connection import close_pools, init_db
+from db.migrations import migrate
+from db.users import add_user
+from db.workouts import add_workout
+from db.writer import close_writers
+
+app = create_app()
+
+
+def run(writers, rows, queued):
+    app.config["DB_WRITE_QUEUE"] = queued
+    errors = []
+
+    def worker(user_id):
+        with app.app_context():
+            for i in range(rows):
+                try:
+                    add_workout(user_id, "2026-01-01", "juoksu", 30 + i % 60, None)
+                except sqlite3.OperationalError as e:
+                    errors.append(str(e))
+
+    with app.app_context():
+        user_ids = [add_user(f"bench-{writers}-{queued}-{n}", "password") for n in range(writers)]
+
+    threads = [threading.Thread(target=worker, args=(uid,)) for uid in user_ids]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    total = writers * rows - len(errors)
+    return total / elapsed, len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", default="1,4,16")
+    parser.add_argument("--rows", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.config["DATABASE"] = os.path.join(tmp, "bench.sqlite3")
+        with app.app_context():
+            init_db("schema.sql")
+            migrate()
+
+        print(f"{'writers':>8} {'direct rows/s':>14} {'errors':>7} {'queued rows/s':>14} {'errors':>7}")
+        for writers in (int(n) for n in args.writers.split(",")):
+            direct, direct_errors = run(writers, args.rows, queued=False)
+            queued, queued_errors = run(writers, args.rows, queued=True)
+            print(f"{writers:>8} {direct:>14.0f} {direct_errors:>7} {queued:>14.0f} {queued_errors:>7}")
+
+        close_writers()
+        close_pools()
+
+
+if __name__ == "__main__":
+    main()
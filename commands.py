@@ -0,0 +1,405 @@
+"""`flask` commands for maintenance, imports and the query checks."""
+import contextvars
+import os
+import tempfile
+import time
+from datetime import date
+from pathlib import Path
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from db.connection import (
+    close_db,
+    close_pools,
+    data_paths,
+    database_path,
+    init_db,
+    shard_paths,
+    use_database,
+)
+from db.leaderboard import (
+    METRICS,
+    current_bucket,
+    find_leaderboard_mismatches,
+    get_leaderboard,
+    rebuild_leaderboards,
+)
+from db.messages import (
+    add_message,
+    get_unread_count,
+    list_messages,
+    list_sent_messages,
+    list_thread,
+)
+from db.migrations import explain, migrate, unindexed_steps
+from db.pagination import encode_cursor
+from db.search import rebuild_search_index
+from db.shards import find_missing_replicas, prepare_shard, replicate_user, reshard
+from db.users import add_user, get_user
+from db.workouts import (
+    find_user_stats_mismatches,
+    get_user_stats,
+    get_user_stats_by_type,
+    get_user_workout_version,
+    get_workout_series,
+    list_all_workouts,
+    list_workouts,
+    list_workouts_by_user,
+    rebuild_user_stats,
+    save_workout,
+    suggest_workouts,
+)
+from db.writer import close_writers
+from exporter import FORMATS as EXPORT_FORMATS, export_user
+from importer import DEFAULT_BATCH_SIZE, FORMATS, detect_format, import_workouts, iter_records
+from profiling import DEFAULT_TOKEN_TTL, PROFILE_HEADER, SORT_KEYS, hotspots, profile_dir
+from profiling import sign as sign_profile_request
+
+
+def register_commands(app):
+    for command in COMMANDS:
+        app.cli.add_command(command)
+
+
+def each_database():
+    """Run the body of a maintenance command once for every database file"""
+    paths = data_paths()
+    for path in paths:
+        with use_database(path):
+            if len(paths) > 1:
+                print(f"{path}:")
+            yield path
+
+
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    # The database files and their directories may not exist yet
+    Path(database_path()).parent.mkdir(parents=True, exist_ok=True)
+    init_db("schema.sql")
+    migrate()
+    rebuild_search_index()
+    for path in shard_paths():
+        prepare_shard(path, fresh=True)
+    print("Initialized the database.")
+
+
+@click.command("migrate")
+@with_appcontext
+def migrate_command():
+    for _ in each_database():
+        applied = migrate()
+        for name in applied:
+            print(f"Applied {name}")
+        if not applied:
+            print("Database is up to date.")
+
+
+@click.command("rebuild-stats")
+@with_appcontext
+def rebuild_stats_command():
+    for _ in each_database():
+        rebuild_user_stats()
+    print("Rebuilt the user statistics.")
+
+
+@click.command("check-stats")
+@with_appcontext
+def check_stats_command():
+    """Check the statistics rollups and copy users missing from shards."""
+    failed = False
+    for _ in each_database():
+        failed = _check_stats() or failed
+
+    missing = find_missing_replicas()
+    for path, user_id, username in missing:
+        print(f"FAIL user {user_id} missing from {path}, copied it there")
+        replicate_user(user_id, username, [path])
+    failed = failed or bool(missing)
+    if failed:
+        raise SystemExit(1)
+    print("Statistics match the workouts table.")
+
+
+def _check_stats():
+    mismatches = find_user_stats_mismatches()
+    for m in mismatches:
+        print(
+            f"FAIL user {m['user_id']} type {m['type'] or '(total)'}: "
+            f"expected {m['expected_count']}/{m['expected_minutes']}, "
+            f"got {m['actual_count']}/{m['actual_minutes']}"
+        )
+
+    board_mismatches = find_leaderboard_mismatches()
+    for m in board_mismatches:
+        print(
+            f"FAIL leaderboard {m['period']} {m['bucket'] or '(all)'} "
+            f"category {m['category_id']} user {m['user_id']}: "
+            f"expected {m['expected_count']}/{m['expected_minutes']}, "
+            f"got {m['actual_count']}/{m['actual_minutes']}"
+        )
+
+    return bool(mismatches or board_mismatches)
+
+
+@click.command("rebuild-leaderboards")
+@with_appcontext
+def rebuild_leaderboards_command():
+    for _ in each_database():
+        rebuild_leaderboards()
+    print("Rebuilt the leaderboards.")
+
+
+@click.command("reshard")
+@click.argument("count", type=click.IntRange(min=0))
+@with_appcontext
+def reshard_command(count):
+    """Spread users over COUNT shard files, 0 moves them back to DATABASE."""
+    migrate()
+
+    def on_move(user_id, source, target):
+        click.echo(f"user {user_id}: {source} -> {target}")
+
+    moved = reshard(count, on_move)
+    click.echo(f"Moved {moved} users.")
+    click.echo(f"Set DB_SHARDS = {count} and restart the app.")
+
+
+@click.command("import-workouts")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--user", "username", required=True, help="Owner of the workouts.")
+@click.option("--format", "fmt", type=click.Choice(FORMATS), help="Default: from the file name.")
+@click.option("--batch-size", default=DEFAULT_BATCH_SIZE, show_default=True)
+@with_appcontext
+def import_workouts_command(path, username, fmt, batch_size):
+    """Import workouts from a CSV or NDJSON file."""
+    user = get_user(username)
+    if not user:
+        raise click.BadParameter(f"no such user: {username}", param_hint="--user")
+
+    fmt = fmt or detect_format(path)
+    if not fmt:
+        raise click.BadParameter("cannot tell the format, use --format", param_hint="PATH")
+
+    def on_error(line_no, errors):
+        click.echo(f"line {line_no}: {' '.join(errors)}", err=True)
+
+    def on_progress(imported, rejected):
+        click.echo(f"{imported} imported, {rejected} rejected")
+
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        imported, rejected = import_workouts(
+            user["id"],
+            iter_records(f, fmt),
+            batch_size=batch_size,
+            on_error=on_error,
+            on_progress=on_progress,
+        )
+    click.echo(f"Done: {imported} imported, {rejected} rejected.")
+
+
+@click.command("export-user")
+@click.argument("output", type=click.Path(dir_okay=False, allow_dash=True))
+@click.option("--user", "username", required=True)
+@click.option("--format", "fmt", type=click.Choice(EXPORT_FORMATS), default="ndjson", show_default=True)
+@with_appcontext
+def export_user_command(output, username, fmt):
+    """Export a user's workouts and messages, gzipped if OUTPUT ends with .gz."""
+    user = get_user(username)
+    if not user:
+        raise click.BadParameter(f"no such user: {username}", param_hint="--user")
+
+    with click.open_file(output, "wb") as f:
+        for chunk in export_user(user["id"], fmt, compress=output.endswith(".gz")):
+            f.write(chunk)
+
+
+@click.command("profile-token")
+@click.argument("path")
+@click.option("--ttl", default=DEFAULT_TOKEN_TTL, show_default=True, help="Seconds the header is valid.")
+@with_appcontext
+def profile_token_command(path, ttl):
+    """Print a header that makes the app profile requests to PATH."""
+    secret = current_app.config.get("PROFILE_SECRET")
+    if not secret:
+        raise click.UsageError("PROFILE_SECRET is not set")
+    click.echo(f"{PROFILE_HEADER}: {sign_profile_request(secret, path, int(time.time()) + ttl)}")
+
+
+@click.command("profile-report")
+@click.option("--endpoint", help="Only this endpoint.")
+@click.option("--top", default=15, show_default=True)
+@click.option("--sort", type=click.Choice(SORT_KEYS), default="tottime", show_default=True)
+@with_appcontext
+def profile_report_command(endpoint, top, sort):
+    """Show the top hotspots of the saved profiles by endpoint."""
+    root = profile_dir()
+    if not root.is_dir():
+        click.echo(f"No profiles in {root}.")
+        return
+
+    for entry in hotspots(root, endpoint, top, sort):
+        click.echo(
+            f"{entry['endpoint']}: {entry['profiles']} profiles, "
+            f"{entry['total']:.1f} ms per request"
+        )
+        click.echo(f"{'tottime ms':>11} {'cumtime ms':>11} {'calls':>9}  function")
+        for row in entry["functions"]:
+            click.echo(
+                f"{row['tottime']:11.2f} {row['cumtime']:11.2f} {row['calls']:9.1f}  {row['function']}"
+            )
+        click.echo()
+
+
+@click.command("check-query-plans")
+@with_appcontext
+def check_query_plans_command():
+    """Check that the hot listing queries are served from indexes."""
+    config = current_app.config
+    statements = []
+    older_workouts = encode_cursor("next", [9999999, 0])
+    older_messages = encode_cursor("next", ["9999-12-31 00:00:00", 0])
+    range_from, range_to = date(2026, 1, 1), date(2026, 1, 31)
+
+    close_db()
+    config["SQL_TRACE_CALLBACK"] = statements.append
+    try:
+        list_workouts(1)
+        list_workouts(1, range_from, range_to)
+        list_workouts_by_user(1, older_workouts)
+        list_workouts_by_user(1, older_workouts, date_from=range_from)
+        list_all_workouts()
+        list_all_workouts(older_workouts)
+        list_all_workouts(date_from=range_from, date_to=range_to)
+        list_messages(1)
+        list_messages(1, older_messages)
+        list_sent_messages(1, older_messages)
+        list_thread(1, 1, 1)
+        get_unread_count(1)
+        get_user_stats(1)
+        get_user_stats_by_type(1)
+        get_user_stats(1, range_from, range_to)
+        get_user_stats_by_type(1, range_from, range_to)
+        suggest_workouts("")
+        suggest_workouts("2026-01")
+        suggest_workouts("v")
+        suggest_workouts("a")
+        suggest_workouts("a", user_lookups=0)
+        get_workout_series(1)
+        get_user_workout_version(1)
+        for metric in METRICS:
+            get_leaderboard("week", current_bucket("week"), metric)
+            get_leaderboard("all", "", metric, category_id=1)
+    finally:
+        config.pop("SQL_TRACE_CALLBACK", None)
+        close_db()
+
+    failed = False
+    for sql in statements:
+        if not sql.lstrip().upper().startswith("SELECT"):
+            continue
+        plan = explain(sql)
+        bad = unindexed_steps(sql, plan)
+        failed = failed or bool(bad)
+        print(("FAIL " if bad else "OK   ") + " ".join(sql.split())[:100])
+        for step in plan:
+            print(f"       {step}")
+
+    if failed:
+        raise SystemExit(1)
+
+
+@click.command("rebuild-search-index")
+@with_appcontext
+def rebuild_search_index_command():
+    for _ in each_database():
+        if rebuild_search_index():
+            print("Rebuilt the search index.")
+        else:
+            print("FTS5 is not available, search uses LIKE queries.")
+
+
+@click.command("check-query-counts")
+@with_appcontext
+def check_query_counts_command():
+    """Check that listing pages run a constant number of SQL statements."""
+    app = current_app._get_current_object()
+    paths = ["/", "/workouts", "/search?query=treeni", "/profile", "/messages"]
+    original_db = app.config.get("DATABASE")
+
+    try:
+        # Run outside the CLI's app context so every request gets its own g
+        counts = contextvars.Context().run(_count_listing_queries, app, paths)
+    finally:
+        app.config["DATABASE"] = original_db
+        app.config.pop("SQL_TRACE_CALLBACK", None)
+
+    failed = False
+    for path, (small, large) in counts.items():
+        ok = small == large
+        failed = failed or not ok
+        print(f"{'OK ' if ok else 'FAIL'} {path}: {small} vs {large} queries")
+
+    if failed:
+        raise SystemExit(1)
+
+
+def _count_listing_queries(app, paths):
+    counts = {path: [] for path in paths}
+    statements = []
+
+    try:
+        for size in (1, 50):
+            with tempfile.TemporaryDirectory() as tmp:
+                app.config["DATABASE"] = os.path.join(tmp, "check.sqlite3")
+                app.config.pop("SQL_TRACE_CALLBACK", None)
+                with app.app_context():
+                    init_db("schema.sql")
+                    migrate()
+                    _seed_check_data(size)
+
+                app.config["SQL_TRACE_CALLBACK"] = statements.append
+                client = app.test_client()
+                with client.session_transaction() as sess:
+                    sess["user_id"] = 1
+                    sess["username"] = "check"
+
+                for path in paths:
+                    statements.clear()
+                    response = client.get(path)
+                    if response.status_code != 200:
+                        raise SystemExit(f"{path} returned {response.status_code}")
+                    counts[path].append(len(statements))
+                close_writers()
+                close_pools()
+    finally:
+        close_writers()
+        close_pools()
+
+    return counts
+
+
+def _seed_check_data(size):
+    add_user("check", "check-password")
+    for _ in range(size):
+        wid = save_workout(1, "2026-01-01", "treeni", 30, "treeni", [1, 2])
+        add_message(1, 1, wid, "viesti")
+
+
+COMMANDS = (
+    init_db_command,
+    migrate_command,
+    rebuild_stats_command,
+    check_stats_command,
+    rebuild_leaderboards_command,
+    reshard_command,
+    import_workouts_command,
+    export_user_command,
+    profile_token_command,
+    profile_report_command,
+    check_query_plans_command,
+    rebuild_search_index_command,
+    check_query_counts_command,
+)
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from typing import Dict, Iterable, Optional
+
+from flask import current_app, g
+
+from .connection import data_dbs, database_path, get_db, shard_count
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_CACHE_TTL = 60.0
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class QueryCache:
+    """Size-bounded LRU cache with a time to live for query results"""
+
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE, ttl=DEFAULT_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_or_call(self, key, fn):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self.entries[key]
+                self.expirations += 1
+            self.misses += 1
+
+        value = fn()
+
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+def get_cache() -> QueryCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = current_app.config
+            _cache = QueryCache(
+                maxsize=config.get("QUERY_CACHE_SIZE", DEFAULT_CACHE_SIZE),
+                ttl=config.get("QUERY_CACHE_TTL", DEFAULT_CACHE_TTL),
+            )
+    return _cache
+
+
+def _load_versions() -> Optional[Dict[str, tuple]]:
+    if "table_versions" not in g:
+        # With shards every file counts its own writes, a change anywhere
+        # moves the sum
+        versions = {}
+        try:
+            for db in data_dbs() if shard_count() else [get_db()]:
+                rows = db.execute(
+                    "SELECT name, version, changed_at FROM table_versions"
+                ).fetchall()
+                for name, version, changed_at in rows:
+                    total, latest = versions.get(name, (0, 0))
+                    versions[name] = (total + version, max(latest, changed_at))
+        except sqlite3.OperationalError:
+            return None
+        g.table_versions = versions
+    return g.table_versions
+
+
+def table_versions() -> Optional[Dict[str, int]]:
+    """Read the change counters once per application context.
+
+    Returns None when the table_versions migrations have not been run,
+    caching is then skipped.
+    """
+    versions = _load_versions()
+    if versions is None:
+        return None
+    return {name: version for name, (version, _) in versions.items()}
+
+
+def last_changed(tables: Iterable[str]) -> Optional[int]:
+    """Unix time of the latest write to any of the tables"""
+    versions = _load_versions()
+    if versions is None:
+        return None
+    return max((versions[t][1] for t in tables if t in versions), default=0)
+
+
+def bump_versions(db, tables: Iterable[str]) -> None:
+    """Bump the change counters, call inside the writing transaction"""
+    tables = list(tables)
+    try:
+        db.execute(
+            f"""UPDATE table_versions
+                SET version = version + 1,
+                    changed_at = CAST(strftime('%s', 'now') AS INTEGER)
+                WHERE name IN ({", ".join("?" for _ in tables)})""",
+            tables,
+        )
+    except sqlite3.OperationalError:
+        pass
+
+
+def forget_versions() -> None:
+    """Make the next cached read in this context see fresh counters"""
+    g.pop("table_versions", None)
+
+
+def cached(*tables: str):
+    """Memoize a read function on its arguments and the given tables' versions.
+
+    Cached results are shared between requests and must not be mutated.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get("QUERY_CACHE", True):
+                return fn(*args, **kwargs)
+
+            versions = table_versions()
+            if versions is None:
+                return fn(*args, **kwargs)
+
+            key = (
+                database_path(),
+                fn.__module__,
+                fn.__qualname__,
+                args,
+                tuple(sorted(kwargs.items())),
+                tuple(versions.get(t, 0) for t in tables),
+            )
+            try:
+                hash(key)
+            except TypeError:
+                return fn(*args, **kwargs)
+
+            return get_cache().get_or_call(key, lambda: fn(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
@@ -1,10 +1,13 @@
 from __future__ import annotations
 
-from typing import Dict, List
+import json
+from typing import Dict, Iterable, List
 
-from .connection import get_db
+from .cache import cached
+from .connection import data_dbs, get_db
 
 
+@cached("categories")
 def list_categories() -> List[Dict]:
     db = get_db()
     rows = db.execute(
@@ -17,21 +20,34 @@ def list_categories() -> List[Dict]:
     return [dict(r) for r in rows]
 
 
-def assign_categories_to_workout(workout_id: int, category_ids: list[int]) -> None:
-    db = get_db()
-    for cid in category_ids:
-        db.execute(
-            """
-            INSERT OR IGNORE INTO workout_categories (workout_id, category_id)
-            VALUES (?, ?)
-        """,
-            (workout_id, cid),
+def sync_workout_categories(db, workout_id: int, category_ids: Iterable[int]) -> None:
+    """Make the workout's categories exactly category_ids.
+
+    Takes the connection of an ongoing write and only touches the rows
+    that differ from the current set.
+    """
+    wanted = set(category_ids)
+    current = {
+        row[0]
+        for row in db.execute(
+            "SELECT category_id FROM workout_categories WHERE workout_id = ?",
+            (workout_id,),
         )
-    db.commit()
+    }
 
+    db.executemany(
+        "DELETE FROM workout_categories WHERE workout_id = ? AND category_id = ?",
+        [(workout_id, cid) for cid in sorted(current - wanted)],
+    )
+    db.executemany(
+        "INSERT INTO workout_categories (workout_id, category_id) VALUES (?, ?)",
+        [(workout_id, cid) for cid in sorted(wanted - current)],
+    )
 
-def list_workout_categories(workout_id: int) -> List[Dict]:
-    db = get_db()
+
+def list_workout_categories(workout_id: int, user_id: int) -> List[Dict]:
+    """Categories of one of the user's workouts"""
+    db = get_db(user_id)
     rows = db.execute(
         """
         SELECT c.id, c.name
@@ -43,3 +59,27 @@ def list_workout_categories(workout_id: int) -> List[Dict]:
         (workout_id,),
     ).fetchall()
     return [dict(r) for r in rows]
+
+
+def list_categories_for_workouts(workout_ids: Iterable[int]) -> Dict[int, List[Dict]]:
+    """Return categories of many workouts with one query, keyed by workout id"""
+    ids = sorted({int(wid) for wid in workout_ids})
+    result: Dict[int, List[Dict]] = {wid: [] for wid in ids}
+    if not ids:
+        return result
+
+    for db in data_dbs():
+        rows = db.execute(
+            """
+            SELECT wc.workout_id, c.id, c.name
+            FROM workout_categories AS wc
+            JOIN categories AS c ON c.id = wc.category_id
+            WHERE wc.workout_id IN (SELECT value FROM json_each(?))
+            ORDER BY c.name
+        """,
+            (json.dumps(ids),),
+        ).fetchall()
+
+        for row in rows:
+            result[row["workout_id"]].append({"id": row["id"], "name": row["name"]})
+    return result
@@ -1,32 +1,285 @@
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import List, Optional
 
-from flask import g, current_app
+from flask import g, current_app, has_request_context, request
 
+from .instrument import TimedConnection
 
-def get_db():
-    """Get a database connection for the Flask"""
-    if "db" not in g:
-        db_path = current_app.config.get("DATABASE")
-        if not db_path:
-            instance = Path(current_app.instance_path)
-            instance.mkdir(parents=True, exist_ok=True)
-            db_path = instance / "app.sqlite3"
-            current_app.config["DATABASE"] = str(db_path)
+DEFAULT_POOL_SIZE = 8
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "cache_size": -20000,
+    "temp_store": "MEMORY",
+    "foreign_keys": "ON",
+    "busy_timeout": 5000,
+}
+READ_ONLY_METHODS = ("GET", "HEAD")
 
-        conn = sqlite3.connect(current_app.config["DATABASE"])
+_pools = {}
+_pools_lock = threading.Lock()
+_pools_pid = os.getpid()
+_shard_map = {}
+
+
+class ConnectionPool:
+    """Keeps up to `size` idle connections to one database file.
+
+    Connections are opened lazily and the pragmas are applied once when
+    a connection is created. When every pooled connection is in use an
+    extra connection is opened and closed again on release, so requests
+    never wait on the pool. Read-only pools open the file with mode=ro
+    and leave the journal mode to the writers.
+    """
+
+    def __init__(
+        self, path, size=DEFAULT_POOL_SIZE, pragmas=None, cached_statements=256, readonly=False
+    ):
+        self.path = path
+        self.size = size
+        self.readonly = readonly
+        self.pragmas = dict(DEFAULT_PRAGMAS, **(pragmas or {}))
+        if readonly:
+            self.pragmas.pop("journal_mode", None)
+        self.cached_statements = cached_statements
+        self.idle = queue.LifoQueue(maxsize=size)
+        self.opened = 0
+        self.in_use = 0
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.readonly:
+            target = f"{Path(self.path).resolve().as_uri()}?mode=ro"
+        else:
+            target = self.path
+        conn = sqlite3.connect(
+            target,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            uri=self.readonly,
+        )
         conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA foreign_keys = ON;")
-        g.db = conn
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value};")
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self.idle.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+            with self.lock:
+                self.opened += 1
+        with self.lock:
+            self.in_use += 1
+        return conn
+
+    def release(self, conn):
+        with self.lock:
+            self.in_use -= 1
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.set_trace_callback(None)
+            self.idle.put_nowait(conn)
+        except (sqlite3.Error, queue.Full):
+            self._discard(conn)
+
+    def _discard(self, conn):
+        with self.lock:
+            self.opened -= 1
+        conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+def database_path():
+    """Return the configured database path, defaulting to the instance folder"""
+    db_path = current_app.config.get("DATABASE")
+    if not db_path:
+        instance = Path(current_app.instance_path)
+        instance.mkdir(parents=True, exist_ok=True)
+        db_path = str(instance / "app.sqlite3")
+        current_app.config["DATABASE"] = db_path
+    return db_path
+
+
+def get_pool(path=None, readonly=False):
+    """Return the connection pool of this process for the app's database"""
+    global _pools_pid
+    config = current_app.config
+    path = path or database_path()
+
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # Connections must not be shared with a forked parent
+            _pools.clear()
+            _pools_pid = os.getpid()
+
+        pool = _pools.get((path, readonly))
+        if pool is None:
+            pool = ConnectionPool(
+                path,
+                size=config.get("DB_POOL_SIZE", DEFAULT_POOL_SIZE),
+                pragmas=config.get("DB_PRAGMAS"),
+                cached_statements=config.get("DB_CACHED_STATEMENTS", 256),
+                readonly=readonly,
+            )
+            _pools[(path, readonly)] = pool
+    return pool
+
+
+def pool_stats() -> List[dict]:
+    """Gauges of every connection pool of this process"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [
+        {
+            "path": pool.path,
+            "readonly": pool.readonly,
+            "size": pool.size,
+            "opened": pool.opened,
+            "in_use": pool.in_use,
+            "idle": pool.idle.qsize(),
+        }
+        for pool in pools
+    ]
+
+
+def close_pools():
+    """Close every idle pooled connection of this process"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def shard_count() -> int:
+    """Number of shard files, 0 when sharding is off"""
+    return int(current_app.config.get("DB_SHARDS", 0) or 0)
+
+
+def shard_path(index: int) -> str:
+    shard_dir = current_app.config.get("DB_SHARD_DIR")
+    if not shard_dir:
+        shard_dir = str(Path(database_path()).parent / "shards")
+    return str(Path(shard_dir) / f"shard-{index:02d}.sqlite3")
+
+
+def data_paths() -> List[str]:
+    """Every database file that can hold workouts and messages.
+
+    The directory database comes first, it keeps the data of users that
+    have not been moved to a shard.
+    """
+    return [database_path()] + shard_paths()
+
+
+def shard_paths() -> List[str]:
+    return [shard_path(i) for i in range(shard_count())]
+
+
+def shard_of(user_id: int) -> Optional[int]:
+    """Shard of the user from the directory, None when it is the directory itself"""
+    key = (database_path(), user_id)
+    if key in _shard_map:
+        return _shard_map[key]
+
+    try:
+        row = _connection(database_path()).execute(
+            "SELECT shard FROM user_shards WHERE user_id = ?", (user_id,)
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # Migration 0010 not applied yet
+        return None
+    if row is None:
+        return None
+    # Moving a user between shards is done offline by flask reshard, a
+    # running process never sees its mapping change
+    _shard_map[key] = row[0]
+    return row[0]
+
+
+def user_path(user_id: Optional[int]) -> str:
+    """Database file holding the user's workouts and messages"""
+    if user_id is None or not shard_count():
+        return database_path()
+    shard = shard_of(user_id)
+    return database_path() if shard is None else shard_path(shard)
+
+
+def directory_path() -> str:
+    """The directory database, or the file selected with use_database()"""
+    return g.get("db_override") or database_path()
+
+
+def _connection(path: str):
+    dbs = g.setdefault("dbs", {})
+    if path not in dbs:
+        readonly = (
+            current_app.config.get("DB_READONLY_GET", True)
+            and has_request_context()
+            and request.method in READ_ONLY_METHODS
+        )
+        pool = get_pool(path, readonly=readonly)
+        conn = pool.acquire()
+        conn.set_trace_callback(current_app.config.get("SQL_TRACE_CALLBACK"))
+        stats = g.get("sql_stats")
+        handle = conn if stats is None else TimedConnection(conn, stats)
+        dbs[path] = (handle, conn, pool)
+    return dbs[path][0]
+
+
+def get_db(user_id: Optional[int] = None):
+    """Get a database connection for the Flask.
+
+    GET and HEAD requests get a read-only connection unless
+    DB_READONLY_GET is turned off, writes go through db.writer. With
+    DB_SHARDS set, pass user_id to get the shard with that user's
+    workouts and messages, otherwise the directory database with users
+    and categories is returned.
+    """
+    if user_id is None:
+        return _connection(directory_path())
+    return _connection(user_path(user_id))
+
+
+def data_dbs() -> List[sqlite3.Connection]:
+    """Connections to every database in data_paths() for scatter-gather reads"""
+    return [_connection(path) for path in data_paths()]
+
+
+@contextmanager
+def use_database(path: str):
+    """Make get_db() without a user_id return the given file.
 
-    return g.db
+    Used by maintenance commands that run the same code on every shard.
+    """
+    previous = g.get("db_override")
+    g.db_override = path
+    try:
+        yield _connection(path)
+    finally:
+        g.db_override = previous
 
 
 def close_db(e=None):
-    """Close the database connection when the application context ends"""
-    db = g.pop("db", None)
-    if db is not None:
-        db.close()
+    """Return the database connections to their pools when the application context ends"""
+    dbs = g.pop("dbs", {})
+    for _, conn, pool in dbs.values():
+        pool.release(conn)
 
 
 def init_db(schema_path: str = "schema.sql"):
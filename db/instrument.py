@@ -0,0 +1,102 @@
+"""Opt-in timing of the SQL statements run by one request.
+
+When the request has a QueryStats in g.sql_stats, get_db() hands out a
+TimedConnection instead of the plain connection. Every statement is
+timed from execute() until its rows have been fetched. Without stats
+the connections are returned untouched and cost nothing extra.
+"""
+from __future__ import annotations
+
+import time
+from typing import List
+
+
+class QueryStats:
+    """Statement count, total SQL time and the statements of one request"""
+
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: List[list] = []
+
+    def add(self, sql: str) -> list:
+        record = [sql, 0.0]
+        self.statements.append(record)
+        self.count += 1
+        return record
+
+    def slowest(self, n: int) -> List[list]:
+        return sorted(self.statements, key=lambda r: r[1], reverse=True)[:n]
+
+
+class TimedCursor:
+    __slots__ = ("_cursor", "_record", "_stats")
+
+    def __init__(self, cursor, record, stats):
+        self._cursor = cursor
+        self._record = record
+        self._stats = stats
+
+    def _timed(self, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - start
+            self._record[1] += elapsed
+            self._stats.seconds += elapsed
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self._timed(self._cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._timed(self._cursor.__next__)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """Wraps a sqlite3 connection and records its statements in stats"""
+
+    __slots__ = ("_conn", "_stats")
+
+    def __init__(self, conn, stats: QueryStats):
+        self._conn = conn
+        self._stats = stats
+
+    def _run(self, method, sql, *args):
+        record = self._stats.add(sql)
+        cursor = TimedCursor(None, record, self._stats)
+        cursor._cursor = cursor._timed(method, sql, *args)
+        return cursor
+
+    def execute(self, sql, *args):
+        return self._run(self._conn.execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return self._run(self._conn.executemany, sql, *args)
+
+    def executescript(self, sql):
+        return self._run(self._conn.executescript, sql)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+from datetime import date, timedelta
+from typing import Dict, List, Optional
+
+from .cache import cached
+from .connection import data_dbs, get_db
+
+PERIODS = ("week", "month", "all")
+METRICS = {
+    "minutes": "l.minutes DESC, l.count DESC, l.user_id",
+    "count": "l.count DESC, l.minutes DESC, l.user_id",
+}
+# The same orders in Python, for merging the boards of several shards
+_METRIC_KEYS = {
+    "minutes": lambda r: (-r["minutes"], -r["count"], r["user_id"]),
+    "count": lambda r: (-r["count"], -r["minutes"], r["user_id"]),
+}
+LEADERBOARD_LIMIT = 20
+# How many periods back the board can be paged, ten years of weeks
+MAX_OFFSET = 520
+
+
+def current_bucket(period: str, today: Optional[date] = None) -> str:
+    """Bucket key of the period containing today, as stored by migration 0009"""
+    today = today or date.today()
+    if period == "week":
+        return (today - timedelta(days=today.weekday())).isoformat()
+    if period == "month":
+        return today.strftime("%Y-%m")
+    return ""
+
+
+def shift_bucket(period: str, bucket: str, steps: int) -> str:
+    """The bucket `steps` periods before (negative) or after the given one.
+
+    Steps past the range of dates leave the bucket unchanged.
+    """
+    if period == "week":
+        try:
+            return (date.fromisoformat(bucket) + timedelta(weeks=steps)).isoformat()
+        except OverflowError:
+            return bucket
+    if period == "month":
+        year, month = map(int, bucket.split("-"))
+        index = year * 12 + month - 1 + steps
+        if not 1 <= index // 12 <= 9999:
+            return bucket
+        return f"{index // 12:04d}-{index % 12 + 1:02d}"
+    return bucket
+
+
+def bucket_label(period: str, bucket: str) -> str:
+    if period == "week":
+        year, week, _ = date.fromisoformat(bucket).isocalendar()
+        return f"{year}-W{week:02d}"
+    return bucket
+
+
+@cached("workouts", "workout_categories", "users")
+def get_leaderboard(
+    period: str,
+    bucket: str,
+    metric: str = "minutes",
+    category_id: int = 0,
+    limit: int = LEADERBOARD_LIMIT,
+) -> List[Dict]:
+    """Top users of one bucket, read in index order from leaderboard_totals.
+
+    A user's totals live in one shard only, so the top rows of every
+    shard together contain the overall top rows.
+    """
+    rows = []
+    for db in data_dbs():
+        rows.extend(
+            dict(row)
+            for row in db.execute(
+                f"""
+                SELECT l.user_id, u.username, l.count, l.minutes
+                FROM leaderboard_totals l
+                JOIN users u ON u.id = l.user_id
+                WHERE l.period = ? AND l.bucket = ? AND l.category_id = ?
+                ORDER BY {METRICS[metric]}
+                LIMIT ?
+                """,
+                (period, bucket, category_id, limit),
+            )
+        )
+    rows.sort(key=_METRIC_KEYS[metric])
+    return rows[:limit]
+
+
+def rebuild_leaderboards() -> None:
+    """Recompute leaderboard_totals from workouts and their categories"""
+    db = get_db()
+    with db:
+        db.execute("DELETE FROM leaderboard_totals")
+        db.execute(
+            """INSERT INTO leaderboard_totals
+                   (period, bucket, category_id, user_id, count, minutes)
+               SELECT period, bucket, category_id, user_id, COUNT(*), SUM(duration)
+               FROM leaderboard_entries
+               GROUP BY period, bucket, category_id, user_id"""
+        )
+
+
+def find_leaderboard_mismatches() -> List[Dict]:
+    """Compare leaderboard_totals against a live aggregate"""
+    db = get_db()
+    rows = db.execute(
+        """
+        WITH expected AS (
+            SELECT period, bucket, category_id, user_id,
+                   COUNT(*) AS count, SUM(duration) AS minutes
+            FROM leaderboard_entries
+            GROUP BY period, bucket, category_id, user_id
+        )
+        SELECT e.period, e.bucket, e.category_id, e.user_id,
+               e.count AS expected_count, e.minutes AS expected_minutes,
+               l.count AS actual_count, l.minutes AS actual_minutes
+        FROM expected e
+        LEFT JOIN leaderboard_totals l USING (period, bucket, category_id, user_id)
+        WHERE l.count IS NOT e.count OR l.minutes IS NOT e.minutes
+        UNION ALL
+        SELECT l.period, l.bucket, l.category_id, l.user_id,
+               NULL, NULL, l.count, l.minutes
+        FROM leaderboard_totals l
+        LEFT JOIN expected e USING (period, bucket, category_id, user_id)
+        WHERE e.count IS NULL
+        """
+    ).fetchall()
+    return [dict(row) for row in rows]
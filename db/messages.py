@@ -1,141 +1,222 @@
 from __future__ import annotations
 from typing import Dict, List, Optional
-from .connection import get_db
+from .cache import cached
+from .connection import data_dbs, data_paths, get_db
+from .pagination import DEFAULT_PAGE_SIZE, fetch_merged_page
+from .shards import next_id
+from .writer import run_write
+
+
+def add_message(
+    sender_id: int,
+    receiver_id: int,
+    workout_id: int,
+    content: str,
+    owner_id: Optional[int] = None,
+) -> int:
+    """Store a message in the shard of the workout's owner, next to the workout.
+
+    owner_id defaults to the receiver, it differs when the owner replies
+    to somebody in the workout's thread.
+    """
+    if owner_id is None:
+        owner_id = receiver_id
+    new_id = next_id("messages")
+
+    def write(db):
+        cur = db.execute(
+            """
+            INSERT INTO messages (id, sender_id, receiver_id, workout_id, content, read_at)
+            VALUES (?, ?, ?, ?, ?, CASE WHEN ? THEN datetime('now') END)
+        """,
+            # Notes on your own workouts never show up as unread
+            (new_id, sender_id, receiver_id, workout_id, content, sender_id == receiver_id),
+        )
+        return int(cur.lastrowid)
+
+    return run_write(write, tables=("messages",), user_id=owner_id)
 
 
-def add_message(sender_id: int, receiver_id: int, workout_id: int, content: str) -> None:
-    db = get_db()
-    db.execute(
-        """
-        INSERT INTO messages (sender_id, receiver_id, workout_id, content)
-        VALUES (?, ?, ?, ?)
-    """,
-        (sender_id, receiver_id, workout_id, content),
+def get_message(message_id: int):
+    for db in data_dbs():
+        row = db.execute(
+            """
+            SELECT m.id, m.sender_id, m.receiver_id, m.content, w.user_id AS workout_owner_id
+            FROM messages m
+            JOIN workouts w ON w.id = m.workout_id
+            WHERE m.id = ?
+            """,
+            (message_id,),
+        ).fetchone()
+        if row:
+            return row
+    return None
+
+
+def delete_message_by_id(message_id: int, owner_id: int):
+    def write(db):
+        db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+
+    run_write(write, tables=("messages",), user_id=owner_id)
+
+
+_MESSAGE_SELECT = """
+    SELECT
+        m.id,
+        m.sender_id,
+        m.receiver_id,
+        m.content,
+        m.created_at,
+        m.read_at,
+        s.username,
+        r.username,
+        w.id,
+        w.date,
+        w.type,
+        w.user_id
+    FROM messages m
+    JOIN users s ON s.id = m.sender_id
+    JOIN users r ON r.id = m.receiver_id
+    JOIN workouts w ON w.id = m.workout_id
+"""
+
+
+def _message_dict(row) -> Dict:
+    return {
+        "id": row[0],
+        "sender_id": row[1],
+        "receiver_id": row[2],
+        "content": row[3],
+        "created_at": row[4],
+        "unread": row[5] is None,
+        "sender": row[6],
+        "receiver": row[7],
+        "workout_id": row[8],
+        "workout_date": row[9],
+        "workout_type": row[10],
+        "workout_owner_id": row[11],
+    }
+
+
+def _list_page(dbs, where: str, user_id: int, cursor: Optional[str], limit: int) -> Dict:
+    page = fetch_merged_page(
+        dbs,
+        _MESSAGE_SELECT + f"WHERE {where} AND {{seek}}\nORDER BY {{order}}",
+        (user_id,),
+        ("m.created_at", "m.id"),
+        cursor,
+        limit,
+        lambda r: (r["created_at"], r["id"]),
     )
-    db.commit()
+    page["items"] = [_message_dict(row) for row in page["items"]]
+    return page
 
 
-def get_message(message_id: int):
-    db = get_db()
-    return db.execute(
-        "SELECT id, sender_id, content FROM messages WHERE id = ?",
-        (message_id,),
-    ).fetchone()
+def list_messages(
+    receiver_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE
+) -> Dict:
+    """One page of the user's inbox, newest first"""
+    # Replies from other owners live in their shards
+    return _list_page(data_dbs(), "m.receiver_id = ?", receiver_id, cursor, limit)
+
 
+def list_sent_messages(
+    sender_id: int, cursor: Optional[str] = None, limit: int = DEFAULT_PAGE_SIZE
+) -> Dict:
+    # Sent messages live in the shards of the workouts' owners
+    return _list_page(data_dbs(), "m.sender_id = ?", sender_id, cursor, limit)
 
-def delete_message_by_id(message_id: int):
-    db = get_db()
-    db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
-    db.commit()
 
+def list_thread(workout_id: int, user_id: int, owner_id: int) -> List[Dict]:
+    """Messages about one workout that the user sent or received, oldest first.
 
-def list_messages(receiver_id: int) -> List[Dict]:
-    db = get_db()
+    owner_id is the workout's owner, the shard that holds the thread.
+    """
+    db = get_db(owner_id)
     rows = db.execute(
-        """
-        SELECT
-            m.id,
-            m.sender_id,
-            m.receiver_id,
-            m.content,
-            m.created_at,
-            s.username,
-            r.username,
-            w.date,
-            w.type
-        FROM messages m
-        JOIN users s ON s.id = m.sender_id
-        JOIN users r ON r.id = m.receiver_id
-        JOIN workouts w ON w.id = m.workout_id
-        WHERE m.receiver_id = ?
-        ORDER BY m.created_at DESC, m.id DESC
-    """,
-        (receiver_id,),
+        _MESSAGE_SELECT
+        + """
+        WHERE m.workout_id = ? AND (m.sender_id = ? OR m.receiver_id = ?)
+        ORDER BY m.created_at, m.id
+        """,
+        (workout_id, user_id, user_id),
     ).fetchall()
-
-    result: List[Dict] = []
-    for row in rows:
-        result.append(
-            {
-                "id": row["id"],
-                "sender_id": row["sender_id"],
-                "receiver_id": row["receiver_id"],
-                "content": row["content"],
-                "created_at": row["created_at"],
-                "sender": row[5],
-                "receiver": row[6],
-                "workout_date": row[7],
-                "workout_type": row[8],
-            }
+    return [_message_dict(row) for row in rows]
+
+
+def mark_read(receiver_id: int, message_ids: List[int]) -> None:
+    """Mark messages of the user's inbox as read.
+
+    The ids come from the inbox page, which mixes the shards of many
+    owners, so every data file is updated. Ids of other users'
+    messages are ignored.
+    """
+    if not message_ids:
+        return
+
+    def write(db):
+        db.execute(
+            f"""
+            UPDATE messages
+            SET read_at = datetime('now')
+            WHERE receiver_id = ? AND read_at IS NULL
+              AND id IN ({", ".join("?" for _ in message_ids)})
+            """,
+            (receiver_id, *message_ids),
         )
-    return result
-
-
-def update_message(message_id: int, content: str) -> None:
-    db = get_db()
-    db.execute(
-        """
-        UPDATE messages
-        SET content = ?
-        WHERE id = ?
-    """,
-        (content, message_id),
-    )
-    db.commit()
-
 
-def list_workouts_for_messages():
-    db = get_db()
-    return db.execute(
-        """SELECT w.id, w.date, w.type, u.username
-           FROM workouts w
-           JOIN users u ON u.id = w.user_id
-           ORDER BY w.date DESC, w.id DESC"""
-    ).fetchall()
+    for path in data_paths():
+        run_write(write, tables=("messages",), path=path)
 
 
-def list_messages_full():
-    db = get_db()
-    rows = db.execute(
-        """
-        SELECT 
-            m.id,
-            m.content,
-            m.created_at,
-            s.username,
-            r.username,
-            w.id,
-            w.type,
-            w.date
-        FROM messages m
-        JOIN users s ON s.id = m.sender_id
-        JOIN users r ON r.id = m.receiver_id
-        JOIN workouts w ON w.id = m.workout_id
-        ORDER BY m.created_at DESC, m.id DESC
-        """
-    ).fetchall()
+def mark_thread_read(receiver_id: int, workout_id: int, owner_id: int) -> None:
+    """Mark the messages the user received in a workout's thread as read"""
+    def write(db):
+        db.execute(
+            """
+            UPDATE messages
+            SET read_at = datetime('now')
+            WHERE workout_id = ? AND receiver_id = ? AND read_at IS NULL
+            """,
+            (workout_id, receiver_id),
+        )
 
-    result = []
-    for row in rows:
-        result.append(
-            {
-                "id": row[0],
-                "content": row[1],
-                "created_at": row[2],
-                "sender": row[3],
-                "receiver": row[4],
-                "workout_id": row[5],
-                "workout_type": row[6],
-                "workout_date": row[7],
-            }
+    run_write(write, tables=("messages",), user_id=owner_id)
+
+
+@cached("messages")
+def get_unread_count(user_id: int) -> int:
+    # Every file keeps the counter of the messages it holds
+    count = 0
+    for db in data_dbs():
+        row = db.execute(
+            "SELECT unread FROM user_inbox WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+        count += row["unread"] if row else 0
+    return count
+
+
+def update_message(message_id: int, content: str, owner_id: int) -> None:
+    def write(db):
+        db.execute(
+            """
+            UPDATE messages
+            SET content = ?
+            WHERE id = ?
+        """,
+            (content, message_id),
         )
 
-    return result
+    run_write(write, tables=("messages",), user_id=owner_id)
 
 
 def get_workout_owner(workout_id: int):
-    db = get_db()
-    return db.execute(
-        "SELECT id, user_id FROM workouts WHERE id = ?",
-        (workout_id,),
-    ).fetchone()
\ No newline at end of file
+    for db in data_dbs():
+        row = db.execute(
+            "SELECT id, user_id FROM workouts WHERE id = ?",
+            (workout_id,),
+        ).fetchone()
+        if row:
+            return row
+    return None
\ No newline at end of file
@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import re
+import sqlite3
+from pathlib import Path
+from typing import List, Tuple
+
+from .connection import get_db
+
+_MIGRATION_NAME = re.compile(r"^(\d+)_[\w-]+\.sql$")
+
+
+def list_migrations(migrations_dir: str = "migrations") -> List[Tuple[int, Path]]:
+    """Return the numbered migration files sorted by version"""
+    found = []
+    for path in Path(migrations_dir).iterdir():
+        match = _MIGRATION_NAME.match(path.name)
+        if match:
+            found.append((int(match.group(1)), path))
+    found.sort()
+
+    versions = [v for v, _ in found]
+    if len(versions) != len(set(versions)):
+        raise RuntimeError(f"Duplicate migration numbers in {migrations_dir}")
+    return found
+
+
+def schema_version() -> int:
+    return get_db().execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(migrations_dir: str = "migrations") -> List[str]:
+    """Apply every migration newer than PRAGMA user_version.
+
+    Each file runs in its own transaction together with the
+    user_version bump, so a failing migration leaves the database at
+    the previous version.
+    """
+    db = get_db()
+    current = schema_version()
+    applied = []
+
+    for version, path in list_migrations(migrations_dir):
+        if version <= current:
+            continue
+
+        script = path.read_text(encoding="utf-8")
+        try:
+            db.executescript(
+                f"BEGIN;\n{script}\n;PRAGMA user_version = {version};\nCOMMIT;"
+            )
+        except sqlite3.Error:
+            if db.in_transaction:
+                db.execute("ROLLBACK")
+            raise
+
+        applied.append(path.name)
+
+    return applied
+
+
+def explain(sql: str) -> List[str]:
+    rows = get_db().execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+    return [row["detail"] for row in rows]
+
+
+# Tables that are meant to be read whole
+SMALL_TABLES = ("table_versions",)
+
+
+def unindexed_steps(sql: str, plan: List[str]) -> List[str]:
+    """Return the plan steps that scan a whole table or sort a paginated listing"""
+    bad = []
+    for step in plan:
+        if step.startswith("SCAN"):
+            table = step.split()[1]
+            if "INDEX" in step or "VIRTUAL TABLE" in step or table in SMALL_TABLES:
+                continue
+            bad.append(step)
+        elif "TEMP B-TREE FOR ORDER BY" in step and "LIMIT" in sql.upper():
+            bad.append(step)
+    return bad
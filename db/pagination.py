@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import base64
+import binascii
+import heapq
+import json
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# SQLite integers are signed 64-bit
+MIN_INT, MAX_INT = -2**63, 2**63 - 1
+
+
+def page_size(raw, default: int = DEFAULT_PAGE_SIZE) -> int:
+    """Parse a page size from user input and clamp it to sane bounds"""
+    try:
+        size = int(raw)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def encode_cursor(direction: str, key: Sequence) -> str:
+    raw = json.dumps([direction, list(key)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> Optional[Tuple[str, list]]:
+    """Decode a cursor token, invalid tokens are treated as the first page"""
+    if not token:
+        return None
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        direction, key = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if direction not in ("next", "prev") or not isinstance(key, list):
+        return None
+    if not all(_bindable(value) for value in key):
+        return None
+    return direction, key
+
+
+def _bindable(value) -> bool:
+    """Whether a cursor key value can be passed to SQLite as a parameter"""
+    if isinstance(value, bool):
+        return False
+    if isinstance(value, int):
+        return MIN_INT <= value <= MAX_INT
+    return isinstance(value, (float, str))
+
+
+def fetch_page(
+    db,
+    sql: str,
+    params: Sequence,
+    columns: Sequence[str],
+    cursor: Optional[str],
+    limit: int,
+    row_key: Callable[[object], Sequence],
+) -> Dict:
+    """Run a keyset paginated query.
+
+    sql must contain {seek} inside its WHERE clause and {order} as the
+    whole ORDER BY expression. columns are the sort key columns, they are
+    always ordered descending like the rest of the listings.
+    """
+    decoded = decode_cursor(cursor)
+    if decoded and len(decoded[1]) != len(columns):
+        decoded = None
+
+    cols = ", ".join(columns)
+    marks = ", ".join("?" for _ in columns)
+
+    if decoded is None:
+        seek, order, seek_params = "1", ", ".join(f"{c} DESC" for c in columns), []
+        backwards = False
+    elif decoded[0] == "next":
+        seek, order = f"({cols}) < ({marks})", ", ".join(f"{c} DESC" for c in columns)
+        seek_params, backwards = decoded[1], False
+    else:
+        seek, order = f"({cols}) > ({marks})", ", ".join(f"{c} ASC" for c in columns)
+        seek_params, backwards = decoded[1], True
+
+    rows = db.execute(
+        sql.format(seek=seek, order=order) + "\nLIMIT ?",
+        (*params, *seek_params, limit + 1),
+    ).fetchall()
+
+    has_more = len(rows) > limit
+    items: List = list(rows[:limit])
+    if backwards:
+        items.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, decoded is not None
+
+    return _page(items, limit, has_next, has_prev, row_key)
+
+
+def fetch_merged_page(
+    dbs: Sequence,
+    sql: str,
+    params: Sequence,
+    columns: Sequence[str],
+    cursor: Optional[str],
+    limit: int,
+    row_key: Callable[[object], Sequence],
+) -> Dict:
+    """fetch_page over several databases, merged on the sort key.
+
+    Every database returns its own page for the cursor and the pages
+    are merged k-way, keeping the `limit` rows closest to the cursor.
+    """
+    pages = [fetch_page(db, sql, params, columns, cursor, limit, row_key) for db in dbs]
+    if len(pages) == 1:
+        return pages[0]
+
+    merged = list(heapq.merge(*(p["items"] for p in pages), key=row_key, reverse=True))
+    decoded = decode_cursor(cursor)
+    if decoded and len(decoded[1]) != len(columns):
+        decoded = None
+
+    if decoded is not None and decoded[0] == "prev":
+        items = merged[-limit:]
+        has_more = len(merged) > limit or any(p["prev_cursor"] for p in pages)
+        has_next, has_prev = True, has_more
+    else:
+        items = merged[:limit]
+        has_more = len(merged) > limit or any(p["next_cursor"] for p in pages)
+        has_next, has_prev = has_more, decoded is not None
+
+    return _page(items, limit, has_next, has_prev, row_key)
+
+
+def _page(items: List, limit: int, has_next: bool, has_prev: bool, row_key) -> Dict:
+    next_cursor = prev_cursor = None
+    if items:
+        if has_next:
+            next_cursor = encode_cursor("next", row_key(items[-1]))
+        if has_prev:
+            prev_cursor = encode_cursor("prev", row_key(items[0]))
+
+    return {
+        "items": items,
+        "next_cursor": next_cursor,
+        "prev_cursor": prev_cursor,
+        "limit": limit,
+    }
@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import base64
+import hashlib
+import hmac
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from flask import current_app
+
+# Hashes are stored as scrypt$<n>$<r>$<p>$<salt>$<hash> with base64
+# salt and hash. Plain 64 character hex strings are legacy SHA-256.
+SCHEME = "scrypt"
+DEFAULT_COST = {"n": 2**14, "r": 8, "p": 1}
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+_LEGACY_SHA256 = re.compile(r"^[0-9a-f]{64}$")
+
+_pool = None
+_pool_pid = os.getpid()
+_pool_lock = threading.Lock()
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool cannot take more work in time"""
+
+
+class _HashingPool:
+    """Runs KDF work on a few threads with a bounded backlog.
+
+    hashlib releases the GIL while hashing, so request threads stay
+    responsive, and a login storm waits for a slot instead of piling up
+    unbounded CPU work.
+    """
+
+    def __init__(self, workers, backlog, timeout):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kdf")
+        self.slots = threading.BoundedSemaphore(workers + backlog)
+        self.timeout = timeout
+
+    def run(self, fn, *args):
+        if not self.slots.acquire(timeout=self.timeout):
+            raise HashingBusy()
+        try:
+            return self.executor.submit(fn, *args).result()
+        finally:
+            self.slots.release()
+
+
+def _get_pool() -> _HashingPool:
+    global _pool, _pool_pid
+    with _pool_lock:
+        # A forked child inherits the executor but not its threads
+        if _pool is None or _pool_pid != os.getpid():
+            _pool_pid = os.getpid()
+            config = current_app.config
+            _pool = _HashingPool(
+                workers=config.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 2),
+                backlog=config.get("PASSWORD_HASH_BACKLOG", 32),
+                timeout=config.get("PASSWORD_HASH_TIMEOUT", 5.0),
+            )
+    return _pool
+
+
+def _cost() -> dict:
+    return dict(DEFAULT_COST, **current_app.config.get("PASSWORD_SCRYPT_COST", {}))
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode("utf-8"),
+        salt=salt,
+        n=n,
+        r=r,
+        p=p,
+        maxmem=256 * r * (n + p + 2),
+        dklen=KEY_BYTES,
+    )
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode("ascii")
+
+
+def hash_password(password: str) -> str:
+    cost = _cost()
+    salt = os.urandom(SALT_BYTES)
+    key = _get_pool().run(_scrypt, password, salt, cost["n"], cost["r"], cost["p"])
+    return f"{SCHEME}${cost['n']}${cost['r']}${cost['p']}${_b64(salt)}${_b64(key)}"
+
+
+def check_password(stored: str, password: str) -> bool:
+    if _LEGACY_SHA256.match(stored):
+        legacy = hashlib.sha256(password.encode("utf-8")).hexdigest()
+        return hmac.compare_digest(stored, legacy)
+
+    parsed = _parse(stored)
+    if parsed is None:
+        return False
+    n, r, p, salt, key = parsed
+    candidate = _get_pool().run(_scrypt, password, salt, n, r, p)
+    return hmac.compare_digest(key, candidate)
+
+
+def needs_rehash(stored: str) -> bool:
+    """True for legacy hashes and for hashes made with another cost"""
+    parsed = _parse(stored)
+    if parsed is None:
+        return True
+    n, r, p, _, _ = parsed
+    cost = _cost()
+    return (n, r, p) != (cost["n"], cost["r"], cost["p"])
+
+
+def _parse(stored: str) -> Optional[tuple]:
+    parts = stored.split("$")
+    if len(parts) != 6 or parts[0] != SCHEME:
+        return None
+    try:
+        n, r, p = (int(x) for x in parts[1:4])
+        return n, r, p, base64.b64decode(parts[4]), base64.b64decode(parts[5])
+    except ValueError:
+        return None
@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import heapq
+import re
+import sqlite3
+from typing import List
+
+from .connection import data_dbs, get_db
+
+SEARCH_LIMIT = 100
+
+_CATEGORY_NAMES = """
+    (SELECT group_concat(c.name, ' ')
+     FROM workout_categories wc
+     JOIN categories c ON c.id = wc.category_id
+     WHERE wc.workout_id = {wid})
+"""
+
+_SEARCH_INDEX_SQL = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS workouts_fts USING fts5(
+    type,
+    description,
+    categories,
+    date,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3'
+);
+
+CREATE TRIGGER IF NOT EXISTS workouts_fts_insert
+AFTER INSERT ON workouts BEGIN
+    INSERT INTO workouts_fts (rowid, type, description, categories, date)
+    VALUES (new.id, new.type, new.description,
+            {_CATEGORY_NAMES.format(wid="new.id")}, new.date);
+END;
+
+CREATE TRIGGER IF NOT EXISTS workouts_fts_update
+AFTER UPDATE OF date, type, description ON workouts BEGIN
+    UPDATE workouts_fts
+    SET type = new.type, description = new.description, date = new.date
+    WHERE rowid = new.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS workouts_fts_delete
+AFTER DELETE ON workouts BEGIN
+    DELETE FROM workouts_fts WHERE rowid = old.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS workout_categories_fts_insert
+AFTER INSERT ON workout_categories BEGIN
+    UPDATE workouts_fts
+    SET categories = {_CATEGORY_NAMES.format(wid="new.workout_id")}
+    WHERE rowid = new.workout_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS workout_categories_fts_delete
+AFTER DELETE ON workout_categories BEGIN
+    UPDATE workouts_fts
+    SET categories = {_CATEGORY_NAMES.format(wid="old.workout_id")}
+    WHERE rowid = old.workout_id;
+END;
+"""
+
+
+def fts5_available(db) -> bool:
+    """Check whether the linked SQLite library was built with FTS5"""
+    try:
+        db.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)")
+        db.execute("DROP TABLE temp.fts5_probe")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def rebuild_search_index() -> bool:
+    """Create the FTS5 index and its triggers and refill it from workouts.
+
+    Returns False when FTS5 is not available, search then keeps using
+    the LIKE queries.
+    """
+    db = get_db()
+    if not fts5_available(db):
+        return False
+
+    db.executescript(_SEARCH_INDEX_SQL)
+    db.execute("DELETE FROM workouts_fts")
+    db.execute(
+        f"""
+        INSERT INTO workouts_fts (rowid, type, description, categories, date)
+        SELECT w.id, w.type, w.description, {_CATEGORY_NAMES.format(wid="w.id")}, w.date
+        FROM workouts w
+        """
+    )
+    db.execute("INSERT INTO workouts_fts (workouts_fts) VALUES ('optimize')")
+    db.commit()
+    return True
+
+
+def to_match_query(query: str) -> str:
+    """Turn free text into an FTS5 query where every word is a prefix term"""
+    words = re.findall(r"\w+", query)
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def search_workouts_fts(query: str, limit: int = SEARCH_LIMIT) -> List[sqlite3.Row]:
+    """Search with the FTS5 index, best bm25 matches first.
+
+    With shards every file ranks its own matches and the results are
+    merged on the score, which is computed from that file's statistics.
+    Raises sqlite3.OperationalError when the index does not exist.
+    """
+    match = to_match_query(query)
+    if not match:
+        return []
+
+    results = [
+        db.execute(
+            """
+            SELECT
+                w.id,
+                w.date,
+                w.type,
+                w.duration,
+                w.description,
+                u.username,
+                bm25(workouts_fts, 10.0, 1.0, 5.0, 2.0) AS score
+            FROM workouts_fts f
+            JOIN workouts w ON w.id = f.rowid
+            JOIN users u ON u.id = w.user_id
+            WHERE workouts_fts MATCH ?
+            ORDER BY score, w.date DESC, w.id DESC
+            LIMIT ?
+            """,
+            (match, limit),
+        ).fetchall()
+        for db in data_dbs()
+    ]
+    return list(heapq.merge(*results, key=lambda r: r["score"]))[:limit]
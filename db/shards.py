@@ -0,0 +1,270 @@
+"""Per-user sharding of workouts, categories assignments and messages.
+
+With DB_SHARDS set the directory database (DATABASE) keeps users,
+categories and the user_shards mapping, and every user's workouts and
+the messages about those workouts live in one shard file. Shards have the
+full schema and a copy of every user row without the password hash, so
+the joins on users and the foreign keys work inside a shard.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from .connection import (
+    _shard_map,
+    database_path,
+    get_db,
+    init_db,
+    shard_count,
+    shard_path,
+    shard_paths,
+    use_database,
+)
+from .migrations import migrate, schema_version
+from .search import rebuild_search_index
+from .writer import run_write
+
+ID_BLOCK_SIZE = 1000
+SHARDED_TABLES = ("workouts", "messages")
+
+_blocks = {}
+_blocks_lock = threading.Lock()
+_blocks_pid = os.getpid()
+
+
+def _reserve_ids(name: str, size: int) -> int:
+    def write(db):
+        rows = db.execute(
+            """UPDATE id_blocks SET next_id = next_id + ?
+               WHERE name = ?
+               RETURNING next_id - ?""",
+            (size, name, size),
+        ).fetchall()
+        if not rows:
+            raise RuntimeError(f"no id block for {name}, run flask migrate")
+        return rows[0][0]
+
+    return run_write(write, path=database_path())
+
+
+def next_ids(name: str, count: int = 1) -> Optional[List[int]]:
+    """Hand out `count` ids for new rows of a sharded table.
+
+    Returns None when sharding is off, the rows then get their ids from
+    AUTOINCREMENT. The ids come from blocks reserved in the directory,
+    so most calls do not touch the database.
+    """
+    global _blocks_pid
+    if not shard_count():
+        return None
+
+    key = (database_path(), name)
+    ids: List[int] = []
+    with _blocks_lock:
+        if _blocks_pid != os.getpid():
+            _blocks.clear()
+            _blocks_pid = os.getpid()
+
+        while len(ids) < count:
+            start, end = _blocks.get(key, (0, 0))
+            if start >= end:
+                size = max(ID_BLOCK_SIZE, count - len(ids))
+                start = _reserve_ids(name, size)
+                end = start + size
+            take = min(end - start, count - len(ids))
+            ids.extend(range(start, start + take))
+            _blocks[key] = (start + take, end)
+    return ids
+
+
+def next_id(name: str) -> Optional[int]:
+    ids = next_ids(name)
+    return ids[0] if ids else None
+
+
+def replicate_user(user_id: int, username: str, paths: Optional[List[str]] = None) -> None:
+    """Copy a user row into every shard, or into the given shard files"""
+    for path in paths if paths is not None else shard_paths():
+        run_write(
+            lambda db: db.execute(
+                "INSERT OR IGNORE INTO users (id, username, password_hash) VALUES (?, ?, '')",
+                (user_id, username),
+            ),
+            path=path,
+        )
+
+
+def ensure_replicated(user_id: int, username: str) -> None:
+    """Copy the user row into the shards that miss it.
+
+    add_user replicates after the directory has committed the user, a
+    crash in between leaves shards without the row and the user's
+    messages there would break the foreign keys. Run on every login.
+    """
+    missing = []
+    for path in shard_paths():
+        with use_database(path) as db:
+            if not db.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone():
+                missing.append(path)
+    if missing:
+        replicate_user(user_id, username, missing)
+
+
+def find_missing_replicas() -> List[Tuple[str, int, str]]:
+    """(shard path, user_id, username) of directory users a shard lacks"""
+    users = get_db().execute("SELECT id, username FROM users").fetchall()
+    missing = []
+    for path in shard_paths():
+        with use_database(path) as db:
+            present = {row[0] for row in db.execute("SELECT id FROM users")}
+        missing.extend((path, u["id"], u["username"]) for u in users if u["id"] not in present)
+    return missing
+
+
+def prepare_shard(path: str, schema_path: str = "schema.sql", fresh: bool = False) -> None:
+    """Create or migrate a shard file and copy users and categories into it.
+
+    fresh recreates the tables of an existing file, like flask init-db.
+    """
+    directory = get_db()
+    users = directory.execute("SELECT id, username FROM users").fetchall()
+    categories = directory.execute("SELECT id, name FROM categories").fetchall()
+
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with use_database(path) as db:
+        created = fresh or schema_version() == 0
+        if created:
+            init_db(schema_path)
+        migrate()
+        with db:
+            db.executemany(
+                "INSERT OR IGNORE INTO users (id, username, password_hash) VALUES (?, ?, '')",
+                [tuple(u) for u in users],
+            )
+            db.executemany(
+                """INSERT INTO categories (id, name) VALUES (?, ?)
+                   ON CONFLICT (id) DO UPDATE SET name = excluded.name""",
+                [tuple(c) for c in categories],
+            )
+        if created:
+            rebuild_search_index()
+
+
+def _copy_columns(conn, table: str) -> str:
+    # Generated columns cannot be inserted, they are computed again
+    rows = conn.execute(f"PRAGMA src.table_xinfo({table})").fetchall()
+    return ", ".join(row[1] for row in rows if row[6] == 0)
+
+
+def move_user(user_id: int, source: str, target: str) -> None:
+    """Move the user's workouts and their messages from source to target.
+
+    Rows are copied with their ids and then deleted from the source in
+    one transaction, the triggers keep the rollups of both files right.
+    """
+    conn = sqlite3.connect(target, isolation_level=None)
+    try:
+        conn.execute("PRAGMA foreign_keys = ON")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("ATTACH DATABASE ? AS src", (source,))
+        workouts = _copy_columns(conn, "workouts")
+        messages = _copy_columns(conn, "messages")
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                f"""INSERT OR IGNORE INTO main.workouts ({workouts})
+                    SELECT {workouts} FROM src.workouts WHERE user_id = ?""",
+                (user_id,),
+            )
+            conn.execute(
+                """INSERT OR IGNORE INTO main.workout_categories (workout_id, category_id)
+                   SELECT wc.workout_id, wc.category_id
+                   FROM src.workout_categories wc
+                   JOIN src.workouts w ON w.id = wc.workout_id
+                   WHERE w.user_id = ?""",
+                (user_id,),
+            )
+            conn.execute(
+                f"""INSERT OR IGNORE INTO main.messages ({messages})
+                    SELECT {messages} FROM src.messages
+                    WHERE workout_id IN (SELECT id FROM src.workouts WHERE user_id = ?)""",
+                (user_id,),
+            )
+            conn.execute(
+                """DELETE FROM src.messages
+                   WHERE workout_id IN (SELECT id FROM src.workouts WHERE user_id = ?)""",
+                (user_id,),
+            )
+            conn.execute("DELETE FROM src.workouts WHERE user_id = ?", (user_id,))
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+def _sync_id_blocks(paths: List[str]) -> None:
+    db = get_db()
+    for name in SHARDED_TABLES:
+        highest = 0
+        for path in paths:
+            with use_database(path) as shard:
+                row = shard.execute(f"SELECT MAX(id) FROM {name}").fetchone()
+                highest = max(highest, row[0] or 0)
+        with db:
+            db.execute(
+                "UPDATE id_blocks SET next_id = MAX(next_id, ?) WHERE name = ?",
+                (highest + 1, name),
+            )
+
+
+def reshard(count: int, on_move: Optional[Callable[[int, str, str], None]] = None) -> int:
+    """Spread the users over `count` shard files by user_id % count.
+
+    count 0 moves everybody back into the directory. Returns the number
+    of users moved. The processes serving the app cache the mapping,
+    they must be restarted with DB_SHARDS = count afterwards.
+    """
+    directory = database_path()
+    targets = [shard_path(i) for i in range(count)]
+    for path in targets:
+        prepare_shard(path)
+
+    db = get_db()
+    users = db.execute(
+        """SELECT u.id, s.shard
+           FROM users u
+           LEFT JOIN user_shards s ON s.user_id = u.id
+           ORDER BY u.id"""
+    ).fetchall()
+
+    moved = 0
+    for user_id, shard in users:
+        source = directory if shard is None else shard_path(shard)
+        target = targets[user_id % count] if count else directory
+        if source != target:
+            if on_move:
+                on_move(user_id, source, target)
+            move_user(user_id, source, target)
+            moved += 1
+
+        with db:
+            if count:
+                db.execute(
+                    """INSERT INTO user_shards (user_id, shard) VALUES (?, ?)
+                       ON CONFLICT (user_id) DO UPDATE SET shard = excluded.shard""",
+                    (user_id, user_id % count),
+                )
+            else:
+                db.execute("DELETE FROM user_shards WHERE user_id = ?", (user_id,))
+
+    _sync_id_blocks([directory, *targets])
+    _shard_map.clear()
+    return moved
@@ -1,23 +1,35 @@
 from __future__ import annotations
-import hashlib
 from typing import Optional
-from .connection import get_db
-
-
-def _hash_password(pw: str) -> str:
-    return hashlib.sha256(pw.encode("utf-8")).hexdigest()
-
-
-def add_user(username: str, password: str) -> None:
-    db = get_db()
-    db.execute(
-        """
-        INSERT INTO users (username, password_hash)
-        VALUES (?, ?)
-    """,
-        (username, _hash_password(password)),
-    )
-    db.commit()
+from .cache import cached
+from .connection import get_db, shard_count
+from .passwords import check_password, hash_password, needs_rehash
+from .shards import replicate_user
+from .writer import run_write
+
+
+def add_user(username: str, password: str) -> int:
+    password_hash = hash_password(password)
+    shards = shard_count()
+
+    def write(db):
+        cur = db.execute(
+            """
+            INSERT INTO users (username, password_hash)
+            VALUES (?, ?)
+        """,
+            (username, password_hash),
+        )
+        user_id = int(cur.lastrowid)
+        if shards:
+            db.execute(
+                "INSERT INTO user_shards (user_id, shard) VALUES (?, ?)",
+                (user_id, user_id % shards),
+            )
+        return user_id
+
+    user_id = run_write(write, tables=("users",))
+    replicate_user(user_id, username)
+    return user_id
 
 
 def get_user(username: str) -> Optional[dict]:
@@ -33,6 +45,7 @@ def get_user(username: str) -> Optional[dict]:
     return dict(row) if row else None
 
 
+@cached("users")
 def get_user_by_id(user_id: int) -> Optional[dict]:
     db = get_db()
     row = db.execute(
@@ -55,25 +68,41 @@ def get_user_with_workouts(user_id):
         WHERE id = ?
     """, (user_id,)).fetchone()
 
-    workouts = db.execute("""
+    workouts = get_db(user_id).execute("""
         SELECT id, date, type, duration
         FROM workouts
         WHERE user_id = ?
-        ORDER BY date DESC
+        ORDER BY day DESC, id DESC
     """, (user_id,)).fetchall()
 
     return user, workouts
 
 
 def verify_password(user_row: Optional[dict], password: str) -> bool:
-    return bool(user_row) and user_row["password_hash"] == _hash_password(password)
+    """Check the password and upgrade legacy or outdated hashes on success"""
+    if not user_row or not check_password(user_row["password_hash"], password):
+        return False
+
+    if needs_rehash(user_row["password_hash"]):
+        update_password_hash(user_row["id"], hash_password(password))
+    return True
+
+
+def update_password_hash(user_id: int, password_hash: str) -> None:
+    def write(db):
+        db.execute(
+            "UPDATE users SET password_hash = ? WHERE id = ?",
+            (password_hash, user_id),
+        )
+
+    run_write(write, tables=("users",))
 
 
 def list_workouts_by_user(user_id):
-    db = get_db()
+    db = get_db(user_id)
     return db.execute("""
         SELECT id, date, type, duration
         FROM workouts
         WHERE user_id = ?
-        ORDER BY date DESC
+        ORDER BY day DESC, id DESC
     """, (user_id,)).fetchall()
\ No newline at end of file
@@ -1,38 +1,117 @@
 from __future__ import annotations
-from typing import Dict, List, Optional
-from .connection import get_db
+import datetime
+import heapq
+import re
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+from .cache import cached
+from .categories import sync_workout_categories
+from .connection import data_dbs, get_db
+from .pagination import DEFAULT_PAGE_SIZE, fetch_merged_page, fetch_page
+from .search import SEARCH_LIMIT, search_workouts_fts
+from .shards import next_id
+from .writer import run_write
 
-def list_all_workouts():
-    db = get_db()
-    return db.execute(
-        """SELECT w.id,
-                  w.date,
-                  w.type,
-                  w.duration,
-                  w.description,
-                  w.user_id,        -- 👈 LISÄTTY
-                  u.username
+WORKOUT_FIELDS = {
+    "id": "w.id",
+    "date": "w.date",
+    "day": "w.day",
+    "type": "w.type",
+    "duration": "w.duration",
+    "description": "w.description",
+    "user_id": "w.user_id",
+    "username": "u.username",
+}
+
+
+def _workout_columns(fields, default):
+    """Build the select list and users join for a field projection.
+
+    id and day are always selected because the pagination seeks on them.
+    """
+    if fields is None:
+        names = ["id", "day"] + [f for f in default if f not in ("id", "day")]
+    else:
+        names = ["id", "day"] + [
+            f for f in WORKOUT_FIELDS if f in fields and f not in ("id", "day")
+        ]
+    columns = ",\n".join(f"{WORKOUT_FIELDS[n]} AS {n}" for n in names)
+    join = "JOIN users u ON u.id = w.user_id" if "username" in names else ""
+    return columns, join
+
+
+# Julian day number of 0001-01-01, where date.toordinal() starts
+_ORDINAL_DAY = 1721425
+
+
+def day_number(value: datetime.date) -> int:
+    """The workouts.day of a date"""
+    return value.toordinal() + _ORDINAL_DAY
+
+
+def _day_range(
+    date_from: Optional[datetime.date], date_to: Optional[datetime.date]
+) -> Tuple[str, tuple]:
+    """Condition on w.day for an inclusive from/to filter and its parameters"""
+    conditions, params = [], []
+    if date_from is not None:
+        conditions.append("w.day >= ?")
+        params.append(day_number(date_from))
+    if date_to is not None:
+        conditions.append("w.day <= ?")
+        params.append(day_number(date_to))
+    return " AND ".join(conditions) or "1", tuple(params)
+
+
+def list_all_workouts(
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[tuple] = None,
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+) -> Dict:
+    columns, join = _workout_columns(
+        fields, ("id", "date", "type", "duration", "description", "user_id", "username")
+    )
+    where, params = _day_range(date_from, date_to)
+    return fetch_merged_page(
+        data_dbs(),
+        f"""SELECT {columns}
            FROM workouts w
-           JOIN users u ON u.id = w.user_id
-           ORDER BY w.date DESC, w.id DESC"""
-    ).fetchall()
+           {join}
+           WHERE {where} AND {{seek}}
+           ORDER BY {{order}}""",
+        params,
+        ("w.day", "w.id"),
+        cursor,
+        limit,
+        lambda r: (r["day"], r["id"]),
+    )
 
 def add_workout(user_id: int, date: str, wtype: str, duration: int, description: Optional[str]) -> int:
-    db = get_db()
-    cur = db.execute(
-        """
-        INSERT INTO workouts (user_id, date, type, duration, description)
-        VALUES (?, ?, ?, ?, ?)
-        """,
-        (user_id, date, wtype, duration, description),
-    )
-    db.commit()
-    return int(cur.lastrowid)
+    new_id = next_id("workouts")
 
-def list_workouts(user_id: int) -> List[Dict]:
-    db = get_db()
+    def write(db):
+        cur = db.execute(
+            """
+            INSERT INTO workouts (id, user_id, date, type, duration, description)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            (new_id, user_id, date, wtype, duration, description),
+        )
+        return int(cur.lastrowid)
+
+    return run_write(write, tables=("workouts",), user_id=user_id)
+
+def list_workouts(
+    user_id: int,
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+) -> List[Dict]:
+    db = get_db(user_id)
+    where, params = _day_range(date_from, date_to)
     rows = db.execute(
-        """
+        f"""
         SELECT
             w.id,
             w.date,
@@ -42,10 +121,10 @@ def list_workouts(user_id: int) -> List[Dict]:
             u.username
         FROM workouts w
         JOIN users u ON u.id = w.user_id
-        WHERE w.user_id = ?
-        ORDER BY w.date DESC, w.id DESC
+        WHERE w.user_id = ? AND {where}
+        ORDER BY w.day DESC, w.id DESC
         """,
-        (user_id,),
+        (user_id, *params),
     ).fetchall()
 
     result: List[Dict] = []
@@ -63,119 +142,409 @@ def list_workouts(user_id: int) -> List[Dict]:
     return result
 
 def get_workout(workout_id: int) -> Optional[dict]:
-    db = get_db()
-    row = db.execute(
-        """
-        SELECT id, user_id, date, type, duration, description
+    for db in data_dbs():
+        row = db.execute(
+            """
+            SELECT id, user_id, date, type, duration, description
+            FROM workouts
+            WHERE id = ?
+            """,
+            (workout_id,),
+        ).fetchone()
+        if row:
+            return dict(row)
+    return None
+
+def search_workouts(query: str, limit: int = SEARCH_LIMIT):
+    try:
+        return search_workouts_fts(query, limit)
+    except sqlite3.OperationalError:
+        # No FTS5 in this SQLite build or the index has not been built yet
+        pass
+
+    rows = []
+    for db in data_dbs():
+        rows.append(db.execute(
+            """
+            SELECT DISTINCT
+                w.id,
+                w.date,
+                w.type,
+                w.duration,
+                w.description,
+                u.username
+            FROM workouts w
+            JOIN users u ON u.id = w.user_id
+            LEFT JOIN workout_categories wc ON wc.workout_id = w.id
+            LEFT JOIN categories c ON c.id = wc.category_id
+            WHERE (
+                    w.type LIKE ?
+                    OR w.description LIKE ?
+                    OR w.date LIKE ?
+                    OR c.name LIKE ?
+            )
+            ORDER BY w.date DESC, w.id DESC
+            LIMIT ?
+            """,
+            (
+                f"%{query}%",
+                f"%{query}%",
+                f"%{query}%",
+                f"%{query}%",
+                limit,
+            ),
+        ).fetchall())
+
+    merged = heapq.merge(*rows, key=lambda r: (r["date"], r["id"]), reverse=True)
+    return list(merged)[:limit]
+
+SUGGEST_LIMIT = 10
+# Up to this many users matching the query are looked up one by one,
+# with more the newest of their workouts are found on the date index
+SUGGEST_USER_LOOKUPS = 50
+
+_SUGGEST_SELECT = """
+    SELECT w.id, w.date, w.type, u.username
+    FROM workouts w
+    JOIN users u ON u.id = w.user_id
+"""
+_SUGGEST_ORDER = "ORDER BY w.date DESC, w.id DESC LIMIT ?"
+
+
+def _like_prefix(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+def _matching_types(db, query: str, pattern: str) -> List[str]:
+    """Distinct workout types starting with query, one index seek per type.
+
+    Types equal but for case come back once, the NOCASE comparison of
+    the per-type query finds all of them.
+    """
+    seek = """
+        SELECT type, type LIKE ? ESCAPE '\\'
         FROM workouts
-        WHERE id = ?
-        """,
-        (workout_id,),
-    ).fetchone()
-    return dict(row) if row else None
+        WHERE type {op} ? COLLATE NOCASE
+        ORDER BY type COLLATE NOCASE
+        LIMIT 1
+    """
+    types = []
+    row = db.execute(seek.format(op=">="), (pattern, query)).fetchone()
+    # Types with the prefix are adjacent in NOCASE order
+    while row is not None and row[1]:
+        types.append(row[0])
+        row = db.execute(seek.format(op=">"), (pattern, row[0])).fetchone()
+    return types
 
-def search_workouts(query: str):
-    db = get_db()
-    return db.execute(
-        """
-        SELECT DISTINCT
-            w.id,
-            w.date,
-            w.type,
-            w.duration,
-            w.description,
-            u.username
-        FROM workouts w
-        JOIN users u ON u.id = w.user_id
-        LEFT JOIN workout_categories wc ON wc.workout_id = w.id
-        LEFT JOIN categories c ON c.id = wc.category_id
-        WHERE (
-                w.type LIKE ?
-                OR w.description LIKE ?
-                OR w.date LIKE ?
-                OR c.name LIKE ?
-        )
-        ORDER BY w.date DESC, w.id DESC
-        """,
-        (
-            f"%{query}%",
-            f"%{query}%",
-            f"%{query}%",
-            f"%{query}%",
-        ),
+
+def _user_matches(pattern: str, limit: int, user_lookups: int) -> List[List]:
+    users = get_db().execute(
+        "SELECT id, username FROM users WHERE username LIKE ? ESCAPE '\\' LIMIT ?",
+        (pattern, user_lookups + 1),
     ).fetchall()
 
-def update_workout(workout_id, user_id, date, wtype, duration, description):
-    db = get_db()
-    db.execute(
-        """
-        UPDATE workouts
-        SET date = ?, type = ?, duration = ?, description = ?
-        WHERE id = ? AND user_id = ?
-        """,
-        (date, wtype, duration, description, workout_id, user_id),
-    )
-    db.commit()
+    if len(users) <= user_lookups:
+        return [
+            get_db(user["id"]).execute(
+                """
+                SELECT id, date, type, ? AS username
+                FROM workouts
+                WHERE user_id = ?
+                ORDER BY day DESC, id DESC
+                LIMIT ?
+                """,
+                (user["username"], user["id"], limit),
+            ).fetchall()
+            for user in users
+        ]
 
-def delete_workout_by_id(workout_id: int, user_id: int):
-    db = get_db()
+    # So many users match that the walk down the date index meets their
+    # workouts early
+    return [
+        db.execute(
+            f"""
+            SELECT w.id, w.date, w.type, u.username
+            FROM workouts w
+            CROSS JOIN users u ON u.id = w.user_id
+            WHERE u.username LIKE ? ESCAPE '\\'
+            {_SUGGEST_ORDER}
+            """,
+            (pattern, limit),
+        ).fetchall()
+        for db in data_dbs()
+    ]
 
-    row = db.execute(
-        "SELECT id FROM workouts WHERE id = ? AND user_id = ?",
-        (workout_id, user_id),
-    ).fetchone()
 
-    if not row:
-        return False
+def suggest_workouts(
+    query: str, limit: int = SUGGEST_LIMIT, user_lookups: int = SUGGEST_USER_LOOKUPS
+) -> List[Dict]:
+    """Newest workouts whose type, owner's username or date starts with query.
 
-    db.execute("DELETE FROM workouts WHERE id = ?", (workout_id,))
-    db.commit()
-    return True
+    Every query reads the top rows of an index range in index order,
+    the results are merged here.
+    """
+    query = query.strip()
+    pattern = _like_prefix(query)
+    results = []
 
-def get_user_stats(user_id: int):
-    db = get_db()
-    row = db.execute(
-        "SELECT COUNT(*), COALESCE(SUM(duration), 0) FROM workouts WHERE user_id = ?",
-        (user_id,),
-    ).fetchone()
+    for db in data_dbs():
+        if not query:
+            results.append(db.execute(f"{_SUGGEST_SELECT} {_SUGGEST_ORDER}", (limit,)).fetchall())
+            continue
+        for wtype in _matching_types(db, query, pattern):
+            results.append(db.execute(
+                f"{_SUGGEST_SELECT} WHERE w.type = ? COLLATE NOCASE {_SUGGEST_ORDER}",
+                (wtype, limit),
+            ).fetchall())
+        if re.fullmatch(r"[\d-]+", query):
+            results.append(db.execute(
+                f"{_SUGGEST_SELECT} WHERE w.date GLOB ? {_SUGGEST_ORDER}",
+                (query + "*", limit),
+            ).fetchall())
+
+    if query:
+        results.extend(_user_matches(pattern, limit, user_lookups))
+
+    # A workout can match both by type and by username
+    found = {}
+    merged = heapq.merge(*results, key=lambda r: (r["date"], r["id"]), reverse=True)
+    for row in merged:
+        found.setdefault(row["id"], dict(row))
+        if len(found) == limit:
+            break
+    return list(found.values())
+
+
+def save_workout(
+    user_id: int,
+    date: str,
+    wtype: str,
+    duration: int,
+    description: Optional[str],
+    category_ids: Iterable[int],
+    workout_id: Optional[int] = None,
+) -> Optional[int]:
+    """Insert a workout, or update one of the user's, with its categories.
+
+    Everything happens in one transaction. Returns the workout id, or
+    None when workout_id is not one of the user's workouts.
+    """
+    category_ids = list(category_ids)
+    new_id = next_id("workouts") if workout_id is None else None
+
+    def write(db):
+        if workout_id is None:
+            cur = db.execute(
+                """
+                INSERT INTO workouts (id, user_id, date, type, duration, description)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (new_id, user_id, date, wtype, duration, description),
+            )
+            saved_id = int(cur.lastrowid)
+        else:
+            cur = db.execute(
+                """
+                UPDATE workouts
+                SET date = ?, type = ?, duration = ?, description = ?
+                WHERE id = ? AND user_id = ?
+                """,
+                (date, wtype, duration, description, workout_id, user_id),
+            )
+            if cur.rowcount == 0:
+                return None
+            saved_id = workout_id
+
+        sync_workout_categories(db, saved_id, category_ids)
+        return saved_id
+
+    return run_write(write, tables=("workouts", "workout_categories"), user_id=user_id)
+
+def delete_workout_by_id(workout_id: int, user_id: int):
+    def write(db):
+        cur = db.execute(
+            "DELETE FROM workouts WHERE id = ? AND user_id = ?",
+            (workout_id, user_id),
+        )
+        return cur.rowcount > 0
+
+    return run_write(
+        write, tables=("workouts", "workout_categories", "messages"), user_id=user_id
+    )
+
+@cached("workouts")
+def get_user_stats(
+    user_id: int,
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+):
+    """Totals of the user's workouts, from the rollup unless a range is given"""
+    db = get_db(user_id)
+    if date_from is None and date_to is None:
+        row = db.execute(
+            "SELECT count, minutes FROM user_totals WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+    else:
+        where, params = _day_range(date_from, date_to)
+        row = db.execute(
+            f"""SELECT COUNT(*), COALESCE(SUM(w.duration), 0)
+                FROM workouts w
+                WHERE w.user_id = ? AND {where}""",
+            (user_id, *params),
+        ).fetchone()
 
     return {
-        "total_count": row[0] or 0,
-        "total_minutes": row[1] or 0,
+        "total_count": row[0] if row else 0,
+        "total_minutes": row[1] if row else 0,
     }
 
 
-def get_user_stats_by_type(user_id: int):
-    db = get_db()
-    rows = db.execute(
-        """SELECT type, COUNT(*), COALESCE(SUM(duration), 0)
-           FROM workouts
-           WHERE user_id = ?
-           GROUP BY type
-           ORDER BY COUNT(*) DESC, type ASC""",
-        (user_id,),
-    ).fetchall()
+@cached("workouts")
+def get_user_stats_by_type(
+    user_id: int,
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+):
+    db = get_db(user_id)
+    if date_from is None and date_to is None:
+        rows = db.execute(
+            """SELECT type, count, minutes
+               FROM user_type_totals
+               WHERE user_id = ?
+               ORDER BY count DESC, type ASC""",
+            (user_id,),
+        ).fetchall()
+    else:
+        where, params = _day_range(date_from, date_to)
+        rows = db.execute(
+            f"""SELECT w.type, COUNT(*) AS count, SUM(w.duration) AS minutes
+                FROM workouts w
+                WHERE w.user_id = ? AND {where}
+                GROUP BY w.type
+                ORDER BY count DESC, w.type ASC""",
+            (user_id, *params),
+        ).fetchall()
 
     return [
         {"type": r[0], "count": r[1], "minutes": r[2]}
         for r in rows
     ]
 
-def list_workouts_by_user(user_id: int):
+
+def rebuild_user_stats() -> None:
+    """Recompute the user_totals and user_type_totals rollups from workouts"""
     db = get_db()
-    return db.execute(
+    with db:
+        db.execute("DELETE FROM user_totals")
+        db.execute("DELETE FROM user_type_totals")
+        db.execute(
+            """INSERT INTO user_totals (user_id, count, minutes)
+               SELECT user_id, COUNT(*), COALESCE(SUM(duration), 0)
+               FROM workouts
+               GROUP BY user_id"""
+        )
+        db.execute(
+            """INSERT INTO user_type_totals (user_id, type, count, minutes)
+               SELECT user_id, type, COUNT(*), COALESCE(SUM(duration), 0)
+               FROM workouts
+               GROUP BY user_id, type"""
+        )
+
+
+def find_user_stats_mismatches() -> List[Dict]:
+    """Compare the rollups against a live aggregate over workouts"""
+    db = get_db()
+    rows = db.execute(
         """
-        SELECT
-            w.id,
-            w.date,
-            w.type,
-            w.duration,
-            w.description,
-            u.username
+        WITH live AS (
+            SELECT user_id, type, COUNT(*) AS count, SUM(duration) AS minutes
+            FROM workouts
+            GROUP BY user_id, type
+        ),
+        live_totals AS (
+            SELECT user_id, NULL AS type, SUM(count) AS count, SUM(minutes) AS minutes
+            FROM live
+            GROUP BY user_id
+        ),
+        expected AS (
+            SELECT * FROM live
+            UNION ALL
+            SELECT * FROM live_totals
+        ),
+        actual AS (
+            SELECT user_id, type, count, minutes FROM user_type_totals
+            UNION ALL
+            SELECT user_id, NULL, count, minutes FROM user_totals
+        )
+        SELECT e.user_id, e.type, e.count AS expected_count, e.minutes AS expected_minutes,
+               a.count AS actual_count, a.minutes AS actual_minutes
+        FROM expected e
+        LEFT JOIN actual a ON a.user_id = e.user_id AND a.type IS e.type
+        WHERE a.count IS NOT e.count OR a.minutes IS NOT e.minutes
+        UNION ALL
+        SELECT a.user_id, a.type, NULL, NULL, a.count, a.minutes
+        FROM actual a
+        LEFT JOIN expected e ON e.user_id = a.user_id AND e.type IS a.type
+        WHERE e.user_id IS NULL
+        """
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+@cached("workouts", "users")
+def list_workouts_by_user(
+    user_id: int,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+    fields: Optional[tuple] = None,
+    date_from: Optional[datetime.date] = None,
+    date_to: Optional[datetime.date] = None,
+) -> Dict:
+    db = get_db(user_id)
+    columns, join = _workout_columns(
+        fields, ("id", "date", "type", "duration", "description", "username")
+    )
+    where, params = _day_range(date_from, date_to)
+    return fetch_page(
+        db,
+        f"""
+        SELECT {columns}
         FROM workouts w
-        JOIN users u ON u.id = w.user_id
-        WHERE w.user_id = ?
-        ORDER BY w.date DESC, w.id DESC
+        {join}
+        WHERE w.user_id = ? AND {where} AND {{seek}}
+        ORDER BY {{order}}
+        """,
+        (user_id, *params),
+        ("w.day", "w.id"),
+        cursor,
+        limit,
+        lambda r: (r["day"], r["id"]),
+    )
+
+
+def get_user_workout_version(user_id: int) -> Optional[int]:
+    """Counter that changes whenever one of the user's workouts does"""
+    try:
+        row = get_db(user_id).execute(
+            "SELECT version FROM user_workout_versions WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+    except sqlite3.OperationalError:
+        # Migration 0008 not applied, callers then skip caching
+        return None
+    return row["version"] if row else 0
+
+
+def get_workout_series(user_id: int) -> List[tuple]:
+    """(date, duration, type) of every workout of the user, oldest first"""
+    db = get_db(user_id)
+    return db.execute(
+        """
+        SELECT date, duration, type
+        FROM workouts
+        WHERE user_id = ? AND day > 0
+        ORDER BY day, id
         """,
         (user_id,),
-    ).fetchall()
\ No newline at end of file
+    ).fetchall()
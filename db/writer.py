@@ -0,0 +1,286 @@
+from __future__ import annotations
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Iterable, Optional
+
+from flask import current_app, g
+
+from .cache import bump_versions, forget_versions
+from .connection import (
+    ConnectionPool,
+    _connection,
+    database_path,
+    directory_path,
+    user_path,
+)
+
+DEFAULT_WRITE_BATCH = 64
+DEFAULT_WRITE_TIMEOUT = 30.0
+
+_writers = {}
+_writers_lock = threading.Lock()
+_writers_pid = os.getpid()
+
+
+class _Job:
+    __slots__ = ("fn", "done", "result", "error", "state", "lock")
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.state = "queued"
+        self.lock = threading.Lock()
+
+    def start(self) -> bool:
+        """Claim the job for the writer, False if the caller gave up on it"""
+        with self.lock:
+            if self.state == "cancelled":
+                return False
+            self.state = "running"
+            return True
+
+    def cancel(self) -> bool:
+        """Withdraw a job that has not started, False if it already runs"""
+        with self.lock:
+            if self.state != "queued":
+                return False
+            self.state = "cancelled"
+            return True
+
+    def fail(self, error):
+        self.error = self.error or error
+        self.done.set()
+
+
+class Writer:
+    """Serializes all writes of one process through a single connection.
+
+    Jobs that pile up while the previous transaction commits are run
+    together in the next one, each inside its own savepoint, so a burst
+    of concurrent requests costs one commit instead of one per row and
+    a failing job only rolls back its own changes.
+    """
+
+    def __init__(self, path, max_batch=DEFAULT_WRITE_BATCH, pragmas=None):
+        self.path = path
+        self.max_batch = max_batch
+        self.jobs = queue.Queue()
+        self.pool = ConnectionPool(path, size=1, pragmas=pragmas)
+        self.commits = 0
+        self.writes = 0
+        self.thread = threading.Thread(
+            target=self._run, name=f"db-writer:{path}", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, fn: Callable[[sqlite3.Connection], Any], timeout=DEFAULT_WRITE_TIMEOUT):
+        job = _Job(fn)
+        self.jobs.put(job)
+        if not job.done.wait(timeout):
+            if job.cancel():
+                raise TimeoutError("database writer did not answer in time")
+            # Already inside a transaction, which either commits or
+            # rolls back shortly
+            job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def stop(self):
+        self.jobs.put(None)
+        self.thread.join()
+
+    def _run(self):
+        conn, batch = None, []
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    if conn is not None:
+                        conn.close()
+                    return
+
+                if conn is None:
+                    # Opened here so that a missing or unreadable file
+                    # fails this batch instead of the whole thread
+                    try:
+                        conn = self.pool.acquire()
+                    except sqlite3.Error as e:
+                        for job in batch:
+                            job.fail(e)
+                        continue
+                    conn.isolation_level = None
+                self._run_batch(conn, batch)
+        except BaseException as e:
+            _forget_writer(self)
+            if conn is not None:
+                # Rolls back the open transaction and frees the write lock
+                conn.close()
+            error = RuntimeError(f"database writer stopped: {e!r}")
+            for job in batch:
+                if not job.done.is_set():
+                    job.fail(error)
+            while True:
+                try:
+                    job = self.jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job.fail(error)
+            raise
+
+    def _next_batch(self):
+        job = self.jobs.get()
+        if job is None:
+            return None
+
+        batch = [job]
+        while len(batch) < self.max_batch:
+            try:
+                job = self.jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is None:
+                self.jobs.put(None)
+                break
+            batch.append(job)
+        return batch
+
+    def _run_batch(self, conn, batch):
+        # Jobs whose caller timed out are dropped unrun
+        batch = [job for job in batch if job.start()]
+        if not batch:
+            return
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job in batch:
+                conn.execute("SAVEPOINT job")
+                try:
+                    job.result = job.fn(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    job.error = e
+                conn.execute("RELEASE job")
+            conn.execute("COMMIT")
+            self.commits += 1
+            self.writes += len(batch)
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for job in batch:
+                job.error = job.error or e
+        # Not in a finally, jobs of a batch that killed the thread are
+        # failed by _run instead of looking committed
+        for job in batch:
+            job.done.set()
+
+
+def get_writer(path=None) -> Writer:
+    """Return the writer thread of this process for the app's database"""
+    global _writers_pid
+    config = current_app.config
+    path = path or database_path()
+
+    with _writers_lock:
+        if _writers_pid != os.getpid():
+            _writers.clear()
+            _writers_pid = os.getpid()
+
+        writer = _writers.get(path)
+        if writer is None or not writer.thread.is_alive():
+            writer = Writer(
+                path,
+                max_batch=config.get("DB_WRITE_BATCH", DEFAULT_WRITE_BATCH),
+                pragmas=config.get("DB_PRAGMAS"),
+            )
+            _writers[path] = writer
+    return writer
+
+
+def _forget_writer(writer: Writer):
+    """Drop a writer whose thread has died, the next write starts a new one"""
+    with _writers_lock:
+        if _writers.get(writer.path) is writer:
+            del _writers[writer.path]
+
+
+def writer_stats() -> list:
+    """Queue length and totals of every writer thread of this process"""
+    with _writers_lock:
+        writers = list(_writers.values())
+    return [
+        {
+            "path": writer.path,
+            "queued": writer.jobs.qsize(),
+            "commits": writer.commits,
+            "writes": writer.writes,
+        }
+        for writer in writers
+    ]
+
+
+def close_writers():
+    """Stop every writer thread of this process"""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.stop()
+
+
+def run_write(
+    fn: Callable[[sqlite3.Connection], Any],
+    tables: Iterable[str] = (),
+    user_id: Optional[int] = None,
+    path: Optional[str] = None,
+):
+    """Run fn(db) in a write transaction and return its result.
+
+    With DB_WRITE_QUEUE enabled the work goes through the process wide
+    writer thread, otherwise it runs on the request connection and is
+    committed right away. The change counters of `tables` are bumped in
+    the same transaction. The write goes to the shard of user_id, to
+    path, or to the directory database.
+    """
+    tables = tuple(tables)
+    if path is None:
+        path = user_path(user_id) if user_id is not None else directory_path()
+
+    def write(db):
+        result = fn(db)
+        if tables:
+            bump_versions(db, tables)
+        return result
+
+    queued = current_app.config.get("DB_WRITE_QUEUE", True)
+    stats = g.get("sql_stats") if queued else None
+    if stats is not None:
+        # The statements run on the writer thread, time the whole job
+        record = stats.add(f"-- write {getattr(fn, '__qualname__', 'job')}")
+        start = time.perf_counter()
+
+    try:
+        if queued:
+            return get_writer(path).submit(write)
+
+        db = _connection(path)
+        try:
+            result = write(db)
+        except Exception:
+            db.rollback()
+            raise
+        db.commit()
+        return result
+    finally:
+        if tables:
+            forget_versions()
+        if stats is not None:
+            elapsed = time.perf_counter() - start
+            record[1] += elapsed
+            stats.seconds += elapsed
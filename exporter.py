@@ -0,0 +1,147 @@
+"""Streaming export of a user's workouts and messages as CSV or NDJSON.
+
+Rows are read straight from the SQLite cursor and encoded one by one,
+so memory use does not depend on the size of the history and the first
+chunk is ready before the query has finished.
+"""
+from __future__ import annotations
+
+import csv
+import heapq
+import io
+import json
+import zlib
+from typing import Dict, Iterable, Iterator
+
+from db.connection import data_dbs, get_db
+
+FORMATS = ("csv", "ndjson")
+COLUMNS = (
+    "kind",
+    "id",
+    "date",
+    "type",
+    "duration",
+    "description",
+    "categories",
+    "workout_id",
+    "sender",
+    "receiver",
+    "content",
+    "created_at",
+)
+CHUNK_SIZE = 16 * 1024
+
+
+def iter_export_rows(user_id: int) -> Iterator[Dict]:
+    db = get_db(user_id)
+    workouts = db.execute(
+        """
+        SELECT
+            w.id,
+            w.date,
+            w.type,
+            w.duration,
+            w.description,
+            (SELECT group_concat(c.name, ';')
+             FROM workout_categories wc
+             JOIN categories c ON c.id = wc.category_id
+             WHERE wc.workout_id = w.id) AS categories
+        FROM workouts w
+        WHERE w.user_id = ?
+        ORDER BY w.day DESC, w.id DESC
+        """,
+        (user_id,),
+    )
+    for row in workouts:
+        yield {"kind": "workout", **dict(row)}
+
+    # Messages are kept in the shards of the workouts' owners. Every
+    # file gives one cursor on the sender index and one on the receiver
+    # index, and all the cursors are merged as they stream. Notes to self
+    # come from the sender cursor only.
+    select = """
+        SELECT
+            m.id,
+            m.workout_id,
+            s.username AS sender,
+            r.username AS receiver,
+            m.content,
+            m.created_at
+        FROM messages m
+        JOIN users s ON s.id = m.sender_id
+        JOIN users r ON r.id = m.receiver_id
+    """
+    order = "ORDER BY m.created_at DESC, m.id DESC"
+    cursors = []
+    for shard in data_dbs():
+        cursors.append(shard.execute(f"{select} WHERE m.sender_id = ? {order}", (user_id,)))
+        cursors.append(shard.execute(
+            f"{select} WHERE m.receiver_id = ? AND m.sender_id != ? {order}",
+            (user_id, user_id),
+        ))
+    messages = heapq.merge(
+        *cursors, key=lambda r: (r["created_at"], r["id"]), reverse=True
+    )
+    for row in messages:
+        yield {"kind": "message", **dict(row)}
+
+
+def _buffered(pieces: Iterable[str]) -> Iterator[bytes]:
+    pieces = iter(pieces)
+    first = next(pieces, None)
+    if first is not None:
+        # Send the first row right away instead of waiting for a full chunk
+        yield first.encode("utf-8")
+
+    buf = []
+    size = 0
+    for piece in pieces:
+        buf.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield "".join(buf).encode("utf-8")
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf).encode("utf-8")
+
+
+def _csv_lines(rows: Iterable[Dict]) -> Iterator[str]:
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=COLUMNS, extrasaction="ignore")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    yield out.getvalue()
+
+
+def _ndjson_lines(rows: Iterable[Dict]) -> Iterator[str]:
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def encode(rows: Iterable[Dict], fmt: str) -> Iterator[bytes]:
+    lines = _csv_lines(rows) if fmt == "csv" else _ndjson_lines(rows)
+    return _buffered(lines)
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Compress a byte stream into gzip format on the fly"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    first = True
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if first:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_user(user_id: int, fmt: str, compress: bool = False) -> Iterator[bytes]:
+    chunks = encode(iter_export_rows(user_id), fmt)
+    return gzip_chunks(chunks) if compress else chunks
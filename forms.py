@@ -0,0 +1,71 @@
+import re
+from datetime import date
+
+MIN_YEAR = 1900
+MAX_YEAR = 2100
+
+_ISO_DATE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+_FINNISH_DATE = re.compile(r"(\d{1,2})\.(\d{1,2})\.(\d{4})")
+
+
+def parse_date(raw):
+    """Parse YYYY-MM-DD or D.M.YYYY, None when it is not a real date"""
+    raw = (raw or "").strip()
+    match = _ISO_DATE.fullmatch(raw)
+    if match:
+        year, month, day = match.groups()
+    else:
+        match = _FINNISH_DATE.fullmatch(raw)
+        if not match:
+            return None
+        day, month, year = match.groups()
+
+    try:
+        parsed = date(int(year), int(month), int(day))
+    except ValueError:
+        return None
+    if not MIN_YEAR <= parsed.year <= MAX_YEAR:
+        return None
+    return parsed
+
+
+def parse_date_range(args):
+    """The from and to filters of a listing, invalid values are ignored"""
+    return parse_date(args.get("from")), parse_date(args.get("to"))
+
+
+def validate_workout_form(form):
+    date_raw = (form.get("date") or "").strip()
+    wtype = (form.get("type") or "").strip()
+    duration_raw = (form.get("duration") or "").strip()
+    description = (form.get("description") or "").strip()
+
+    errors = []
+
+    parsed_date = parse_date(date_raw)
+    if not date_raw:
+        errors.append("Päivämäärä vaaditaan.")
+    elif parsed_date is None:
+        errors.append("Päivämäärä ei kelpaa (VVVV-KK-PP).")
+    if not wtype:
+        errors.append("Tyyppi vaaditaan.")
+    if len(wtype) > 50:
+        errors.append("Tyyppi on liian pitkä (max 50).")
+    if len(description) > 1000:
+        errors.append("Kuvaus on liian pitkä (max 1000).")
+
+    try:
+        duration_val = int(duration_raw)
+        if duration_val < 0 or duration_val > 100000:
+            errors.append("Kesto ei kelpaa.")
+    except ValueError:
+        errors.append("Keston tulee olla kokonaisluku.")
+        duration_val = None
+
+    return {
+        "date": parsed_date.isoformat() if parsed_date else date_raw,
+        "type": wtype,
+        "duration": duration_raw,
+        "description": description,
+        "duration_val": duration_val,
+    }, errors
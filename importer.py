@@ -0,0 +1,181 @@
+"""Bulk import of workout history from CSV or NDJSON files.
+
+Rows are read one at a time, validated with the same rules as the
+workout form and inserted in batches, each batch in one transaction.
+Columns: date, type, duration, description, categories. In CSV files
+categories are separated with ';', in NDJSON they can also be a list.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import json
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from db.categories import list_categories
+from db.shards import next_ids
+from db.writer import run_write
+from forms import validate_workout_form
+
+DEFAULT_BATCH_SIZE = 500
+FORMATS = ("csv", "ndjson")
+
+
+def detect_format(filename: str) -> Optional[str]:
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl", ".json")):
+        return "ndjson"
+    return None
+
+
+def iter_records(stream: io.TextIOBase, fmt: str) -> Iterator[Tuple[int, Dict]]:
+    """Yield (line number, record) pairs without reading the whole file"""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_no, record if isinstance(record, dict) else None
+
+
+def _category_names(raw) -> List[str]:
+    if raw is None:
+        return []
+    if isinstance(raw, list):
+        names = raw
+    else:
+        names = str(raw).split(";")
+    return [str(n).strip() for n in names if str(n).strip()]
+
+
+def _parse_record(record, category_ids: Dict[str, int]):
+    if record is None:
+        return None, ["Rivi ei ole kelvollinen JSON-olio."]
+
+    form = {
+        key: "" if record.get(key) is None else str(record.get(key))
+        for key in ("date", "type", "duration", "description")
+    }
+    data, errors = validate_workout_form(form)
+
+    ids = []
+    for name in _category_names(record.get("categories")):
+        cid = category_ids.get(name.lower())
+        if cid is None:
+            errors.append(f"Tuntematon luokka: {name}.")
+        else:
+            ids.append(cid)
+
+    return (data, ids), errors
+
+
+def _insert_batch(user_id: int, batch: List[Tuple[Dict, List[int]]]) -> None:
+    # Sharded databases need ids that are unique across the shards
+    new_ids = next_ids("workouts", len(batch)) or [None] * len(batch)
+
+    def write(db):
+        db.executemany(
+            """
+            INSERT INTO workouts (id, user_id, date, type, duration, description)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """,
+            [
+                (new_id, user_id, d["date"], d["type"], d["duration_val"], d["description"] or None)
+                for new_id, (d, _) in zip(new_ids, batch)
+            ],
+        )
+        if new_ids[0] is None:
+            # The writer holds the write lock, so the new ids are consecutive
+            last_id = db.execute("SELECT last_insert_rowid()").fetchone()[0]
+            workout_ids = range(last_id - len(batch) + 1, last_id + 1)
+        else:
+            workout_ids = new_ids
+        db.executemany(
+            """
+            INSERT OR IGNORE INTO workout_categories (workout_id, category_id)
+            VALUES (?, ?)
+            """,
+            [
+                (workout_id, cid)
+                for workout_id, (_, ids) in zip(workout_ids, batch)
+                for cid in ids
+            ],
+        )
+
+    run_write(write, tables=("workouts", "workout_categories"), user_id=user_id)
+
+
+def _readable(records: Iterable[Tuple[int, Dict]], on_error) -> Iterator[Tuple[int, Dict]]:
+    """The records up to the first undecodable or malformed part of the file"""
+    records = iter(records)
+    line_no = 0
+    while True:
+        try:
+            line_no, record = next(records)
+        except StopIteration:
+            return
+        except UnicodeDecodeError:
+            error = "Tiedosto ei ole UTF-8-muodossa, tuonti keskeytettiin."
+        except csv.Error as e:
+            error = f"Virheellinen CSV-rivi ({e}), tuonti keskeytettiin."
+        else:
+            yield line_no, record
+            continue
+        if on_error:
+            on_error(line_no + 1, [error])
+        return
+
+
+def import_workouts(
+    user_id: int,
+    records: Iterable[Tuple[int, Dict]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_error: Optional[Callable[[int, List[str]], None]] = None,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> Tuple[int, int]:
+    """Validate and insert records for one user.
+
+    Returns (imported, rejected). on_error gets the line number and the
+    error messages of each rejected row, on_progress the running totals
+    after every committed batch. A file that cannot be decoded or parsed
+    stops the import at that point, the rows before it are kept and the
+    reason goes to on_error.
+    """
+    category_ids = {c["name"].lower(): c["id"] for c in list_categories()}
+    imported = rejected = 0
+    batch = []
+
+    for line_no, record in _readable(records, on_error):
+        parsed, errors = _parse_record(record, category_ids)
+        if errors:
+            rejected += 1
+            if on_error:
+                on_error(line_no, errors)
+            continue
+
+        batch.append(parsed)
+        if len(batch) >= batch_size:
+            _insert_batch(user_id, batch)
+            imported += len(batch)
+            batch = []
+            if on_progress:
+                on_progress(imported, rejected)
+
+    if batch:
+        _insert_batch(user_id, batch)
+        imported += len(batch)
+        if on_progress:
+            on_progress(imported, rejected)
+
+    return imported, rejected
@@ -0,0 +1,263 @@
+"""Request and SQL metrics in the Prometheus text format at /metrics.
+
+Turned on with METRICS. Every request is then timed and its SQL
+statements are counted and timed through db.instrument. Statements
+slower than SLOW_QUERY_MS are written to the "sql.slow" log. With
+METRICS off the hooks return right away and get_db() hands out the
+plain connections.
+
+The numbers live in the memory of one process, with several workers
+each of them reports its own.
+"""
+from __future__ import annotations
+
+import bisect
+import logging
+import threading
+import time
+from typing import Dict, List, Sequence, Tuple
+
+from flask import Blueprint, Response, abort, current_app, g, jsonify, request
+
+from db.cache import get_cache
+from db.connection import pool_stats
+from db.instrument import QueryStats
+from db.writer import writer_stats
+from views import login_required
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+DEFAULT_SLOW_QUERY_MS = 100
+SLOWEST_STATEMENTS = 3
+
+bp = Blueprint("metrics", __name__)
+slow_log = logging.getLogger("sql.slow")
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total, result = 0, []
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            total += count
+            result.append((str(bound), total))
+        return result
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests: Dict[tuple, int] = {}
+        self.latency: Dict[str, Histogram] = {}
+        self.sql_queries: Dict[str, Histogram] = {}
+        self.sql_seconds: Dict[str, Histogram] = {}
+        self.slow_queries = 0
+
+    def observe(self, endpoint: str, method: str, status: int, seconds: float, stats) -> None:
+        with self.lock:
+            key = (endpoint, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self._histogram(self.latency, endpoint, LATENCY_BUCKETS).observe(seconds)
+            if stats is not None:
+                self._histogram(self.sql_queries, endpoint, QUERY_COUNT_BUCKETS).observe(stats.count)
+                self._histogram(self.sql_seconds, endpoint, LATENCY_BUCKETS).observe(stats.seconds)
+
+    @staticmethod
+    def _histogram(histograms, endpoint, buckets) -> Histogram:
+        histogram = histograms.get(endpoint)
+        if histogram is None:
+            histogram = histograms[endpoint] = Histogram(buckets)
+        return histogram
+
+    def clear(self) -> None:
+        with self.lock:
+            self.requests.clear()
+            self.latency.clear()
+            self.sql_queries.clear()
+            self.sql_seconds.clear()
+            self.slow_queries = 0
+
+
+registry = Registry()
+
+
+@bp.before_app_request
+def start_request_timer():
+    if not current_app.config.get("METRICS"):
+        return
+    g.request_started = time.perf_counter()
+    g.sql_stats = QueryStats()
+
+
+@bp.after_app_request
+def record_request(response):
+    started = g.pop("request_started", None)
+    if started is None:
+        return response
+
+    elapsed = time.perf_counter() - started
+    stats = g.pop("sql_stats", None)
+    endpoint = request.endpoint or "none"
+    registry.observe(endpoint, request.method, response.status_code, elapsed, stats)
+
+    if stats is not None:
+        log_slow_queries(stats, endpoint)
+        response.headers["Server-Timing"] = (
+            f'sql;dur={stats.seconds * 1000:.1f};desc="{stats.count} queries", '
+            f"app;dur={elapsed * 1000:.1f}"
+        )
+    return response
+
+
+def log_slow_queries(stats: QueryStats, endpoint: str) -> None:
+    threshold = current_app.config.get("SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS) / 1000
+    slow = [r for r in stats.slowest(SLOWEST_STATEMENTS) if r[1] >= threshold]
+    if not slow:
+        return
+
+    with registry.lock:
+        registry.slow_queries += len(slow)
+    for sql, seconds in slow:
+        slow_log.warning(
+            "%.1f ms %s (%d queries, %.1f ms SQL in the request): %s",
+            seconds * 1000,
+            endpoint,
+            stats.count,
+            stats.seconds * 1000,
+            " ".join(sql.split())[:500],
+        )
+
+
+def _labels(**labels) -> str:
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _histogram_lines(name: str, help_text: str, histograms: Dict[str, Histogram]) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for endpoint, histogram in sorted(histograms.items()):
+        for bound, count in histogram.cumulative():
+            lines.append(f"{name}_bucket{_labels(endpoint=endpoint, le=bound)} {count}")
+        lines.append(f"{name}_sum{_labels(endpoint=endpoint)} {histogram.sum:.6f}")
+        lines.append(f"{name}_count{_labels(endpoint=endpoint)} {histogram.count}")
+    return lines
+
+
+def _gauge_lines(name: str, help_text: str, kind: str, samples) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{_labels(**labels)} {value}" for labels, value in samples)
+    return lines
+
+
+def render() -> str:
+    with registry.lock:
+        requests = sorted(registry.requests.items())
+        lines = _gauge_lines(
+            "app_requests_total",
+            "Requests by endpoint, method and status.",
+            "counter",
+            [
+                ({"endpoint": e, "method": m, "status": s}, count)
+                for (e, m, s), count in requests
+            ],
+        )
+        lines += _histogram_lines(
+            "app_request_duration_seconds",
+            "Time to build the response.",
+            registry.latency,
+        )
+        lines += _histogram_lines(
+            "app_sql_queries_per_request",
+            "SQL statements run by one request.",
+            registry.sql_queries,
+        )
+        lines += _histogram_lines(
+            "app_sql_duration_seconds",
+            "Time spent in SQL by one request.",
+            registry.sql_seconds,
+        )
+        lines += [
+            "# HELP app_sql_slow_queries_total Statements over SLOW_QUERY_MS.",
+            "# TYPE app_sql_slow_queries_total counter",
+            f"app_sql_slow_queries_total {registry.slow_queries}",
+        ]
+
+    pools = pool_stats()
+    for field, help_text in (
+        ("size", "Idle connections the pool keeps."),
+        ("opened", "Open connections."),
+        ("in_use", "Connections handed out to requests."),
+        ("idle", "Connections waiting in the pool."),
+    ):
+        lines += _gauge_lines(
+            f"app_db_pool_{field}",
+            help_text,
+            "gauge",
+            [
+                ({"path": p["path"], "readonly": str(p["readonly"]).lower()}, p[field])
+                for p in pools
+            ],
+        )
+
+    writers = writer_stats()
+    lines += _gauge_lines(
+        "app_db_writer_queued",
+        "Write jobs waiting for the writer thread.",
+        "gauge",
+        [({"path": w["path"]}, w["queued"]) for w in writers],
+    )
+    lines += _gauge_lines(
+        "app_db_writer_commits_total",
+        "Transactions committed by the writer thread.",
+        "counter",
+        [({"path": w["path"]}, w["commits"]) for w in writers],
+    )
+    lines += _gauge_lines(
+        "app_db_writer_jobs_total",
+        "Write jobs run by the writer thread.",
+        "counter",
+        [({"path": w["path"]}, w["writes"]) for w in writers],
+    )
+
+    cache = get_cache().stats()
+    for field, kind in (
+        ("size", "gauge"),
+        ("hits", "counter"),
+        ("misses", "counter"),
+        ("evictions", "counter"),
+    ):
+        name = f"app_query_cache_{field}" + ("_total" if kind == "counter" else "")
+        lines += [f"# TYPE {name} {kind}", f"{name} {cache[field]}"]
+
+    return "\n".join(lines) + "\n"
+
+
+@bp.route("/metrics")
+def metrics():
+    if not current_app.config.get("METRICS"):
+        abort(404)
+    token = current_app.config.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        abort(403)
+    return Response(render(), mimetype="text/plain; version=0.0.4")
+
+
+@bp.route("/cache-stats")
+@login_required
+def cache_stats():
+    return jsonify(get_cache().stats())
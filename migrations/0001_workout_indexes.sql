@@ -0,0 +1,12 @@
+-- Per-user listings and stats: list_workouts, list_workouts_by_user,
+-- get_user_stats and get_user_stats_by_type
+CREATE INDEX IF NOT EXISTS idx_workouts_user_date
+    ON workouts (user_id, date DESC, id DESC);
+
+-- Global listings: list_all_workouts and list_workouts_for_messages
+CREATE INDEX IF NOT EXISTS idx_workouts_date
+    ON workouts (date DESC, id DESC);
+
+-- Deleting a category and looking up workouts by category
+CREATE INDEX IF NOT EXISTS idx_workout_categories_category
+    ON workout_categories (category_id, workout_id);
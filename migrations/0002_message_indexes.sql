@@ -0,0 +1,14 @@
+-- list_messages_full
+CREATE INDEX IF NOT EXISTS idx_messages_created
+    ON messages (created_at DESC, id DESC);
+
+-- list_messages
+CREATE INDEX IF NOT EXISTS idx_messages_receiver_created
+    ON messages (receiver_id, created_at DESC, id DESC);
+
+-- Cascading deletes from workouts and users
+CREATE INDEX IF NOT EXISTS idx_messages_workout
+    ON messages (workout_id);
+
+CREATE INDEX IF NOT EXISTS idx_messages_sender
+    ON messages (sender_id);
@@ -0,0 +1,83 @@
+-- Per-user rollups for get_user_stats and get_user_stats_by_type,
+-- kept up to date by the triggers below
+CREATE TABLE IF NOT EXISTS user_totals (
+    user_id INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL DEFAULT 0,
+    minutes INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS user_type_totals (
+    user_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    minutes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, type)
+);
+
+DELETE FROM user_totals;
+DELETE FROM user_type_totals;
+
+INSERT INTO user_totals (user_id, count, minutes)
+SELECT user_id, COUNT(*), COALESCE(SUM(duration), 0)
+FROM workouts
+GROUP BY user_id;
+
+INSERT INTO user_type_totals (user_id, type, count, minutes)
+SELECT user_id, type, COUNT(*), COALESCE(SUM(duration), 0)
+FROM workouts
+GROUP BY user_id, type;
+
+CREATE TRIGGER IF NOT EXISTS workouts_stats_insert
+AFTER INSERT ON workouts BEGIN
+    INSERT INTO user_totals (user_id, count, minutes)
+    VALUES (new.user_id, 1, new.duration)
+    ON CONFLICT (user_id) DO UPDATE
+    SET count = count + 1, minutes = minutes + excluded.minutes;
+
+    INSERT INTO user_type_totals (user_id, type, count, minutes)
+    VALUES (new.user_id, new.type, 1, new.duration)
+    ON CONFLICT (user_id, type) DO UPDATE
+    SET count = count + 1, minutes = minutes + excluded.minutes;
+END;
+
+CREATE TRIGGER IF NOT EXISTS workouts_stats_delete
+AFTER DELETE ON workouts BEGIN
+    UPDATE user_totals
+    SET count = count - 1, minutes = minutes - old.duration
+    WHERE user_id = old.user_id;
+
+    DELETE FROM user_totals WHERE user_id = old.user_id AND count <= 0;
+
+    UPDATE user_type_totals
+    SET count = count - 1, minutes = minutes - old.duration
+    WHERE user_id = old.user_id AND type = old.type;
+
+    DELETE FROM user_type_totals
+    WHERE user_id = old.user_id AND type = old.type AND count <= 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS workouts_stats_update
+AFTER UPDATE OF user_id, type, duration ON workouts BEGIN
+    UPDATE user_totals
+    SET count = count - 1, minutes = minutes - old.duration
+    WHERE user_id = old.user_id;
+
+    DELETE FROM user_totals WHERE user_id = old.user_id AND count <= 0;
+
+    INSERT INTO user_totals (user_id, count, minutes)
+    VALUES (new.user_id, 1, new.duration)
+    ON CONFLICT (user_id) DO UPDATE
+    SET count = count + 1, minutes = minutes + excluded.minutes;
+
+    UPDATE user_type_totals
+    SET count = count - 1, minutes = minutes - old.duration
+    WHERE user_id = old.user_id AND type = old.type;
+
+    DELETE FROM user_type_totals
+    WHERE user_id = old.user_id AND type = old.type AND count <= 0;
+
+    INSERT INTO user_type_totals (user_id, type, count, minutes)
+    VALUES (new.user_id, new.type, 1, new.duration)
+    ON CONFLICT (user_id, type) DO UPDATE
+    SET count = count + 1, minutes = minutes + excluded.minutes;
+END;
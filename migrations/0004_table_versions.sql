@@ -0,0 +1,14 @@
+-- Change counters for the query result cache in db/cache.py. The write
+-- helpers bump the counters of the tables they modify in the same
+-- transaction, so every process sees a change on its next read.
+CREATE TABLE IF NOT EXISTS table_versions (
+    name TEXT PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+INSERT OR IGNORE INTO table_versions (name) VALUES
+    ('users'),
+    ('workouts'),
+    ('categories'),
+    ('workout_categories'),
+    ('messages');
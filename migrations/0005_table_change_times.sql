@@ -0,0 +1,4 @@
+-- Last change time per table for Last-Modified headers
+ALTER TABLE table_versions ADD COLUMN changed_at INTEGER NOT NULL DEFAULT 0;
+
+UPDATE table_versions SET changed_at = CAST(strftime('%s', 'now') AS INTEGER);
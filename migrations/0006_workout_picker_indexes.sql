@@ -0,0 +1,8 @@
+-- Typeahead workout picker: suggest_workouts matches prefixes of the
+-- workout type and the username case-insensitively with LIKE, which
+-- can only use an index built with the NOCASE collation
+CREATE INDEX IF NOT EXISTS idx_workouts_type_nocase
+    ON workouts (type COLLATE NOCASE, date DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_users_username_nocase
+    ON users (username COLLATE NOCASE);
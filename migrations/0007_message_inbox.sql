@@ -0,0 +1,41 @@
+-- Per-user inbox and sent views and the per-workout thread view in
+-- db/messages.py. Messages from before this migration count as read.
+ALTER TABLE messages ADD COLUMN read_at TEXT;
+
+UPDATE messages SET read_at = created_at;
+
+-- The global listing is gone, the inbox uses idx_messages_receiver_created
+DROP INDEX IF EXISTS idx_messages_created;
+
+DROP INDEX IF EXISTS idx_messages_sender;
+CREATE INDEX IF NOT EXISTS idx_messages_sender_created
+    ON messages (sender_id, created_at DESC, id DESC);
+
+DROP INDEX IF EXISTS idx_messages_workout;
+CREATE INDEX IF NOT EXISTS idx_messages_workout_created
+    ON messages (workout_id, created_at DESC, id DESC);
+
+-- Unread counter for the navigation bar, kept up to date by the
+-- triggers below so showing it is a primary key lookup
+CREATE TABLE IF NOT EXISTS user_inbox (
+    user_id INTEGER PRIMARY KEY,
+    unread INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TRIGGER IF NOT EXISTS messages_inbox_insert
+AFTER INSERT ON messages WHEN new.read_at IS NULL BEGIN
+    INSERT INTO user_inbox (user_id, unread)
+    VALUES (new.receiver_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET unread = unread + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS messages_inbox_delete
+AFTER DELETE ON messages WHEN old.read_at IS NULL BEGIN
+    UPDATE user_inbox SET unread = unread - 1 WHERE user_id = old.receiver_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS messages_inbox_read
+AFTER UPDATE OF read_at ON messages
+WHEN old.read_at IS NULL AND new.read_at IS NOT NULL BEGIN
+    UPDATE user_inbox SET unread = unread - 1 WHERE user_id = old.receiver_id;
+END;
@@ -0,0 +1,32 @@
+-- Per-user change counter for the training load analytics, so a write
+-- by one user does not invalidate everybody's cached results
+CREATE TABLE IF NOT EXISTS user_workout_versions (
+    user_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0
+);
+
+INSERT OR IGNORE INTO user_workout_versions (user_id)
+SELECT DISTINCT user_id FROM workouts;
+
+CREATE TRIGGER IF NOT EXISTS workouts_version_insert
+AFTER INSERT ON workouts BEGIN
+    INSERT INTO user_workout_versions (user_id, version)
+    VALUES (new.user_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS workouts_version_delete
+AFTER DELETE ON workouts BEGIN
+    UPDATE user_workout_versions SET version = version + 1
+    WHERE user_id = old.user_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS workouts_version_update
+AFTER UPDATE OF user_id, date, type, duration ON workouts BEGIN
+    UPDATE user_workout_versions SET version = version + 1
+    WHERE user_id = old.user_id;
+
+    INSERT INTO user_workout_versions (user_id, version)
+    VALUES (new.user_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+END;
@@ -0,0 +1,134 @@
+-- Leaderboard rollups for db/leaderboard.py. period 'week' buckets by
+-- the Monday of the ISO week, 'month' by YYYY-MM and 'all' has the
+-- single bucket ''. category_id 0 counts every workout, other rows
+-- only the workouts in that category.
+CREATE TABLE IF NOT EXISTS leaderboard_totals (
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    category_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    minutes INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (period, bucket, category_id, user_id)
+);
+
+-- Top N by minutes or by count straight from the index
+CREATE INDEX IF NOT EXISTS idx_leaderboard_minutes
+    ON leaderboard_totals (period, bucket, category_id, minutes DESC, count DESC, user_id);
+
+CREATE INDEX IF NOT EXISTS idx_leaderboard_count
+    ON leaderboard_totals (period, bucket, category_id, count DESC, minutes DESC, user_id);
+
+-- Every (period, bucket, category) a workout counts towards. Workouts
+-- with a date SQLite cannot parse only count towards 'all'.
+CREATE VIEW IF NOT EXISTS leaderboard_entries AS
+SELECT
+    w.id AS workout_id,
+    p.period,
+    CASE p.period
+        WHEN 'week' THEN date(w.date, '-6 days', 'weekday 1')
+        WHEN 'month' THEN strftime('%Y-%m', w.date)
+        ELSE ''
+    END AS bucket,
+    c.category_id,
+    w.user_id,
+    w.duration
+FROM workouts w
+CROSS JOIN (SELECT 'week' AS period UNION ALL SELECT 'month' UNION ALL SELECT 'all') p
+JOIN (
+    SELECT workout_id, category_id FROM workout_categories
+    UNION ALL
+    SELECT id, 0 FROM workouts
+) c ON c.workout_id = w.id
+WHERE bucket IS NOT NULL;
+
+DELETE FROM leaderboard_totals;
+
+INSERT INTO leaderboard_totals (period, bucket, category_id, user_id, count, minutes)
+SELECT period, bucket, category_id, user_id, COUNT(*), SUM(duration)
+FROM leaderboard_entries
+GROUP BY period, bucket, category_id, user_id;
+
+-- The triggers add a workout's entries once it is complete and take
+-- them away while it still is, so date, duration and owner changes
+-- move the workout between buckets. Rows that drop to zero are removed.
+CREATE TRIGGER IF NOT EXISTS workouts_leaderboard_insert
+AFTER INSERT ON workouts BEGIN
+    INSERT INTO leaderboard_totals (period, bucket, category_id, user_id, count, minutes)
+    SELECT period, bucket, category_id, user_id, 1, duration
+    FROM leaderboard_entries WHERE workout_id = new.id
+    ON CONFLICT DO UPDATE
+    SET count = count + excluded.count, minutes = minutes + excluded.minutes;
+END;
+
+-- Before the delete, while the workout and its categories still exist
+CREATE TRIGGER IF NOT EXISTS workouts_leaderboard_delete
+BEFORE DELETE ON workouts BEGIN
+    INSERT INTO leaderboard_totals (period, bucket, category_id, user_id, count, minutes)
+    SELECT period, bucket, category_id, user_id, -1, -duration
+    FROM leaderboard_entries WHERE workout_id = old.id
+    ON CONFLICT DO UPDATE
+    SET count = count + excluded.count, minutes = minutes + excluded.minutes;
+
+    DELETE FROM leaderboard_totals
+    WHERE count = 0
+      AND (period, bucket, category_id, user_id) IN (
+          SELECT period, bucket, category_id, user_id
+          FROM leaderboard_entries WHERE workout_id = old.id
+      );
+END;
+
+CREATE TRIGGER IF NOT EXISTS workouts_leaderboard_update_old
+BEFORE UPDATE OF user_id, date, duration ON workouts BEGIN
+    INSERT INTO leaderboard_totals (period, bucket, category_id, user_id, count, minutes)
+    SELECT period, bucket, category_id, user_id, -1, -duration
+    FROM leaderboard_entries WHERE workout_id = old.id
+    ON CONFLICT DO UPDATE
+    SET count = count + excluded.count, minutes = minutes + excluded.minutes;
+
+    DELETE FROM leaderboard_totals
+    WHERE count = 0
+      AND (period, bucket, category_id, user_id) IN (
+          SELECT period, bucket, category_id, user_id
+          FROM leaderboard_entries WHERE workout_id = old.id
+      );
+END;
+
+CREATE TRIGGER IF NOT EXISTS workouts_leaderboard_update_new
+AFTER UPDATE OF user_id, date, duration ON workouts BEGIN
+    INSERT INTO leaderboard_totals (period, bucket, category_id, user_id, count, minutes)
+    SELECT period, bucket, category_id, user_id, 1, duration
+    FROM leaderboard_entries WHERE workout_id = new.id
+    ON CONFLICT DO UPDATE
+    SET count = count + excluded.count, minutes = minutes + excluded.minutes;
+END;
+
+CREATE TRIGGER IF NOT EXISTS workout_categories_leaderboard_insert
+AFTER INSERT ON workout_categories BEGIN
+    INSERT INTO leaderboard_totals (period, bucket, category_id, user_id, count, minutes)
+    SELECT period, bucket, category_id, user_id, 1, duration
+    FROM leaderboard_entries
+    WHERE workout_id = new.workout_id AND category_id = new.category_id
+    ON CONFLICT DO UPDATE
+    SET count = count + excluded.count, minutes = minutes + excluded.minutes;
+END;
+
+-- When the workout itself is being deleted it is already gone here and
+-- workouts_leaderboard_delete has done the work
+CREATE TRIGGER IF NOT EXISTS workout_categories_leaderboard_delete
+BEFORE DELETE ON workout_categories BEGIN
+    INSERT INTO leaderboard_totals (period, bucket, category_id, user_id, count, minutes)
+    SELECT period, bucket, category_id, user_id, -1, -duration
+    FROM leaderboard_entries
+    WHERE workout_id = old.workout_id AND category_id = old.category_id
+    ON CONFLICT DO UPDATE
+    SET count = count + excluded.count, minutes = minutes + excluded.minutes;
+
+    DELETE FROM leaderboard_totals
+    WHERE count = 0
+      AND (period, bucket, category_id, user_id) IN (
+          SELECT period, bucket, category_id, user_id
+          FROM leaderboard_entries
+          WHERE workout_id = old.workout_id AND category_id = old.category_id
+      );
+END;
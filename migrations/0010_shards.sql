@@ -0,0 +1,20 @@
+-- Sharded mode (DB_SHARDS > 0) for db/shards.py. user_shards lives in
+-- the directory database and maps users to their shard file, users
+-- without a row keep their data in the directory itself.
+CREATE TABLE IF NOT EXISTS user_shards (
+    user_id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL
+);
+
+-- Workout and message ids are handed out in blocks from the directory
+-- so they stay unique across the shard files
+CREATE TABLE IF NOT EXISTS id_blocks (
+    name TEXT PRIMARY KEY,
+    next_id INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO id_blocks (name, next_id)
+SELECT 'workouts', COALESCE(MAX(id), 0) + 1 FROM workouts;
+
+INSERT OR IGNORE INTO id_blocks (name, next_id)
+SELECT 'messages', COALESCE(MAX(id), 0) + 1 FROM messages;
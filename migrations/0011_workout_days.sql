@@ -0,0 +1,40 @@
+-- Normalized workout dates. The form only accepts ISO dates from now
+-- on, older rows are converted here: surrounding spaces, Finnish
+-- D.M.YYYY dates and ISO dates with a time part or an impossible day.
+UPDATE workouts SET date = trim(date) WHERE date <> trim(date);
+
+UPDATE workouts
+SET date = printf(
+    '%04d-%02d-%02d',
+    CAST(substr(date, instr(date, '.') + 1 + instr(substr(date, instr(date, '.') + 1), '.')) AS INTEGER),
+    CAST(substr(date, instr(date, '.') + 1) AS INTEGER),
+    CAST(date AS INTEGER)
+)
+WHERE date GLOB '[0-9]*.[0-9]*.[0-9][0-9][0-9][0-9]';
+
+-- '+0 days' also rolls overflowing days like 2026-02-31 into March
+UPDATE workouts SET date = date(date, '+0 days')
+WHERE date(date, '+0 days') <> date;
+
+-- day is the Julian day number of the date, 0 for the rows that still
+-- do not parse so they sort last instead of dropping out of listings.
+-- week is the day number of the Monday starting the ISO week. The
+-- columns are computed from date, ALTER TABLE cannot add STORED ones.
+ALTER TABLE workouts ADD COLUMN day INTEGER
+    GENERATED ALWAYS AS (COALESCE(CAST(julianday(date) + 0.5 AS INTEGER), 0)) VIRTUAL;
+
+ALTER TABLE workouts ADD COLUMN year INTEGER
+    GENERATED ALWAYS AS (CAST(strftime('%Y', date) AS INTEGER)) VIRTUAL;
+
+ALTER TABLE workouts ADD COLUMN week INTEGER
+    GENERATED ALWAYS AS (CASE WHEN day > 0 THEN day - day % 7 END) VIRTUAL;
+
+-- Listings, from/to ranges and the stats of a range per user and for
+-- everybody, newest first
+DROP INDEX IF EXISTS idx_workouts_user_date;
+
+CREATE INDEX IF NOT EXISTS idx_workouts_user_day
+    ON workouts (user_id, day DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS idx_workouts_day
+    ON workouts (day DESC, id DESC);
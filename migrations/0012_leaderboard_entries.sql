@@ -0,0 +1,27 @@
+-- leaderboard_entries takes workout_id from the category side of the
+-- join. Inside the triggers `workout_id = new.id` is not a constant, so
+-- SQLite could not carry it over from w.id and materialized every
+-- workout and category row on each insert, update and delete. Filtering
+-- on c.workout_id is pushed into both halves of the UNION ALL.
+DROP VIEW IF EXISTS leaderboard_entries;
+
+CREATE VIEW leaderboard_entries AS
+SELECT
+    c.workout_id,
+    p.period,
+    CASE p.period
+        WHEN 'week' THEN date(w.date, '-6 days', 'weekday 1')
+        WHEN 'month' THEN strftime('%Y-%m', w.date)
+        ELSE ''
+    END AS bucket,
+    c.category_id,
+    w.user_id,
+    w.duration
+FROM workouts w
+CROSS JOIN (SELECT 'week' AS period UNION ALL SELECT 'month' UNION ALL SELECT 'all') p
+JOIN (
+    SELECT workout_id, category_id FROM workout_categories
+    UNION ALL
+    SELECT id, 0 FROM workouts
+) c ON c.workout_id = w.id
+WHERE bucket IS NOT NULL;
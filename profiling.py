@@ -0,0 +1,207 @@
+"""On-demand cProfile of production requests.
+
+Off unless PROFILE_SAMPLE_RATE or PROFILE_SECRET is set. A sampled
+fraction of requests is profiled, and so is any request that carries
+an X-Profile header signed with PROFILE_SECRET (see `flask
+profile-token`). Every profile is dumped in pstats format to
+PROFILE_DIR/<endpoint>/, the oldest files are removed once the
+directory grows past PROFILE_MAX_BYTES. `flask profile-report` merges
+them into the top hotspots per endpoint.
+
+Streamed response bodies are produced after the profile is closed and
+are not included. One request per process is profiled at a time, a
+request wanted while another is being profiled runs unprofiled.
+"""
+from __future__ import annotations
+
+import hashlib
+import hmac
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from flask import Blueprint, current_app, g, request
+
+if TYPE_CHECKING:
+    import cProfile
+
+PROFILE_HEADER = "X-Profile"
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_TOKEN_TTL = 600
+SORT_KEYS = ("tottime", "cumtime")
+
+bp = Blueprint("profiling", __name__)
+log = logging.getLogger("profiling")
+_sequence = itertools.count()
+# cProfile cannot run twice at once on Python 3.12+, and there it would
+# also record the other threads of the process
+_active = threading.Lock()
+
+
+def profile_dir() -> Path:
+    path = current_app.config.get("PROFILE_DIR")
+    return Path(path) if path else Path(current_app.instance_path) / "profiles"
+
+
+def sign(secret: str, path: str, expires: int) -> str:
+    """Header value that allows profiling `path` until the unix time `expires`"""
+    mac = hmac.new(
+        secret.encode("utf-8"), f"{expires}:{path}".encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+    return f"{expires}.{mac}"
+
+
+def _signed(secret: str, token: str) -> bool:
+    expires, _, _ = token.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(sign(secret, request.path, int(expires)), token)
+
+
+def _wanted() -> bool:
+    config = current_app.config
+    token = request.headers.get(PROFILE_HEADER)
+    if token and config.get("PROFILE_SECRET"):
+        return _signed(config["PROFILE_SECRET"], token)
+    rate = config.get("PROFILE_SAMPLE_RATE", 0)
+    return rate > 0 and random.random() < rate
+
+
+@bp.before_app_request
+def start_profile():
+    config = current_app.config
+    if not (config.get("PROFILE_SAMPLE_RATE") or config.get("PROFILE_SECRET")):
+        return
+    if request.endpoint in (None, "static") or not _wanted():
+        return
+
+    if not _active.acquire(blocking=False):
+        log.info("skipped profiling %s, another request is profiled", request.endpoint)
+        return
+
+    # Imported here so that workers which never profile do not pay for it
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler outside the app, coverage or a debugger
+        _active.release()
+        log.info("skipped profiling %s, another profiler is active", request.endpoint)
+        return
+    g.profile_started = time.perf_counter()
+    g.profiler = profiler
+
+
+@bp.after_app_request
+def finish_profile(response):
+    profiler = g.pop("profiler", None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    _active.release()
+
+    elapsed_ms = (time.perf_counter() - g.pop("profile_started")) * 1000
+    try:
+        path = save_profile(profiler, request.endpoint, elapsed_ms)
+    except OSError:
+        log.exception("could not write the profile of %s", request.endpoint)
+    else:
+        log.info("profiled %s in %.1f ms: %s", request.endpoint, elapsed_ms, path)
+    return response
+
+
+@bp.teardown_app_request
+def drop_profile(exc):
+    # The request failed before after_request ran
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        _active.release()
+
+
+def save_profile(profiler: cProfile.Profile, endpoint: str, elapsed_ms: float) -> Path:
+    root = profile_dir()
+    directory = root / endpoint
+    directory.mkdir(parents=True, exist_ok=True)
+
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    path = directory / f"{stamp}-{os.getpid()}-{next(_sequence)}-{elapsed_ms:.0f}ms.prof"
+    tmp = path.with_suffix(".tmp")
+    profiler.dump_stats(str(tmp))
+    os.replace(tmp, path)
+
+    rotate(root, current_app.config.get("PROFILE_MAX_BYTES", DEFAULT_MAX_BYTES))
+    return path
+
+
+def rotate(root: Path, max_bytes: int) -> int:
+    """Remove the oldest profiles until the directory fits in max_bytes"""
+    files = []
+    for path in root.glob("*/*.prof"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()
+
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def _function_name(key) -> str:
+    filename, line, name = key
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.relpath(filename)}:{line})"
+
+
+def hotspots(root: Path, endpoint: Optional[str] = None, top: int = 15, sort: str = "tottime") -> List[Dict]:
+    """Merge the profiles of every endpoint and list its top functions.
+
+    Times are averages per profiled request, in milliseconds.
+    """
+    import pstats
+
+    report = []
+    for directory in sorted(p for p in root.iterdir() if p.is_dir()):
+        if endpoint and directory.name != endpoint:
+            continue
+        files = sorted(str(p) for p in directory.glob("*.prof"))
+        if not files:
+            continue
+
+        stats = pstats.Stats(*files)
+        rows = []
+        for key, (_, calls, tottime, cumtime, _) in stats.stats.items():
+            rows.append({
+                "function": _function_name(key),
+                "calls": calls / len(files),
+                "tottime": tottime * 1000 / len(files),
+                "cumtime": cumtime * 1000 / len(files),
+            })
+        rows.sort(key=lambda r: r[sort], reverse=True)
+        report.append({
+            "endpoint": directory.name,
+            "profiles": len(files),
+            "total": stats.total_tt * 1000 / len(files),
+            "functions": rows[:top],
+        })
+    return report
@@ -1,5 +1,15 @@
 PRAGMA foreign_keys = ON;
+PRAGMA user_version = 0;
 
+DROP TABLE IF EXISTS id_blocks;
+DROP TABLE IF EXISTS user_shards;
+DROP VIEW IF EXISTS leaderboard_entries;
+DROP TABLE IF EXISTS leaderboard_totals;
+DROP TABLE IF EXISTS user_workout_versions;
+DROP TABLE IF EXISTS user_inbox;
+DROP TABLE IF EXISTS table_versions;
+DROP TABLE IF EXISTS user_type_totals;
+DROP TABLE IF EXISTS user_totals;
 DROP TABLE IF EXISTS messages;
 DROP TABLE IF EXISTS workout_categories;
 DROP TABLE IF EXISTS workouts;
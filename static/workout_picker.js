@@ -0,0 +1,46 @@
+// Fills the workout select on /messages from /workouts/suggest as the
+// user types, so the page itself never lists every workout.
+(function () {
+  var form = document.getElementById("workout-picker");
+  var input = document.getElementById("workout_query");
+  var select = document.getElementById("workout_id");
+  if (!form || !input || !select) {
+    return;
+  }
+
+  var timer = null;
+  var latest = 0;
+
+  function render(items) {
+    while (select.options.length > 1) {
+      select.remove(1);
+    }
+    items.forEach(function (w) {
+      var label = w.date + " – " + w.type + " (" + w.username + ")";
+      select.add(new Option(label, w.id));
+    });
+    select.selectedIndex = items.length ? 1 : 0;
+  }
+
+  function suggest() {
+    var request = ++latest;
+    var url = form.dataset.suggestUrl + "?q=" + encodeURIComponent(input.value.trim());
+    fetch(url, { credentials: "same-origin" })
+      .then(function (response) { return response.json(); })
+      .then(function (data) {
+        if (request === latest) {
+          render(data.items);
+        }
+      });
+  }
+
+  input.addEventListener("input", function () {
+    clearTimeout(timer);
+    timer = setTimeout(suggest, 200);
+  });
+
+  form.addEventListener("submit", function (event) {
+    event.preventDefault();
+    suggest();
+  });
+})();
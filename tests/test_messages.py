@@ -0,0 +1,141 @@
+import pytest
+
+from app import create_app
+from db.connection import close_pools, init_db
+from db.messages import get_unread_count, list_messages
+from db.migrations import migrate
+from db.search import rebuild_search_index
+from db.shards import reshard
+from db.users import add_user
+from db.workouts import save_workout
+from db.writer import close_writers
+
+
+@pytest.fixture(
+    params=[
+        {"shards": 0},
+        {"shards": 2},
+        {"shards": 0, "DB_WRITE_QUEUE": False},
+    ],
+    ids=["single", "sharded", "direct"],
+)
+def app(request, tmp_path):
+    config = dict(request.param)
+    shards = config.pop("shards")
+    app = create_app({
+        "TESTING": True,
+        "DATABASE": str(tmp_path / "test.sqlite3"),
+        "JINJA_CACHE_DIR": False,
+        **config,
+    })
+    with app.app_context():
+        init_db("schema.sql")
+        migrate()
+        rebuild_search_index()
+    with app.test_request_context(method="POST"):
+        for name in ("owner", "bert", "carl"):
+            add_user(name, "password123")
+        save_workout(1, "2026-01-01", "juoksu", 30, "Lenkki", [])
+
+    if shards:
+        # user_id % 2 puts the owner and bert into different shards
+        with app.app_context():
+            reshard(shards)
+        close_writers()
+        close_pools()
+        app.config["DB_SHARDS"] = shards
+
+    yield app
+    close_writers()
+    close_pools()
+
+
+def login(app, user_id, username):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = user_id
+        sess["username"] = username
+        sess["csrf_token"] = "token"
+    return client
+
+
+def send(client, content, **form):
+    return client.post(
+        "/message/add",
+        data={"csrf_token": "token", "workout_id": "1", "content": content, **form},
+    )
+
+
+def unread(app, user_id):
+    with app.app_context():
+        return get_unread_count(user_id)
+
+
+def test_owner_reply_reaches_commenter(app):
+    bert = login(app, 2, "bert")
+    owner = login(app, 1, "owner")
+
+    assert send(bert, "Hyvä treeni!").status_code == 302
+    assert send(owner, "Kiitos!").status_code == 302
+
+    # Replying marked bert's comment as read for the owner
+    assert unread(app, 1) == 0
+    assert unread(app, 2) == 1
+
+    thread = bert.get("/workout/1/messages").get_data(as_text=True)
+    assert "Hyvä treeni!" in thread
+    assert "Kiitos!" in thread
+    assert "Kiitos!" in bert.get("/messages").get_data(as_text=True)
+
+    response = bert.post("/workout/1/messages/read", data={"csrf_token": "token"})
+    assert response.status_code == 302
+    assert unread(app, 2) == 0
+
+
+def test_reading_does_not_mark_read(app):
+    bert = login(app, 2, "bert")
+    send(login(app, 1, "owner"), "Muistiinpano")
+    send(login(app, 3, "carl"), "Hyvä treeni!")
+    send(login(app, 1, "owner"), "Kiitos!")
+
+    for path in ("/messages", "/workout/1/messages"):
+        assert bert.get(path).status_code == 200
+        assert bert.head(path).status_code == 200
+    assert unread(app, 3) == 1
+
+    carl = login(app, 3, "carl")
+    with app.app_context():
+        ids = [str(m["id"]) for m in list_messages(3)["items"]]
+    # Ids of other users' messages are ignored
+    response = bert.post("/messages/read", data={"csrf_token": "token", "message_id": ids})
+    assert response.status_code == 302
+    assert unread(app, 3) == 1
+
+    assert "Merkitse luetuiksi (1)" in carl.get("/messages").get_data(as_text=True)
+    carl.post("/messages/read", data={"csrf_token": "token", "message_id": ids})
+    assert unread(app, 3) == 0
+
+
+def test_owner_picks_receiver_when_several_wrote(app):
+    owner = login(app, 1, "owner")
+    carl = login(app, 3, "carl")
+    send(login(app, 2, "bert"), "Hyvä treeni!")
+    send(carl, "Mikä vauhti?")
+
+    assert 'name="receiver_id"' in owner.get("/workout/1/messages").get_data(as_text=True)
+
+    response = send(owner, "Kenelle?")
+    assert response.status_code == 302
+    assert "Kenelle?" not in owner.get("/workout/1/messages").get_data(as_text=True)
+
+    assert send(owner, "Kiitos!", receiver_id="9").status_code == 400
+    assert send(owner, "Kiitos!", receiver_id="3").status_code == 302
+    assert "Kiitos!" in carl.get("/messages").get_data(as_text=True)
+
+
+def test_note_to_self_without_thread(app):
+    owner = login(app, 1, "owner")
+
+    assert send(owner, "Muistiinpano").status_code == 302
+    assert "Muistiinpano" in owner.get("/workout/1/messages").get_data(as_text=True)
+    assert unread(app, 1) == 0
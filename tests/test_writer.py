@@ -0,0 +1,177 @@
+import sqlite3
+import threading
+
+import pytest
+
+from app import create_app
+from db.writer import Writer, close_writers, get_writer
+
+
+class Crash(BaseException):
+    """Escapes the per-job error handling and kills the writer thread"""
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "writer.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x INTEGER PRIMARY KEY)")
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def writer(path):
+    writer = Writer(path)
+    yield writer
+    if writer.thread.is_alive():
+        writer.stop()
+
+
+def rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [r[0] for r in conn.execute("SELECT x FROM t ORDER BY x")]
+    finally:
+        conn.close()
+
+
+def insert(x):
+    return lambda db: db.execute("INSERT INTO t (x) VALUES (?)", (x,)).lastrowid
+
+
+def block(writer):
+    """Occupy the writer until the returned event is set"""
+    started, release = threading.Event(), threading.Event()
+
+    def job(db):
+        started.set()
+        release.wait(5)
+
+    thread = threading.Thread(target=writer.submit, args=(job,))
+    thread.start()
+    assert started.wait(5)
+    return release, thread
+
+
+def submit_in_thread(writer, fn, results, key, **kwargs):
+    def run():
+        try:
+            results[key] = writer.submit(fn, **kwargs)
+        except BaseException as e:
+            results[key] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_queued(writer, count):
+    for _ in range(500):
+        if writer.jobs.qsize() >= count:
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("jobs were not queued")
+
+
+def test_failing_job_rolls_back_only_itself(writer, path):
+    release, blocker = block(writer)
+
+    def fail(db):
+        db.execute("INSERT INTO t (x) VALUES (2)")
+        raise ValueError("bad row")
+
+    results = {}
+    threads = [
+        submit_in_thread(writer, insert(1), results, "first"),
+        submit_in_thread(writer, fail, results, "failing"),
+        submit_in_thread(writer, insert(3), results, "last"),
+    ]
+    wait_queued(writer, 3)
+    release.set()
+    for thread in (blocker, *threads):
+        thread.join(5)
+
+    assert results["first"] == 1
+    assert isinstance(results["failing"], ValueError)
+    assert results["last"] == 3
+    assert rows(path) == [1, 3]
+    # The blocker committed alone, the three others together
+    assert writer.commits == 2
+
+
+def test_timed_out_job_is_not_run(writer, path):
+    release, blocker = block(writer)
+
+    with pytest.raises(TimeoutError):
+        writer.submit(insert(1), timeout=0.05)
+    release.set()
+    blocker.join(5)
+
+    assert writer.submit(insert(2)) == 2
+    assert rows(path) == [2]
+
+
+def test_running_job_is_waited_for_after_timeout(writer, path):
+    started = threading.Event()
+
+    def slow(db):
+        started.set()
+        threading.Event().wait(0.2)
+        return insert(1)(db)
+
+    assert writer.submit(slow, timeout=0.05) == 1
+    assert started.is_set()
+    assert rows(path) == [1]
+
+
+def test_open_error_fails_the_batch_and_keeps_the_thread(tmp_path):
+    path = tmp_path / "missing" / "writer.sqlite3"
+    writer = Writer(str(path))
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            writer.submit(lambda db: None)
+        assert writer.thread.is_alive()
+
+        path.parent.mkdir()
+        writer.submit(lambda db: db.execute("CREATE TABLE t (x INTEGER PRIMARY KEY)"))
+        assert writer.submit(insert(1)) == 1
+    finally:
+        writer.stop()
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_dead_writer_is_replaced(path):
+    app = create_app({"TESTING": True, "DATABASE": path, "JINJA_CACHE_DIR": False})
+    with app.app_context():
+        writer = get_writer()
+        release, blocker = block(writer)
+
+        def crash(db):
+            raise Crash()
+
+        results = {}
+        threads = [
+            submit_in_thread(writer, crash, results, "crash"),
+            submit_in_thread(writer, insert(1), results, "same_batch"),
+        ]
+        wait_queued(writer, 2)
+        release.set()
+        for thread in (blocker, *threads):
+            thread.join(5)
+        writer.thread.join(5)
+
+        assert not writer.thread.is_alive()
+        # The dead thread's transaction is rolled back, not left holding the lock
+        conn = sqlite3.connect(path, timeout=0)
+        conn.execute("BEGIN IMMEDIATE")
+        conn.rollback()
+        conn.close()
+        assert isinstance(results["crash"], RuntimeError)
+        assert isinstance(results["same_batch"], RuntimeError)
+
+        replacement = get_writer()
+        assert replacement is not writer
+        assert replacement.submit(insert(2)) == 2
+        assert rows(path) == [2]
+    close_writers()
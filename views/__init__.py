@@ -0,0 +1,94 @@
+"""HTML views, one blueprint per area, and the helpers they share."""
+import hashlib
+import time
+from datetime import date, datetime, timezone
+from functools import wraps
+
+from flask import abort, current_app, flash, g, redirect, request, session, url_for
+
+from db.cache import last_changed, table_versions
+from db.categories import list_categories_for_workouts
+
+
+def validate_csrf():
+    if request.form.get("csrf_token") != session.get("csrf_token"):
+        abort(400)
+
+
+def login_required(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        if "user_id" not in session:
+            flash("Kirjaudu sisään ensin.", "error")
+            return redirect(url_for("auth.login"))
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def conditional(*tables, public=False, daily=False):
+    """Answer If-None-Match / If-Modified-Since before running the view.
+
+    The validator is built from the change counters of `tables`, the
+    URL and the session, so a 304 skips both the queries and the
+    template. Pages with pending flash messages are always rendered.
+    daily marks pages that also change when the date does.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            versions = table_versions()
+            if versions is None or session.get("_flashes"):
+                return fn(*args, **kwargs)
+
+            watched = tables
+            if "user_id" in session and "messages" not in watched:
+                # The unread counter in the navigation bar
+                watched = (*watched, "messages")
+
+            parts = [
+                request.full_path,
+                str(session.get("user_id")),
+                str(g.csrf_token),
+                *(f"{t}:{versions.get(t, 0)}" for t in watched),
+            ]
+            changed = max(last_changed(watched), session.get("since", 0))
+            if daily:
+                today = date.today()
+                parts.append(today.isoformat())
+                changed = max(changed, time.mktime(today.timetuple()))
+            etag = hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+            modified = datetime.fromtimestamp(changed, timezone.utc)
+
+            if public and "user_id" not in session:
+                cache_control = "public, max-age=0, must-revalidate"
+            else:
+                cache_control = "private, no-cache"
+
+            if request.if_none_match:
+                fresh = request.if_none_match.contains_weak(etag)
+            else:
+                since = request.if_modified_since
+                fresh = since is not None and modified.replace(microsecond=0) <= since
+
+            if fresh:
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(fn(*args, **kwargs))
+
+            response.set_etag(etag, weak=True)
+            if time.time() >= int(changed) + 1:
+                # Last-Modified has whole seconds, a write later in the
+                # same second would go unnoticed by If-Modified-Since
+                response.last_modified = modified
+            response.headers["Cache-Control"] = cache_control
+            return response
+        return wrapper
+    return decorator
+
+
+def with_categories(workouts):
+    workouts = [dict(w) for w in workouts]
+    categories = list_categories_for_workouts(w["id"] for w in workouts)
+    for w in workouts:
+        w["categories"] = categories.get(w["id"], [])
+    return workouts
@@ -0,0 +1,71 @@
+import time
+
+from flask import Blueprint, flash, redirect, render_template, request, session, url_for
+
+from db.shards import ensure_replicated
+from db.users import add_user, get_user, verify_password
+
+from . import validate_csrf
+
+bp = Blueprint("auth", __name__)
+
+
+@bp.route("/register", methods=["GET", "POST"])
+def register():
+    if request.method == "POST":
+        validate_csrf()
+
+        username = (request.form.get("username") or "").strip()
+        password = (request.form.get("password") or "").strip()
+        password2 = (request.form.get("password2") or "").strip()
+
+        if not (3 <= len(username) <= 30):
+            flash("Käyttäjätunnuksen pituus 3–30 merkkiä.", "error")
+            return render_template("register.html")
+
+        if not (8 <= len(password) <= 128):
+            flash("Salasanan pituus 8–128 merkkiä.", "error")
+            return render_template("register.html")
+
+        if password != password2:
+            flash("Salasanat eivät täsmää.", "error")
+            return render_template("register.html")
+
+        if get_user(username):
+            flash("Käyttäjätunnus on jo käytössä.", "error")
+            return render_template("register.html")
+
+        add_user(username, password)
+        flash("Tunnus luotu. Voit nyt kirjautua sisään.", "success")
+        return redirect(url_for("auth.login"))
+
+    return render_template("register.html")
+
+
+@bp.route("/login", methods=["GET", "POST"])
+def login():
+    if request.method == "POST":
+        validate_csrf()
+
+        username = (request.form.get("username") or "").strip()
+        password = (request.form.get("password") or "").strip()
+        user = get_user(username)
+
+        if user and verify_password(user, password):
+            ensure_replicated(user["id"], user["username"])
+            session["user_id"] = user["id"]
+            session["username"] = user["username"]
+            session["since"] = int(time.time())
+            flash(f"Tervetuloa, {user['username']}!", "success")
+            return redirect(url_for("workouts.index"))
+
+        flash("Virheellinen käyttäjätunnus tai salasana.", "error")
+
+    return render_template("login.html")
+
+
+@bp.route("/logout")
+def logout():
+    session.clear()
+    flash("Uloskirjautuminen onnistui.", "success")
+    return redirect(url_for("auth.login"))
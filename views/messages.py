@@ -0,0 +1,190 @@
+from flask import Blueprint, abort, flash, redirect, render_template, request, session, url_for
+
+from db.messages import (
+    add_message,
+    delete_message_by_id,
+    get_message,
+    get_workout_owner,
+    list_messages,
+    list_sent_messages,
+    list_thread,
+    mark_read,
+    mark_thread_read,
+    update_message,
+)
+from db.pagination import MAX_PAGE_SIZE, page_size
+from db.users import get_user_by_id
+from db.workouts import get_workout, suggest_workouts
+
+from . import conditional, login_required, validate_csrf
+
+bp = Blueprint("messages", __name__)
+
+
+@bp.route("/messages", defaults={"box": "inbox"}, endpoint="inbox")
+@bp.route("/messages/sent", defaults={"box": "sent"}, endpoint="sent")
+@login_required
+@conditional("users", "workouts", "messages")
+def mailbox(box):
+    # Without JavaScript the picker submits its query here instead
+    workout_query = (request.args.get("workout_query") or "").strip()
+    workouts = suggest_workouts(workout_query) if workout_query else []
+
+    list_box = list_messages if box == "inbox" else list_sent_messages
+    page = list_box(
+        session["user_id"],
+        request.args.get("cursor"),
+        page_size(request.args.get("limit")),
+    )
+    return render_template(
+        "messages.html",
+        box=box,
+        workouts=workouts,
+        workout_query=workout_query,
+        messages=page["items"],
+        page=page,
+    )
+
+
+@bp.route("/workout/<int:workout_id>/messages")
+@login_required
+@conditional("users", "workouts", "messages")
+def thread(workout_id):
+    workout = get_workout(workout_id)
+    if not workout:
+        abort(404)
+
+    messages = list_thread(workout_id, session["user_id"], workout["user_id"])
+
+    # The owner sees the whole thread and picks whom to answer
+    participants = {}
+    if workout["user_id"] == session["user_id"]:
+        participants = thread_participants(messages, workout["user_id"])
+
+    return render_template(
+        "thread.html",
+        workout=workout,
+        owner=get_user_by_id(workout["user_id"]),
+        messages=messages,
+        participants=participants,
+    )
+
+
+def thread_participants(messages, owner_id):
+    """Users other than the owner in the thread, by id"""
+    participants = {}
+    for m in messages:
+        participants[m["sender_id"]] = m["sender"]
+        participants[m["receiver_id"]] = m["receiver"]
+    participants.pop(owner_id, None)
+    return participants
+
+
+@bp.route("/message/add", methods=["POST"])
+@login_required
+def add():
+    validate_csrf()
+
+    workout_id = request.form.get("workout_id")
+    content = (request.form.get("content") or "").strip()
+
+    if not workout_id or not workout_id.isdigit() or not content:
+        abort(400)
+
+    owner_row = get_workout_owner(int(workout_id))
+    if not owner_row:
+        abort(400)
+
+    owner_id = owner_row["user_id"]
+    receiver_id = owner_id
+
+    if session["user_id"] == owner_id:
+        # The owner answers somebody in the thread, or writes a note
+        # to themselves when nobody has written yet
+        participants = thread_participants(
+            list_thread(int(workout_id), owner_id, owner_id), owner_id
+        )
+        posted = request.form.get("receiver_id")
+        if posted:
+            if not posted.isdigit() or int(posted) not in participants:
+                abort(400)
+            receiver_id = int(posted)
+        elif len(participants) == 1:
+            receiver_id = next(iter(participants))
+        elif participants:
+            flash("Valitse vastaanottaja.", "error")
+            return redirect(url_for("messages.thread", workout_id=int(workout_id)))
+
+    add_message(
+        session["user_id"],
+        receiver_id,
+        int(workout_id),
+        content,
+        owner_id,
+    )
+    # Answering a thread means having read it
+    mark_thread_read(session["user_id"], int(workout_id), owner_id)
+
+    flash("Viesti lisätty.", "success")
+    return redirect(url_for("messages.thread", workout_id=int(workout_id)))
+
+
+@bp.route("/messages/read", methods=["POST"], endpoint="mark_read")
+@login_required
+def mark_inbox_read():
+    validate_csrf()
+
+    ids = [int(x) for x in request.form.getlist("message_id") if x.isdigit()]
+    mark_read(session["user_id"], ids[:MAX_PAGE_SIZE])
+
+    cursor = request.form.get("cursor")
+    return redirect(url_for("messages.inbox", cursor=cursor or None))
+
+
+@bp.route("/workout/<int:workout_id>/messages/read", methods=["POST"])
+@login_required
+def mark_thread(workout_id):
+    validate_csrf()
+
+    owner_row = get_workout_owner(workout_id)
+    if not owner_row:
+        abort(404)
+
+    mark_thread_read(session["user_id"], workout_id, owner_row["user_id"])
+    return redirect(url_for("messages.thread", workout_id=workout_id))
+
+
+@bp.route("/message/<int:message_id>/edit", methods=["GET", "POST"])
+@login_required
+def edit(message_id):
+    message = get_message(message_id)
+
+    if not message or message["sender_id"] != session["user_id"]:
+        abort(403)
+
+    if request.method == "POST":
+        validate_csrf()
+        content = (request.form.get("content") or "").strip()
+
+        if not content:
+            abort(400)
+
+        update_message(message_id, content, message["workout_owner_id"])
+        flash("Viesti päivitetty.", "success")
+        return redirect(url_for("messages.inbox"))
+
+    return render_template("edit_message.html", message=message)
+
+
+@bp.route("/message/<int:message_id>/delete", methods=["POST"])
+@login_required
+def delete(message_id):
+    validate_csrf()
+
+    message = get_message(message_id)
+    if not message or message["sender_id"] != session["user_id"]:
+        abort(403)
+
+    delete_message_by_id(message_id, message["workout_owner_id"])
+    flash("Viesti poistettu.", "success")
+    return redirect(url_for("messages.inbox"))
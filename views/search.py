@@ -0,0 +1,42 @@
+from flask import Blueprint, jsonify, render_template, request
+
+from db.pagination import page_size
+from db.workouts import SUGGEST_LIMIT, search_workouts, suggest_workouts
+
+from . import login_required, with_categories
+
+bp = Blueprint("search", __name__)
+
+
+@bp.route("/search")
+@login_required
+def search():
+    query = (request.args.get("query") or "").strip()
+    results = []
+
+    if query:
+        rows = search_workouts(query)
+        results = [
+            {
+                "id": r["id"],
+                "date": r["date"],
+                "type": r["type"],
+                "duration": r["duration"],
+                "description": r["description"],
+                "username": r["username"],
+            }
+            for r in rows
+        ]
+        results = with_categories(results)
+
+    return render_template("search.html", results=results, query=query)
+
+
+@bp.route("/workouts/suggest")
+@login_required
+def suggest():
+    workouts = suggest_workouts(
+        request.args.get("q") or "",
+        page_size(request.args.get("limit"), SUGGEST_LIMIT),
+    )
+    return jsonify({"items": workouts})
@@ -0,0 +1,327 @@
+import io
+import sqlite3
+
+from flask import (
+    Blueprint, Response, abort, flash, redirect, render_template,
+    request, session, stream_with_context, url_for
+)
+
+from db.categories import list_categories, list_workout_categories
+from db.leaderboard import (
+    LEADERBOARD_LIMIT,
+    MAX_OFFSET,
+    METRICS,
+    PERIODS,
+    bucket_label,
+    current_bucket,
+    get_leaderboard,
+    shift_bucket,
+)
+from db.pagination import page_size
+from db.users import get_user_by_id
+from db.workouts import (
+    delete_workout_by_id,
+    get_user_stats,
+    get_user_stats_by_type,
+    get_workout,
+    list_all_workouts,
+    list_workouts,
+    list_workouts_by_user,
+    save_workout,
+)
+from analytics import training_load
+from exporter import FORMATS as EXPORT_FORMATS, export_user
+from forms import parse_date_range, validate_workout_form
+from importer import detect_format, import_workouts as import_records, iter_records
+
+from . import conditional, login_required, validate_csrf, with_categories
+
+bp = Blueprint("workouts", __name__)
+
+
+@bp.route("/")
+@login_required
+def index():
+    date_from, date_to = parse_date_range(request.args)
+    workouts = with_categories(list_workouts(session["user_id"], date_from, date_to))
+    return render_template("index.html", workouts=workouts)
+
+
+@bp.route("/profile")
+@login_required
+@conditional("users", "workouts", "workout_categories", daily=True)
+def profile():
+    date_from, date_to = parse_date_range(request.args)
+    user = get_user_by_id(session["user_id"])
+    stats = get_user_stats(session["user_id"], date_from, date_to)
+    stats_by_type = get_user_stats_by_type(session["user_id"], date_from, date_to)
+    load = training_load(session["user_id"])
+    workouts = with_categories(list_workouts(session["user_id"], date_from, date_to))
+
+    return render_template(
+        "user.html",
+        user=user,
+        stats=stats,
+        stats_by_type=stats_by_type,
+        load=load,
+        workouts=workouts,
+    )
+
+
+@bp.route("/workout/add", methods=["GET", "POST"])
+@login_required
+def add():
+    if request.method == "POST":
+        validate_csrf()
+
+        selected_ids = [
+            int(x) for x in request.form.getlist("categories")
+            if x.isdigit()
+        ]
+
+        data, errors = validate_workout_form(request.form)
+
+        if errors:
+            for e in errors:
+                flash(e, "error")
+            return render_template(
+                "workout_form.html",
+                form=data,
+                categories=list_categories(),
+                selected=set(selected_ids),
+            )
+
+        try:
+            save_workout(
+                session["user_id"],
+                data["date"],
+                data["type"],
+                data["duration_val"],
+                data["description"] or None,
+                selected_ids,
+            )
+        except sqlite3.IntegrityError:
+            abort(403)
+
+        flash("Treeni lisätty.", "success")
+        return redirect(url_for("workouts.index"))
+
+    return render_template(
+        "workout_form.html",
+        form={"date": "", "type": "", "duration": "", "description": ""},
+        categories=list_categories(),
+        selected=set(),
+    )
+
+
+@bp.route("/workout/import", methods=["GET", "POST"])
+@login_required
+def import_workouts():
+    if request.method == "POST":
+        validate_csrf()
+
+        upload = request.files.get("file")
+        fmt = detect_format(upload.filename) if upload else None
+        if not fmt:
+            flash("Valitse CSV- tai NDJSON-tiedosto.", "error")
+            return render_template("import.html")
+
+        errors = []
+
+        def on_error(line_no, messages):
+            if len(errors) < 20:
+                errors.append(f"Rivi {line_no}: {' '.join(messages)}")
+
+        stream = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+        imported, rejected = import_records(
+            session["user_id"], iter_records(stream, fmt), on_error=on_error
+        )
+
+        for e in errors:
+            flash(e, "error")
+        flash(f"Tuotiin {imported} treeniä, hylättiin {rejected}.", "success")
+        return redirect(url_for("workouts.index"))
+
+    return render_template("import.html")
+
+
+@bp.route("/workout/<int:workout_id>/edit", methods=["GET", "POST"])
+@login_required
+def edit(workout_id):
+    workout = get_workout(workout_id)
+
+    if not workout or workout["user_id"] != session["user_id"]:
+        abort(403)
+
+    if request.method == "POST":
+        validate_csrf()
+
+        selected_ids = [
+            int(x) for x in request.form.getlist("categories")
+            if x.isdigit()
+        ]
+
+        data, errors = validate_workout_form(request.form)
+
+        if errors:
+            for e in errors:
+                flash(e, "error")
+            return render_template(
+                "workout_form.html",
+                form=data,
+                categories=list_categories(),
+                selected=set(selected_ids),
+            )
+
+        try:
+            saved = save_workout(
+                session["user_id"],
+                data["date"],
+                data["type"],
+                data["duration_val"],
+                data["description"] or None,
+                selected_ids,
+                workout_id=workout_id,
+            )
+        except sqlite3.IntegrityError:
+            abort(403)
+        if saved is None:
+            abort(403)
+
+        flash("Treeni päivitetty.", "success")
+        return redirect(url_for("workouts.profile"))
+
+    return render_template(
+        "workout_form.html",
+        form={
+            "date": workout["date"],
+            "type": workout["type"],
+            "duration": workout["duration"],
+            "description": workout["description"] or "",
+        },
+        categories=list_categories(),
+        selected={
+            c["id"] for c in list_workout_categories(workout_id, workout["user_id"])
+        },
+    )
+
+
+@bp.route("/workout/<int:workout_id>/delete", methods=["POST"])
+@login_required
+def delete(workout_id):
+    validate_csrf()
+
+    success = delete_workout_by_id(workout_id, session["user_id"])
+
+    if not success:
+        abort(403)
+
+    flash("Treeni poistettu.", "success")
+    return redirect(url_for("workouts.profile"))
+
+
+@bp.route("/users/<int:user_id>")
+@conditional("users", "workouts", public=True)
+def user_profile(user_id):
+    user = get_user_by_id(user_id)
+
+    if not user:
+        abort(404)
+
+    date_from, date_to = parse_date_range(request.args)
+    page = list_workouts_by_user(
+        user_id,
+        request.args.get("cursor"),
+        page_size(request.args.get("limit")),
+        date_from=date_from,
+        date_to=date_to,
+    )
+
+    return render_template(
+        "user_profile.html",
+        user=user,
+        workouts=page["items"],
+        page=page,
+    )
+
+
+@bp.route("/workouts")
+@login_required
+@conditional("users", "workouts", "workout_categories")
+def all_workouts():
+    date_from, date_to = parse_date_range(request.args)
+    page = list_all_workouts(
+        request.args.get("cursor"),
+        page_size(request.args.get("limit")),
+        date_from=date_from,
+        date_to=date_to,
+    )
+    rows = page["items"]
+
+    items = [
+    {
+        "id": r["id"],
+        "date": r["date"],
+        "type": r["type"],
+        "duration": r["duration"],
+        "description": r["description"],
+        "username": r["username"],
+        "user_id": r["user_id"],
+    }
+    for r in rows
+]
+    return render_template(
+        "workouts_all.html",
+        workouts=with_categories(items),
+        page=page,
+    )
+
+
+@bp.route("/export.<fmt>")
+@login_required
+def export(fmt):
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+
+    compress = "gzip" in request.headers.get("Accept-Encoding", "")
+    headers = {
+        "Content-Disposition": f"attachment; filename=treenit.{fmt}",
+        "Vary": "Accept-Encoding",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    return Response(
+        stream_with_context(export_user(session["user_id"], fmt, compress)),
+        mimetype=mimetype,
+        headers=headers,
+    )
+
+
+@bp.route("/leaderboard")
+@conditional("users", "workouts", "workout_categories", public=True, daily=True)
+def leaderboard():
+    period = request.args.get("period", "week")
+    if period not in PERIODS:
+        period = "week"
+    metric = request.args.get("metric", "minutes")
+    if metric not in METRICS:
+        metric = "minutes"
+    category_id = request.args.get("category", type=int, default=0)
+
+    bucket = current_bucket(period)
+    offset = max(min(request.args.get("offset", type=int, default=0), 0), -MAX_OFFSET)
+    if offset:
+        bucket = shift_bucket(period, bucket, offset)
+
+    return render_template(
+        "leaderboard.html",
+        period=period,
+        metric=metric,
+        category_id=category_id,
+        offset=offset,
+        label=bucket_label(period, bucket),
+        categories=list_categories(),
+        rows=get_leaderboard(period, bucket, metric, category_id, LEADERBOARD_LIMIT),
+    )
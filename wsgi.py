@@ -0,0 +1,10 @@
+"""WSGI entry point: gunicorn --preload -w 4 wsgi:app
+
+The app is built and warmed up in the master process, and the workers
+share the compiled templates and imported modules copy-on-write.
+Database connections are opened per worker on first use.
+"""
+from app import create_app, warm_up
+
+app = create_app()
+warm_up(app)